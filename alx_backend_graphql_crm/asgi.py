@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "alx_backend_graphql_crm.settings")
+# ASGI workers serve GraphQL through the async view
+os.environ.setdefault("GRAPHQL_ASYNC", "1")
 
 application = get_asgi_application()
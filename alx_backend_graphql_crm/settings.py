@@ -2,6 +2,7 @@
 Django settings for alx_backend_graphql_crm project.
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -67,13 +68,75 @@ TEMPLATES = [
 WSGI_APPLICATION = "alx_backend_graphql_crm.wsgi.application"
 
 # Database
+# SQLite tuning applied to every connection by crm.sqlite: "performance" (WAL,
+# synchronous=NORMAL, mmap and a larger page cache, persistent connections and
+# mutations funnelled through one writer thread) or "default" (SQLite's own)
+CRM_SQLITE_PROFILE = os.environ.get("CRM_SQLITE_PROFILE", "default")
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Keep connections, with their page cache and mmap, across requests
+        "CONN_MAX_AGE": 600 if CRM_SQLITE_PROFILE == "performance" else 0,
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+CRM_SQLITE = {
+    "PROFILE": CRM_SQLITE_PROFILE,
+    "PRAGMAS": {},
+    "WRITE_TIMEOUT": 30,
+}
+
+# Read replicas. CRM_READ_REPLICAS=N adds N local SQLite copies of the
+# database standing in for replicas: GraphQL queries read from them (see
+# crm.routers) and crm.replication copies the primary into them.
+CRM_READ_REPLICAS = int(os.environ.get("CRM_READ_REPLICAS", "0"))
+REPLICA_ALIASES = [f"replica{index}" for index in range(1, CRM_READ_REPLICAS + 1)]
+DATABASES.update(
+    {
+        alias: {
+            **DATABASES["default"],
+            "NAME": BASE_DIR / f"db.{alias}.sqlite3",
+            # Tests read through the primary's test database
+            "TEST": {"MIRROR": "default"},
+        }
+        for alias in REPLICA_ALIASES
+    }
+)
+
+# Order shards. CRM_ORDER_SHARDS=N spreads orders and their line items over N
+# local SQLite files by customer (see crm.sharding); customers and products
+# are copied into every shard. Create each with migrate --database ordersK.
+CRM_ORDER_SHARDS = int(os.environ.get("CRM_ORDER_SHARDS", "0"))
+ORDER_SHARD_ALIASES = [f"orders{index}" for index in range(CRM_ORDER_SHARDS)]
+DATABASES.update(
+    {
+        alias: {**DATABASES["default"], "NAME": BASE_DIR / f"db.{alias}.sqlite3"}
+        for alias in ORDER_SHARD_ALIASES
+    }
+)
+
+DATABASE_ROUTERS = ["crm.routers.ShardRouter", "crm.routers.ReplicaRouter"]
+
+# Clients read from the primary for PIN_SECONDS after a mutation so they see
+# their own writes; the stand-in copies the primary into the replicas at most
+# every STAND_IN_INTERVAL seconds (None when replicas are real).
+CRM_REPLICAS = {
+    "PRIMARY": "default",
+    "READ_ALIASES": REPLICA_ALIASES,
+    "PIN_SECONDS": 5,
+    "PIN_COOKIE": "crm_primary_until",
+    "STAND_IN_INTERVAL": 1.0,
+}
+
+# Order ids of shard k start above k * ID_SPAN, so an id names its shard
+CRM_SHARDING = {
+    "ALIASES": ORDER_SHARD_ALIASES,
+    "ID_SPAN": 10**12,
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -103,4 +166,117 @@ STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # GraphQL Configuration
-GRAPHENE = {"SCHEMA": "alx_backend_graphql_crm.schema.schema"}
+GRAPHENE = {
+    "SCHEMA": "alx_backend_graphql_crm.schema.schema",
+    # Largest first/last accepted by any connection field
+    "RELAY_CONNECTION_MAX_LIMIT": 1000,
+}
+
+# Maximum number of parsed and validated documents kept by the GraphQL view
+GRAPHQL_DOCUMENT_CACHE_SIZE = 256
+
+# Automatic persisted queries (Apollo APQ). BACKEND may be the in-memory,
+# Django cache or database registry from crm.persisted_queries; the in-memory
+# one keeps the max_size most recently used documents. STRICT only executes
+# registered documents; GET_MAX_AGE marks hash-only GET responses as publicly
+# cacheable for that many seconds.
+GRAPHQL_PERSISTED_QUERIES = {
+    "BACKEND": "crm.persisted_queries.InMemoryPersistedQueryRegistry",
+    "OPTIONS": {"max_size": 1000},
+    "STRICT": False,
+    "GET_MAX_AGE": 0,
+}
+
+# Per-operation budget checked before execution. Connection fields multiply
+# the cost of their selection by first/last (or DEFAULT_PAGE_SIZE, which is
+# also applied when neither is given). FIELD_WEIGHTS maps "Type.field" to a
+# weight overriding SCALAR_COST/OBJECT_COST.
+GRAPHQL_QUERY_COST = {
+    "MAX_DEPTH": 10,
+    "MAX_COST": 50000,
+    "DEFAULT_PAGE_SIZE": 100,
+    "SCALAR_COST": 0,
+    "OBJECT_COST": 1,
+    "FIELD_WEIGHTS": {},
+}
+
+# Serve /graphql with the async view (set by asgi.py for uvicorn workers):
+# queries resolve on the event loop and independent root fields overlap.
+GRAPHQL_ASYNC = os.environ.get("GRAPHQL_ASYNC", "0") == "1"
+
+# Batched operations: a JSON array POSTed to /graphql runs every operation with
+# one shared loader cache. Consecutive queries run in parallel; mutations run
+# alone, in order.
+GRAPHQL_BATCH = {
+    "MAX_SIZE": 10,
+    "MAX_WORKERS": 4,
+}
+
+# Streaming exports at /export/<customers|products|orders>
+CRM_EXPORT = {
+    "CHUNK_SIZE": 2000,
+    "FLUSH_SIZE": 64 * 1024,
+}
+
+# Response cache for queries, stored in the Django cache and tagged with the
+# models each response read; saves, deletes and set-based writes of those
+# models invalidate the matching responses. Use a shared CACHE_ALIAS (Redis,
+# Memcached) when running several workers. Stats via
+# crm.response_cache.response_cache.stats().
+GRAPHQL_RESPONSE_CACHE = {
+    "ENABLED": False,
+    "CACHE_ALIAS": "default",
+    "KEY_PREFIX": "gqlrc",
+    "TIMEOUT": 300,
+    "SCOPE": "crm.response_cache.user_scope",
+}
+
+# Resolver tracing. Requests sending HEADER get Apollo-tracing timings, SQL
+# counts and result sizes per resolver in extensions.tracing (only when
+# EXTENSIONS is on); METRICS aggregates object and list fields into the
+# histograms served at /metrics. With both off, no tracing middleware runs.
+GRAPHQL_TRACING = {
+    "HEADER": "X-GraphQL-Tracing",
+    "EXTENSIONS": DEBUG,
+    "METRICS": False,
+}
+
+# Slow-operation log: operations running for THRESHOLD_MS or longer are
+# written with their document, redacted variables, SQL statements and, with
+# EXPLAIN, query plans to the "crm.slow_operations" logger (see LOGGING).
+# None, the default, disables it.
+GRAPHQL_SLOW_LOG = {
+    "THRESHOLD_MS": None,
+    "REDACT_VARIABLES": "crm.slow_log.redact_variables",
+    "EXPLAIN": False,
+    "MAX_QUERIES": 100,
+    "LOG_SQL_PARAMS": False,
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "crm.slow_log.JSONFormatter"},
+    },
+    "handlers": {
+        "slow_operations": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": os.environ.get(
+                "GRAPHQL_SLOW_LOG_FILE", "/tmp/crm_slow_operations.log"
+            ),
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "formatter": "json",
+            # Don't create the file until something is slow
+            "delay": True,
+        },
+    },
+    "loggers": {
+        "crm.slow_operations": {
+            "handlers": ["slow_operations"],
+            "level": "WARNING",
+            "propagate": False,
+        },
+    },
+}
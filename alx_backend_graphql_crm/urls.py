@@ -1,7 +1,22 @@
+from django.conf import settings
 from django.urls import path
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 
+from crm.views import (
+    AsyncCRMGraphQLView,
+    AsyncExportView,
+    CRMGraphQLView,
+    ExportView,
+    metrics_view,
+)
+
+# Settings modules that predate the async views serve the sync ones
+graphql_async = getattr(settings, "GRAPHQL_ASYNC", False)
+graphql_view = AsyncCRMGraphQLView if graphql_async else CRMGraphQLView
+export_view = AsyncExportView if graphql_async else ExportView
+
 urlpatterns = [
-   path("graphql", csrf_exempt(GraphQLView.as_view(graphiql=True))),
-]
\ No newline at end of file
+   path("graphql", csrf_exempt(graphql_view.as_view(graphiql=True))),
+   path("export/<str:resource>", export_view.as_view()),
+   path("metrics", metrics_view),
+]
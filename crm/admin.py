@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Customer, Product, Order
+from .models import Customer, Product, Order, OrderItem, PersistedQuery
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ('name', 'email', 'phone', 'created_at')
@@ -17,11 +17,28 @@ class ProductAdmin(admin.ModelAdmin):
     list_editable = ('price', 'stock')
 
 
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 1
+    autocomplete_fields = ('product',)
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'customer', 'total_amount', 'order_date')
     list_filter = ('order_date',)
     search_fields = ('customer__name', 'customer__email')
     ordering = ('-order_date',)
-    filter_horizontal = ('products',)
-    readonly_fields = ('total_amount',)
\ No newline at end of file
+    inlines = (OrderItemInline,)
+    readonly_fields = ('total_amount',)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.update_total()
+
+
+@admin.register(PersistedQuery)
+class PersistedQueryAdmin(admin.ModelAdmin):
+    list_display = ('sha256_hash', 'created_at')
+    search_fields = ('sha256_hash', 'query')
+    readonly_fields = ('created_at',)
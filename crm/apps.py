@@ -4,4 +4,46 @@ from django.apps import AppConfig
 class CrmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm'
-    verbose_name = 'Customer Relationship Management'
\ No newline at end of file
+    verbose_name = 'Customer Relationship Management'
+
+    def ready(self):
+        from django.core import checks
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import (
+            m2m_changed,
+            post_delete,
+            post_migrate,
+            post_save,
+        )
+
+        from .models import Customer, Order, OrderItem, Product
+        from .persisted_queries import check_strict_registry
+        from .response_cache import invalidate_instance, invalidate_relation
+        from .sharding import replicate_instance, seed_shard_sequences
+        from .slow_log import install_query_capture
+        from .sqlite import apply_journal_mode, apply_pragmas
+        from .tracing import install_query_recorder
+
+        # Cached GraphQL responses are tagged with the models they read
+        for model in (Customer, Product, Order, OrderItem):
+            post_save.connect(invalidate_instance, sender=model)
+            post_delete.connect(invalidate_instance, sender=model)
+        m2m_changed.connect(invalidate_relation, sender=Order.products.through)
+
+        # Order shards keep copies of customers and products, and allocate
+        # order ids in their own range
+        for model in (Customer, Product):
+            post_save.connect(replicate_instance, sender=model)
+            post_delete.connect(replicate_instance, sender=model)
+        post_migrate.connect(seed_shard_sequences, sender=self)
+
+        # Synchronous and cache PRAGMAs of the CRM_SQLITE profile, and its
+        # journal mode, which lives in the database file, once per migrate
+        connection_created.connect(apply_pragmas)
+        post_migrate.connect(apply_journal_mode, sender=self)
+        # Charge SQL to the resolver that issued it when tracing
+        connection_created.connect(install_query_recorder)
+        # Record statements of operations timed for the slow-operation log
+        connection_created.connect(install_query_capture)
+        # STRICT persisted queries need a registry filled outside requests
+        checks.register(check_strict_registry)
@@ -0,0 +1,39 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+
+def is_running_async():
+    """Whether the caller runs on an event loop, i.e. under the async GraphQL view"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def run_in_worker(func, *args, **kwargs):
+    """Await blocking ORM work on a pooled worker thread
+
+    Django's async ORM methods share one thread per request, so they never
+    overlap; a worker thread with its own connection lets independent fields
+    of the same document query concurrently.
+    """
+
+    def run():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Honour CONN_MAX_AGE for the worker thread's own connection
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+async def aget_or_none(queryset, **lookups):
+    """Async ORM get that returns None instead of raising DoesNotExist"""
+    try:
+        return await queryset.aget(**lookups)
+    except queryset.model.DoesNotExist:
+        return None
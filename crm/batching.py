@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from graphql import OperationType
+
+DEFAULT_SETTINGS = {
+    # Most operations accepted in one batched request; 0 disables batching
+    "MAX_SIZE": 10,
+    # Threads running consecutive read operations of a batch in parallel
+    "MAX_WORKERS": 4,
+}
+
+
+def get_batch_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "GRAPHQL_BATCH", {})}
+
+
+class BatchEntry:
+    """One operation of a batched request and its result"""
+
+    def __init__(self, id=None):
+        self.id = id
+        self.document = None
+        self.operation_ast = None
+        self.variables = None
+        self.operation_name = None
+        self.cost = None
+        # ExecutionResult, set early when validation or costing failed
+        self.result = None
+        # HttpError or PersistedQueryError raised while reading the entry
+        self.error = None
+
+    @property
+    def runnable(self):
+        return self.document is not None and self.error is None
+
+    @property
+    def is_read(self):
+        return (
+            self.operation_ast is not None
+            and self.operation_ast.operation == OperationType.QUERY
+        )
+
+
+def split_batch(entries):
+    """Group runnable entries into steps, keeping consecutive reads together
+
+    Reads in the same step may run in parallel; a write always runs alone so
+    later operations observe its effects.
+    """
+    steps = []
+    for entry in entries:
+        if not entry.runnable:
+            continue
+        if entry.is_read and steps and steps[-1][0].is_read:
+            steps[-1].append(entry)
+        else:
+            steps.append([entry])
+    return steps
+
+
+def run_parallel(calls, max_workers):
+    """Run zero-argument callables on a thread pool and return their results"""
+    if len(calls) <= 1 or max_workers <= 1:
+        return [call() for call in calls]
+
+    def run(call):
+        try:
+            return call()
+        finally:
+            # Pool threads open their own connections; don't leak them
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as executor:
+        return list(executor.map(run, calls))
@@ -0,0 +1,183 @@
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLInt,
+    InlineFragmentNode,
+    get_named_type,
+    is_composite_type,
+    value_from_ast,
+)
+
+DEFAULT_SETTINGS = {
+    "MAX_DEPTH": 10,
+    "MAX_COST": 50000,
+    "DEFAULT_PAGE_SIZE": 100,
+    # Falls back to graphene's RELAY_CONNECTION_MAX_LIMIT
+    "MAX_PAGE_SIZE": None,
+    "SCALAR_COST": 0,
+    "OBJECT_COST": 1,
+    # "TypeName.fieldName" -> weight, overriding the defaults above
+    "FIELD_WEIGHTS": {},
+}
+
+
+def get_query_cost_settings():
+    config = {**DEFAULT_SETTINGS, **getattr(settings, "GRAPHQL_QUERY_COST", {})}
+    if config["MAX_PAGE_SIZE"] is None:
+        config["MAX_PAGE_SIZE"] = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    return config
+
+
+class QueryCostError(GraphQLError):
+    """Operation rejected before execution for exceeding a query budget"""
+
+    def __init__(self, message, code, node=None, **details):
+        super().__init__(message, nodes=node, extensions={"code": code, **details})
+
+
+class QueryCost:
+    """Computes the cost and depth of an operation, raising QueryCostError over budget"""
+
+    def __init__(self, schema, document, variables=None, config=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.config = config or get_query_cost_settings()
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+
+    def analyze(self, operation):
+        """Return (cost, depth) for an operation definition"""
+        root_type = self.schema.get_root_type(operation.operation)
+        cost, depth = self._selection_set(root_type, operation.selection_set, 0)
+
+        if depth > self.config["MAX_DEPTH"]:
+            raise QueryCostError(
+                f"Query depth {depth} exceeds the maximum of {self.config['MAX_DEPTH']}",
+                "QUERY_TOO_DEEP",
+                depth=depth,
+                maxDepth=self.config["MAX_DEPTH"],
+            )
+        if cost > self.config["MAX_COST"]:
+            raise QueryCostError(
+                f"Query cost {cost} exceeds the maximum of {self.config['MAX_COST']}",
+                "QUERY_TOO_COSTLY",
+                cost=cost,
+                maxCost=self.config["MAX_COST"],
+            )
+        return cost, depth
+
+    def _selection_set(self, parent_type, selection_set, depth):
+        cost = 0
+        max_depth = depth
+        for field_type, node in self._fields(parent_type, selection_set):
+            field_cost, field_depth = self._field(field_type, node, depth)
+            cost += field_cost
+            max_depth = max(max_depth, field_depth)
+        return cost, max_depth
+
+    def _fields(self, parent_type, selection_set):
+        """Yield (parent type, field node) pairs, expanding fragments"""
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield parent_type, selection
+                continue
+
+            if isinstance(selection, FragmentSpreadNode):
+                fragment = self.fragments.get(selection.name.value)
+                if fragment is None:
+                    continue
+            elif isinstance(selection, InlineFragmentNode):
+                fragment = selection
+            else:
+                continue
+
+            fragment_type = parent_type
+            if fragment.type_condition is not None:
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+            yield from self._fields(fragment_type, fragment.selection_set)
+
+    def _field(self, parent_type, node, depth):
+        name = node.name.value
+        # Introspection is bounded by the schema itself
+        if name.startswith("__"):
+            return 0, depth
+
+        field = getattr(parent_type, "fields", {}).get(name)
+        if field is None:
+            return 0, depth
+        field_type = get_named_type(field.type)
+
+        structural = _is_connection_wrapper(parent_type)
+        if not structural:
+            depth += 1
+
+        default_weight = (
+            0
+            if structural
+            else self.config["OBJECT_COST"]
+            if is_composite_type(field_type)
+            else self.config["SCALAR_COST"]
+        )
+        weight = self.config["FIELD_WEIGHTS"].get(
+            f"{parent_type.name}.{name}", default_weight
+        )
+
+        if node.selection_set is None:
+            return weight, depth
+
+        child_cost, child_depth = self._selection_set(
+            field_type, node.selection_set, depth
+        )
+        if _is_connection(field_type):
+            child_cost *= self._page_size(field, node)
+        return weight + child_cost, child_depth
+
+    def _page_size(self, field, node):
+        """Number of rows a connection field may return for the given arguments
+
+        Nested connections also load no more than this per parent (see
+        crm.loaders.PageWindow), so the cost follows the rows fetched.
+        """
+        arguments = {argument.name.value: argument for argument in node.arguments}
+        sizes = []
+        for name in ("first", "last"):
+            argument = arguments.get(name)
+            if argument is None or name not in field.args:
+                continue
+            value = value_from_ast(argument.value, GraphQLInt, self.variables)
+            if isinstance(value, int):
+                sizes.append(value)
+
+        max_page_size = self.config["MAX_PAGE_SIZE"]
+        for size in sizes:
+            if max_page_size and size > max_page_size:
+                raise QueryCostError(
+                    f"Requested page size {size} on `{node.name.value}` exceeds the maximum of {max_page_size}",
+                    "PAGE_SIZE_TOO_LARGE",
+                    node=node,
+                    pageSize=size,
+                    maxPageSize=max_page_size,
+                )
+        return max(sizes) if sizes else self.config["DEFAULT_PAGE_SIZE"]
+
+
+def _is_connection(graphql_type):
+    fields = getattr(graphql_type, "fields", {})
+    return "edges" in fields and "pageInfo" in fields
+
+
+def _is_connection_wrapper(graphql_type):
+    """Connection, edge and page info types only wrap the real objects"""
+    fields = getattr(graphql_type, "fields", {})
+    return (
+        _is_connection(graphql_type)
+        or ("node" in fields and "cursor" in fields)
+        or graphql_type.name == "PageInfo"
+    )
@@ -0,0 +1,62 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class DocumentCache:
+    """Bounded LRU cache of parsed and validated GraphQL documents"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(query):
+        """Hash a query string into its cache key"""
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            document = self._documents.get(key)
+            if document is None:
+                self.misses += 1
+                return None
+            self._documents.move_to_end(key)
+            self.hits += 1
+            return document
+
+    def set(self, key, document):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._documents[key] = document
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return the cache counters as a dict"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._documents),
+                "max_size": self.max_size,
+            }
+
+
+# Shared by every GraphQL view in the process
+document_cache = DocumentCache(getattr(settings, "GRAPHQL_DOCUMENT_CACHE_SIZE", 128))
@@ -0,0 +1,290 @@
+import csv
+import datetime
+import heapq
+import io
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F
+from graphene.utils.str_converters import to_snake_case
+
+from .filters import CustomerFilter, OrderFilter, ProductFilter
+from .sharding import scatter_aliases
+
+DEFAULT_SETTINGS = {
+    # Rows fetched per database round trip while streaming
+    "CHUNK_SIZE": 2000,
+    # Encoded bytes buffered before a part is handed to the server
+    "FLUSH_SIZE": 64 * 1024,
+}
+
+# Exportable tables: the FilterSet shared with the GraphQL connections and the
+# columns written per row. Lookups spanning a relation are exported as
+# "<relation>_<field>" columns.
+EXPORTS = {
+    "customers": {
+        "filterset": CustomerFilter,
+        "columns": ("id", "name", "email", "phone", "created_at", "updated_at"),
+    },
+    "products": {
+        "filterset": ProductFilter,
+        "columns": ("id", "name", "price", "stock", "created_at", "updated_at"),
+    },
+    "orders": {
+        "filterset": OrderFilter,
+        "columns": (
+            "id",
+            "customer_id",
+            "customer__name",
+            "customer__email",
+            "total_amount",
+            "order_date",
+            "created_at",
+            "updated_at",
+        ),
+    },
+}
+
+
+def get_export_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "CRM_EXPORT", {})}
+
+
+class ExportError(Exception):
+    """Raised when an export request cannot be served"""
+
+    def __init__(self, errors, status=400):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+        self.status = status
+
+
+class NDJSONEncoder:
+    """One JSON object per line"""
+
+    content_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def header(self):
+        return ""
+
+    def encode(self, row):
+        row = {column: row[column] for column in self.columns}
+        return json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+class CSVEncoder:
+    """RFC 4180 CSV with a header row"""
+
+    content_type = "text/csv"
+    extension = "csv"
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def line(self, values):
+        self.writer.writerow(values)
+        line = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return line
+
+    def header(self):
+        return self.line(self.columns)
+
+    def encode(self, row):
+        return self.line(_csv_value(row[column]) for column in self.columns)
+
+
+ENCODERS = {"ndjson": NDJSONEncoder, "csv": CSVEncoder}
+
+
+class ShardedExport:
+    """values() rows of a sharded table read from every shard, merged in order
+
+    Stands in for the queryset in the export views: each shard streams its
+    rows in chunks and the rows are merged on the sort keys, selected as
+    export_key_<i>.
+    """
+
+    def __init__(self, queryset, aliases, ordering):
+        self.queryset = queryset
+        self.aliases = aliases
+        self.descending = [descending for _, descending in ordering]
+        self.nulls_largest = connections[aliases[0]].features.nulls_order_largest
+
+    def sort_key(self, row):
+        # NULL sorts where the backend puts it: before any value, or after it
+        values = (row[f"export_key_{i}"] for i in range(len(self.descending)))
+        return _MergeKey(
+            [((value is None) == self.nulls_largest, value) for value in values],
+            self.descending,
+        )
+
+    def iterator(self, chunk_size):
+        return heapq.merge(
+            *(
+                self.queryset.using(alias).iterator(chunk_size=chunk_size)
+                for alias in self.aliases
+            ),
+            key=self.sort_key,
+        )
+
+    async def aiterator(self, chunk_size):
+        iterators = [
+            self.queryset.using(alias).aiterator(chunk_size=chunk_size)
+            for alias in self.aliases
+        ]
+        # (sort key, shard index, row) of the next row of every shard
+        heap = []
+        for index, rows in enumerate(iterators):
+            row = await anext(rows, None)
+            if row is not None:
+                heap.append((self.sort_key(row), index, row))
+        heapq.heapify(heap)
+        while heap:
+            _, index, row = heap[0]
+            yield row
+            row = await anext(iterators[index], None)
+            if row is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (self.sort_key(row), index, row))
+
+
+class _MergeKey:
+    """Compares sort key values key by key, each in its own direction"""
+
+    __slots__ = ("values", "descending")
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __eq__(self, other):
+        return self.values == other.values
+
+    def __lt__(self, other):
+        for mine, theirs, descending in zip(
+            self.values, other.values, self.descending
+        ):
+            if mine != theirs:
+                return theirs < mine if descending else mine < theirs
+        return False
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _order_field(field):
+    if field.startswith("-"):
+        return "-" + to_snake_case(field[1:])
+    return to_snake_case(field)
+
+
+def build_export(resource, params):
+    """Return the filtered values() queryset and the encoder for a request"""
+    spec = EXPORTS.get(resource)
+    if spec is None:
+        raise ExportError([f"Unknown export '{resource}'."], status=404)
+
+    export_format = params.get("format", "ndjson")
+    if export_format not in ENCODERS:
+        raise ExportError(
+            [f"Unknown format '{export_format}', expected one of: {', '.join(ENCODERS)}."]
+        )
+
+    # Accept the GraphQL argument names (customerName) as well as snake_case
+    data = {to_snake_case(key): value for key, value in params.items()}
+    filterset_class = spec["filterset"]
+    filterset = filterset_class(
+        data, queryset=filterset_class._meta.model.objects.all()
+    )
+    if not filterset.is_valid():
+        raise ExportError(
+            [
+                f"{to_snake_case(name)}: {' '.join(messages)}"
+                for name, messages in filterset.errors.items()
+            ]
+        )
+
+    queryset = filterset.qs
+
+    # Streaming needs a stable order; default to the primary key
+    order_by = [
+        _order_field(field)
+        for value in params.getlist("orderBy") or params.getlist("order_by")
+        for field in value.split(",")
+        if field
+    ]
+    try:
+        queryset = queryset.order_by(*order_by, "pk")
+    except FieldError as e:
+        raise ExportError([str(e)])
+
+    lookups = spec["columns"]
+    columns = [lookup.replace("__", "_") for lookup in lookups]
+    # Orders not narrowed to one shard are read from all of them and merged
+    # on their sort keys
+    shards = scatter_aliases(queryset)
+    ordering = [
+        (field.lstrip("-"), field.startswith("-")) for field in queryset.query.order_by
+    ]
+    sort_keys = (
+        {f"export_key_{i}": F(name) for i, (name, _) in enumerate(ordering)}
+        if shards
+        else {}
+    )
+    queryset = queryset.values(
+        *(lookup for lookup in lookups if "__" not in lookup),
+        **{
+            column: F(lookup)
+            for column, lookup in zip(columns, lookups)
+            if "__" in lookup
+        },
+        **sort_keys,
+    )
+    if shards:
+        queryset = ShardedExport(queryset, shards, ordering)
+    return queryset, ENCODERS[export_format](columns)
+
+
+def stream_rows(rows, encoder, flush_size):
+    """Encode rows into byte parts of roughly flush_size bytes"""
+    parts = [encoder.header()]
+    size = len(parts[0])
+    for row in rows:
+        line = encoder.encode(row)
+        parts.append(line)
+        size += len(line)
+        if size >= flush_size:
+            yield "".join(parts).encode()
+            parts, size = [], 0
+    if size:
+        yield "".join(parts).encode()
+
+
+async def astream_rows(rows, encoder, flush_size):
+    """Async variant of stream_rows for rows from an async iterator"""
+    parts = [encoder.header()]
+    size = len(parts[0])
+    async for row in rows:
+        line = encoder.encode(row)
+        parts.append(line)
+        size += len(line)
+        if size >= flush_size:
+            yield "".join(parts).encode()
+            parts, size = [], 0
+    if size:
+        yield "".join(parts).encode()
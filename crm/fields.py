@@ -0,0 +1,130 @@
+import inspect
+
+from graphene_django.fields import DjangoConnectionField
+from graphene_django.filter import DjangoFilterConnectionField
+from promise import Promise
+
+from .async_utils import is_running_async, run_in_worker
+from .cost import get_query_cost_settings
+from .loaders import LoadedPage, get_loaders
+from .pagination import ShardedRows, keyset_connection
+from .sharding import scatter_aliases
+
+
+class BatchedConnectionMixin:
+    """Connection behaviour shared by the CRM list fields
+
+    Applies the default page size, supports keyset pagination, merges pages
+    of sharded models and hands each resolved page to the request loaders.
+    Under the async view, pages are resolved off the event loop.
+    """
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        # Orders not narrowed to one shard are read from all of them
+        shards = scatter_aliases(iterable)
+        # Keyset mode seeks by the sort key instead of OFFSET and skips COUNT(*)
+        if args.get("keyset"):
+            return keyset_connection(
+                connection, args, iterable, max_limit=max_limit, shards=shards
+            )
+        if shards:
+            iterable = ShardedRows(iterable, shards)
+        return super().resolve_connection(
+            connection, args, iterable, max_limit=max_limit
+        )
+
+    @classmethod
+    def connection_resolver(
+        cls,
+        resolver,
+        connection,
+        default_manager,
+        queryset_resolver,
+        max_limit,
+        enforce_first_or_last,
+        root,
+        info,
+        **args,
+    ):
+        def register_page(resolved):
+            get_loaders(info).register(edge.node for edge in resolved.edges)
+            return resolved
+
+        if args.get("first") is None and args.get("last") is None:
+            args["first"] = get_query_cost_settings()["DEFAULT_PAGE_SIZE"]
+
+        if is_running_async():
+            return cls.async_connection_resolver(
+                resolver,
+                connection,
+                default_manager,
+                queryset_resolver,
+                max_limit,
+                enforce_first_or_last,
+                root,
+                info,
+                **args,
+            )
+
+        resolved = super().connection_resolver(
+            resolver,
+            connection,
+            default_manager,
+            queryset_resolver,
+            max_limit,
+            enforce_first_or_last,
+            root,
+            info,
+            **args,
+        )
+        if Promise.is_thenable(resolved):
+            return Promise.resolve(resolved).then(register_page)
+        return register_page(resolved)
+
+    @classmethod
+    async def async_connection_resolver(
+        cls,
+        resolver,
+        connection,
+        default_manager,
+        queryset_resolver,
+        max_limit,
+        enforce_first_or_last,
+        root,
+        info,
+        **args,
+    ):
+        """Await loader results, then page querysets on a worker thread"""
+        iterable = resolver(root, info, **args)
+        if inspect.isawaitable(iterable):
+            iterable = await iterable
+
+        def resolve_page():
+            return super(BatchedConnectionMixin, cls).connection_resolver(
+                lambda root, info, **args: iterable,
+                connection,
+                default_manager,
+                queryset_resolver,
+                max_limit,
+                enforce_first_or_last,
+                root,
+                info,
+                **args,
+            )
+
+        # Loader results are already in memory; querysets still run COUNT and LIMIT
+        if isinstance(iterable, (list, LoadedPage)):
+            resolved = resolve_page()
+        else:
+            resolved = await run_in_worker(resolve_page)
+        get_loaders(info).register(edge.node for edge in resolved.edges)
+        return resolved
+
+
+class BatchedConnectionField(BatchedConnectionMixin, DjangoConnectionField):
+    """Connection for nested relations such as Order.products"""
+
+
+class BatchedFilterConnectionField(BatchedConnectionMixin, DjangoFilterConnectionField):
+    """Filterable root list connection"""
@@ -1,9 +1,124 @@
+import copy
+
 import django_filters
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
+from django.db.models import Exists, OuterRef
+from django.db.models.constants import LOOKUP_SEP
 from .models import Customer, Product, Order
 
 
-class CustomerFilter(django_filters.FilterSet):
+def split_to_many(model, field_name):
+    """Split a lookup path at its first to-many relation
+
+    Returns (outer path, relation field, inner path), or None when the path
+    only follows to-one relations.
+    """
+    opts = model._meta
+    parts = field_name.split(LOOKUP_SEP)
+    for i, part in enumerate(parts):
+        try:
+            field = opts.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if field.many_to_many or field.one_to_many:
+            return (
+                LOOKUP_SEP.join(parts[:i]),
+                field,
+                LOOKUP_SEP.join(parts[i + 1 :]),
+            )
+        if not field.is_relation:
+            return None
+        opts = field.related_model._meta
+    return None
+
+
+def related_rows(field, inner):
+    """Rows of a to-many relation, unfiltered
+
+    Returns the queryset, the name of its column pointing at the outer row
+    and the path of inner on it. Many-to-many relations are read from the
+    through table, so filtering on the related primary key never joins the
+    related table.
+    """
+    if inner in ("pk", field.related_model._meta.pk.name):
+        inner = ""
+    if field.many_to_many:
+        # ManyToManyRel on the reverse side, ManyToManyField on the forward one
+        m2m = field.field if field.auto_created else field
+        source, target = m2m.m2m_field_name(), m2m.m2m_reverse_field_name()
+        if field.auto_created:
+            source, target = target, source
+        queryset = m2m.remote_field.through._default_manager.all()
+        path = LOOKUP_SEP.join(part for part in (target, inner) if part)
+        return queryset, source, path
+    queryset = field.related_model._default_manager.all()
+    return queryset, field.field.name, inner or "pk"
+
+
+class CRMFilterSet(django_filters.FilterSet):
+    """FilterSet that filters across to-many relations with EXISTS subqueries
+
+    A join through a to-many relation repeats a row once per matching child,
+    which duplicates results and inflates COUNT unless followed by an
+    expensive DISTINCT. A correlated EXISTS matches each row at most once
+    and lets the database stop at the first matching child. Equality on the
+    child's key becomes an IN semi-join instead, which an index can drive.
+    """
+
+    def filter_queryset(self, queryset):
+        for name, value in self.form.cleaned_data.items():
+            queryset = self.apply_filter(queryset, self.filters[name], value)
+            assert isinstance(
+                queryset, models.QuerySet
+            ), "Expected '%s.%s' to return a QuerySet, but got a %s instead." % (
+                type(self).__name__,
+                name,
+                type(queryset).__name__,
+            )
+        return queryset
+
+    def apply_filter(self, queryset, filter_, value):
+        split = None
+        if filter_.method is None and filter_.field_name:
+            split = split_to_many(queryset.model, filter_.field_name)
+        if split is None:
+            return filter_.filter(queryset, value)
+
+        outer, field, inner = split
+        rows, source, path = related_rows(field, inner)
+        # The filter's own lookup and value handling, applied to the child rows
+        inner_filter = copy.copy(filter_)
+        inner_filter.field_name = path
+        inner_filter.distinct = False
+        inner_filter.exclude = False
+        matching = inner_filter.filter(rows, value)
+        if matching is rows:
+            # Empty value: the filter did nothing
+            return queryset
+
+        outer = outer or "pk"
+        if not filter_.exclude and self.is_key_lookup(field, path, filter_):
+            # A few known keys: SQLite never drives a correlated EXISTS from
+            # the child's index, but does drive an IN semi-join, which still
+            # matches each row once
+            return queryset.filter(**{f"{outer}__in": matching.values(source)})
+        matching = matching.filter(**{source: OuterRef(outer)})
+        if filter_.exclude:
+            return queryset.exclude(Exists(matching))
+        return queryset.filter(Exists(matching))
+
+    @staticmethod
+    def is_key_lookup(field, path, filter_):
+        """Whether a filter compares the child rows' key with given values"""
+        if filter_.lookup_expr not in ("exact", "in"):
+            return False
+        if field.many_to_many:
+            return LOOKUP_SEP not in path
+        return path == "pk"
+
+
+class CustomerFilter(CRMFilterSet):
     """Filter class for Customer model with various search options"""
     
     # Case-insensitive partial match for name
@@ -41,7 +156,7 @@ class CustomerFilter(django_filters.FilterSet):
         return queryset
 
 
-class ProductFilter(django_filters.FilterSet):
+class ProductFilter(CRMFilterSet):
     """Filter class for Product model with price and stock filtering"""
     
     # Case-insensitive partial match for name
@@ -81,7 +196,7 @@ class ProductFilter(django_filters.FilterSet):
         return queryset
 
 
-class OrderFilter(django_filters.FilterSet):
+class OrderFilter(CRMFilterSet):
     """Filter class for Order model with customer and product lookups"""
     
     # Total amount range filters
@@ -99,10 +214,10 @@ class OrderFilter(django_filters.FilterSet):
     customer_email = django_filters.CharFilter(field_name='customer__email', lookup_expr='icontains')
     customer_id = django_filters.NumberFilter(field_name='customer__id', lookup_expr='exact')
     
-    # Filter by product name (related field lookup through many-to-many)
+    # Filter by product name (EXISTS over the order's line items)
     product_name = django_filters.CharFilter(field_name='products__name', lookup_expr='icontains')
     
-    # Filter orders that include a specific product ID
+    # Filter orders that include a specific product ID (IN over the through table)
     product_id = django_filters.NumberFilter(field_name='products__id', lookup_expr='exact')
     
     # Date filters for created_at
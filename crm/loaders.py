@@ -0,0 +1,587 @@
+import asyncio
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from functools import partial
+
+from django.db import connections
+from django.db.models import Count, F, Prefetch, Value, Window
+from django.db.models.functions import Least, RowNumber
+from graphql_relay import get_offset_with_default
+
+from .async_utils import aget_or_none, is_running_async
+from .models import Customer, Product, Order, OrderItem
+from .pagination import keyset_ordering, merge_key
+from .sharding import get_sharding_settings, split_keys
+
+
+class PageWindow:
+    """Positions of the related rows a nested connection page can return
+
+    Mirrors how graphene pages a list with offset cursors, so a batch can
+    keep only those rows of each parent with ROW_NUMBER() in SQL.
+    """
+
+    def __init__(self, args):
+        after = args.get("after")
+        self.start = (get_offset_with_default(after, -1) + 1 if after else 0) + (
+            args.get("offset") or 0
+        )
+        before = get_offset_with_default(args.get("before"), -1)
+        self.before = before if before >= 0 else None
+        self.first = args.get("first")
+        self.last = args.get("last")
+        # Position the page ends before, when known without counting the rows
+        ends = [self.before]
+        if self.first is not None:
+            ends.append(self.start + self.first)
+        ends = [end for end in ends if end is not None]
+        self.end = min(ends) if ends else None
+        self.key = (self.start, self.before, self.first, self.last)
+
+    def may_skip_rows(self):
+        """Whether a parent can have rows yet none in the window"""
+        return self.start > 0 or self.end == 0 or self.last == 0
+
+    def apply(self, queryset, merged=False):
+        """Number each parent's rows and keep those the page can return
+
+        With merged, for rows merged from several shards afterwards, each
+        shard keeps every row up to the end of the window, or its last rows
+        when only last bounds the page.
+        """
+        order_by = [
+            F(name).desc() if descending else F(name).asc()
+            for name, descending in keyset_ordering(queryset)
+        ]
+        queryset = queryset.annotate(
+            loader_row=Window(
+                RowNumber(), partition_by=F("loader_key"), order_by=order_by
+            ),
+            loader_total=Window(Count("pk"), partition_by=F("loader_key")),
+        )
+        if self.end is not None:
+            queryset = queryset.filter(loader_row__lte=self.end)
+        if merged and self.end is not None:
+            return queryset
+        if self.start and not merged:
+            queryset = queryset.filter(loader_row__gt=self.start)
+        if self.last is not None:
+            # The page ends at the window's end or the last row, whichever
+            # comes first, and starts at most last rows before that
+            end = Window(Count("pk"), partition_by=F("loader_key"))
+            if self.end is not None:
+                end = Least(end, Value(self.end))
+            # Compared through an annotation: Django mis-selects the columns
+            # when a filter's right-hand side is a window expression
+            queryset = queryset.annotate(loader_floor=end - self.last).filter(
+                loader_row__gt=F("loader_floor")
+            )
+        return queryset
+
+
+class LoadedPage:
+    """The rows of one parent in a nested connection's window
+
+    Stands in for the parent's full list of related rows: len() counts all
+    of them, and slices by position return the loaded rows they cover.
+    """
+
+    def __init__(self, rows, length, start=0, offset=0):
+        self.rows = rows
+        self.length = length
+        # Position of rows[0], and of index 0 of this view
+        self.start = start
+        self.offset = offset
+
+    def count(self):
+        return self.length
+
+    def __len__(self):
+        return self.length - self.offset
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("LoadedPage only supports slices")
+        start = self.offset + (item.start or 0)
+        if item.stop is None:
+            return LoadedPage(self.rows, self.length, self.start, start)
+        stop = self.offset + item.stop
+        return self.rows[max(start - self.start, 0) : max(stop - self.start, 0)]
+
+
+class BatchLoader:
+    """Request-scoped loader that resolves one relation for many parents at once"""
+
+    # Parent model whose instances feed keys into this loader
+    model = None
+    # Relation on the parent model, reused when already select/prefetch-ed
+    field_name = None
+    # Attribute holding the batch key on parent instances
+    key_attname = "pk"
+    # Whether each key maps to a list of related objects
+    many = False
+    # What the keys of sharded rows are: "order" ids, "customer" ids or "all"
+    # for rows on any shard; None when the rows aren't sharded
+    sharded_by = None
+    # PageWindow cutting each parent's rows to a connection page, if any
+    window = None
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._cache = {}
+        self._pending = set()
+        # Window key -> copy of this loader fetching only that page
+        self._pages = {}
+        # Key -> task fetching its batch, shared by concurrent async loads
+        self._inflight = {}
+        # Key -> future of the batch a thread is fetching, for the same in
+        # threads of a batched operation
+        self._fetching = {}
+
+    def get_key(self, instance):
+        return getattr(instance, self.key_attname)
+
+    def get_queryset(self, keys):
+        """Return the related rows for the given keys, annotated with loader_key"""
+        raise NotImplementedError
+
+    def page(self, args):
+        """This loader cutting each parent's rows to the page of a connection"""
+        window = PageWindow(args)
+        with self.registry.lock:
+            loader = self._pages.get(window.key)
+            if loader is None:
+                loader = self._pages[window.key] = type(self)(self.registry)
+                loader.window = window
+                # Parents registered so far load in its first batch
+                loader._pending = set(self._pending)
+                self.registry.add(loader)
+        return loader
+
+    def merges_shards(self):
+        """Whether one parent's rows come from several shards"""
+        return self.sharded_by == "all" and bool(get_sharding_settings()["ALIASES"])
+
+    def get_querysets(self, keys, windowed=True):
+        """get_queryset split into one queryset per shard holding the rows"""
+        for alias, shard_keys in split_keys(self.sharded_by, keys):
+            queryset = self.get_queryset(shard_keys).using(alias)
+            if windowed and self.window is not None:
+                queryset = self.window.apply(queryset, self.merges_shards())
+            yield queryset
+
+    def count_querysets(self, keys):
+        """(key, related row count) querysets for parents with no rows loaded"""
+        if self.window is None or not self.window.may_skip_rows():
+            return []
+        return [
+            queryset.order_by()
+            .values("loader_key")
+            .annotate(count=Count("pk"))
+            .values_list("loader_key", "count")
+            for queryset in self.get_querysets(keys, windowed=False)
+        ]
+
+    def batch_load(self, keys):
+        """Return a dict mapping the given keys to their related objects"""
+        results = self.group(
+            [instance for queryset in self.get_querysets(keys) for instance in queryset]
+        )
+        missing = [k for k in keys if k not in results]
+        counts = defaultdict(int)
+        for queryset in self.count_querysets(missing) if missing else []:
+            for k, count in queryset:
+                counts[k] += count
+        return self.add_counts(results, counts)
+
+    async def abatch_load(self, keys):
+        """Async variant of batch_load using async ORM iteration"""
+        results = self.group(
+            [
+                instance
+                for queryset in self.get_querysets(keys)
+                async for instance in queryset
+            ]
+        )
+        missing = [k for k in keys if k not in results]
+        counts = defaultdict(int)
+        for queryset in self.count_querysets(missing) if missing else []:
+            async for k, count in queryset:
+                counts[k] += count
+        return self.add_counts(results, counts)
+
+    def group(self, instances):
+        """Map fetched rows to their keys and queue them for the next level"""
+        if self.many:
+            grouped = _group_by_key(self.registry, instances)
+            if self.window is None:
+                return grouped
+            return {key: self.loaded_page(rows) for key, rows in grouped.items()}
+        results = {instance.loader_key: instance for instance in instances}
+        self.registry.register(results.values())
+        return results
+
+    def loaded_page(self, rows):
+        """LoadedPage of one parent's rows fetched through the window"""
+        if not self.merges_shards():
+            return LoadedPage(rows, rows[0].loader_total, rows[0].loader_row - 1)
+        # Every shard's rows up to the window's end, or its last rows, merged
+        # in order
+        total = sum({row._state.db: row.loader_total for row in rows}.values())
+        keys = keyset_ordering(self.get_queryset([]))
+        nulls_largest = connections[rows[0]._state.db].features.nulls_order_largest
+        for name, descending in reversed(keys):
+            rows.sort(key=partial(merge_key, name, nulls_largest), reverse=descending)
+        if self.window.end is None and self.window.last is not None:
+            rows = rows[-self.window.last :]
+            return LoadedPage(rows, total, total - len(rows))
+        return LoadedPage(rows, total)
+
+    def add_counts(self, results, counts):
+        """Add the pages of parents whose rows all fall outside the window"""
+        for k, count in counts.items():
+            results[k] = LoadedPage([], count)
+        return results
+
+    def queue(self, instance):
+        """Schedule an instance's key for the next batch"""
+        # Reading a column deferred by .only() would cost a query per row
+        if self.key_attname in instance.get_deferred_fields():
+            return
+        key = self.get_key(instance)
+        if key is not None and key not in self._cache:
+            self._pending.add(key)
+
+    def get_loaded(self, instance):
+        """Return (True, value) when the relation is already select/prefetch-ed"""
+        if self.many:
+            prefetched = getattr(instance, "_prefetched_objects_cache", {})
+            if self.field_name in prefetched:
+                return True, list(prefetched[self.field_name])
+        elif instance._meta.get_field(self.field_name).is_cached(instance):
+            return True, getattr(instance, self.field_name)
+        return False, None
+
+    def take_batch(self, key):
+        """Return the keys to fetch together with the requested one"""
+        keys = self._pending | {key}
+        self._pending = set()
+        return keys
+
+    def store(self, keys, results):
+        for k in keys:
+            self._cache[k] = results.get(k, [] if self.many else None)
+
+    def clear(self):
+        self._cache = {}
+        self._pending = set()
+
+    def load(self, instance):
+        """Return the related object(s) for an instance, batching queued siblings"""
+        loaded, value = self.get_loaded(instance)
+        if loaded:
+            return value
+
+        key = self.get_key(instance)
+        # Threads of one batch wait for an in-progress fetch of their key
+        # instead of repeating it; the lock is only held to claim keys, so
+        # fetches of other keys run in parallel
+        with self.registry.lock:
+            if key in self._cache:
+                return self._cache[key]
+            future = self._fetching.get(key)
+            if future is None:
+                keys = {k for k in self.take_batch(key) if k not in self._fetching}
+                future = Future()
+                for k in keys:
+                    self._fetching[k] = future
+                fetching = True
+            else:
+                fetching = False
+
+        if fetching:
+            try:
+                results = self.batch_load(keys)
+                with self.registry.lock:
+                    self.store(keys, results)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(None)
+            finally:
+                with self.registry.lock:
+                    for k in keys:
+                        self._fetching.pop(k, None)
+        else:
+            future.result()
+        with self.registry.lock:
+            if key in self._cache:
+                return self._cache[key]
+        # Cleared while fetching, e.g. by a mutation
+        return self.load(instance)
+
+    async def aload(self, instance):
+        """Async variant of load; concurrent loads share a single batch query"""
+        loaded, value = self.get_loaded(instance)
+        if loaded:
+            return value
+
+        key = self.get_key(instance)
+        if key not in self._cache:
+            if key not in self._inflight:
+                keys = self.take_batch(key)
+                task = asyncio.ensure_future(self._afetch(keys))
+                for k in keys:
+                    self._inflight[k] = task
+            await self._inflight[key]
+        return self._cache[key]
+
+    def resolve(self, instance):
+        """load() under the sync view, an awaitable aload() under the async view"""
+        if is_running_async():
+            return self.aload(instance)
+        return self.load(instance)
+
+    async def _afetch(self, keys):
+        try:
+            self.store(keys, await self.abatch_load(keys))
+        finally:
+            for k in keys:
+                self._inflight.pop(k, None)
+
+
+class OrderCustomerLoader(BatchLoader):
+    """Batch Order.customer foreign key lookups"""
+
+    model = Order
+    field_name = "customer"
+    key_attname = "customer_id"
+
+    def get_queryset(self, keys):
+        return Customer.objects.filter(pk__in=keys).annotate(loader_key=F("pk"))
+
+
+class OrderProductsLoader(BatchLoader):
+    """Batch Order.products many-to-many lookups"""
+
+    model = Order
+    field_name = "products"
+    many = True
+    sharded_by = "order"
+
+    def get_queryset(self, keys):
+        return Product.objects.filter(orders__in=keys).annotate(
+            loader_key=F("orders")
+        )
+
+
+class OrderItemsLoader(BatchLoader):
+    """Batch Order.items reverse foreign key lookups with their products"""
+
+    model = Order
+    field_name = "items"
+    many = True
+    sharded_by = "order"
+
+    def get_queryset(self, keys):
+        return (
+            OrderItem.objects.filter(order__in=keys)
+            .select_related("product")
+            .annotate(loader_key=F("order"))
+        )
+
+    def group(self, instances):
+        grouped = super().group(instances)
+        self.registry.register(
+            item.product for items in grouped.values() for item in items
+        )
+        return grouped
+
+
+class CustomerOrdersLoader(BatchLoader):
+    """Batch Customer.orders reverse foreign key lookups"""
+
+    model = Customer
+    field_name = "orders"
+    many = True
+    sharded_by = "customer"
+
+    def get_queryset(self, keys):
+        return Order.objects.filter(customer__in=keys).annotate(
+            loader_key=F("customer")
+        )
+
+
+class ProductOrdersLoader(BatchLoader):
+    """Batch Product.orders reverse many-to-many lookups"""
+
+    model = Product
+    field_name = "orders"
+    many = True
+    sharded_by = "all"
+
+    def get_queryset(self, keys):
+        return Order.objects.filter(products__in=keys).annotate(
+            loader_key=F("products")
+        )
+
+
+def _group_by_key(registry, instances):
+    """Group annotated rows by their loader key and queue them for the next level"""
+    grouped = defaultdict(list)
+    for instance in instances:
+        grouped[instance.loader_key].append(instance)
+    for instances in grouped.values():
+        registry.register(instances)
+    return grouped
+
+
+class Loaders:
+    """All batch loaders shared by the resolvers of a single GraphQL request"""
+
+    def __init__(self):
+        # Batched operations may resolve on several threads at once
+        self.lock = threading.RLock()
+
+        self.order_customer = OrderCustomerLoader(self)
+        self.order_products = OrderProductsLoader(self)
+        self.order_items = OrderItemsLoader(self)
+        self.customer_orders = CustomerOrdersLoader(self)
+        self.product_orders = ProductOrdersLoader(self)
+
+        self._by_model = defaultdict(list)
+        for loader in (
+            self.order_customer,
+            self.order_products,
+            self.order_items,
+            self.customer_orders,
+            self.product_orders,
+        ):
+            self.add(loader)
+
+        # Single-row lookups by primary key, shared by the operations of a batch
+        self._objects = {}
+        self._inflight_objects = {}
+        self._fetching_objects = {}
+
+    def add(self, loader):
+        """Queue the instances registered from now on into a loader too"""
+        with self.lock:
+            self._by_model[loader.model].append(loader)
+
+    def get_object(self, queryset, pk):
+        """Fetch one row by primary key, reusing an identical earlier lookup"""
+        key = _lookup_key(queryset, pk)
+        with self.lock:
+            if key in self._objects:
+                return self._objects[key]
+            future = self._fetching_objects.get(key)
+            if future is None:
+                future = self._fetching_objects[key] = Future()
+                fetching = True
+            else:
+                fetching = False
+
+        if not fetching:
+            return future.result()
+        try:
+            try:
+                instance = queryset.get(pk=pk)
+            except queryset.model.DoesNotExist:
+                instance = None
+            with self.lock:
+                self._objects[key] = instance
+            if instance is not None:
+                self.register([instance])
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(instance)
+        finally:
+            with self.lock:
+                self._fetching_objects.pop(key, None)
+        return instance
+
+    async def aget_object(self, queryset, pk):
+        """Async variant of get_object; concurrent identical lookups share one query"""
+        key = _lookup_key(queryset, pk)
+        if key not in self._objects:
+            if key not in self._inflight_objects:
+                self._inflight_objects[key] = asyncio.ensure_future(
+                    self._afetch_object(key, queryset, pk)
+                )
+            await self._inflight_objects[key]
+        return self._objects[key]
+
+    async def _afetch_object(self, key, queryset, pk):
+        try:
+            instance = await aget_or_none(queryset, pk=pk)
+            self._objects[key] = instance
+            if instance is not None:
+                self.register([instance])
+        finally:
+            self._inflight_objects.pop(key, None)
+
+    def register(self, instances):
+        """Queue fetched instances so their relations load in one batch"""
+        with self.lock:
+            for instance in instances:
+                for loader in self._by_model.get(type(instance), ()):
+                    loader.queue(instance)
+
+    def clear(self):
+        """Forget everything loaded so far, e.g. after a mutation"""
+        with self.lock:
+            self._objects = {}
+            for loaders in self._by_model.values():
+                for loader in loaders:
+                    loader.clear()
+
+
+def _lookup_key(queryset, pk):
+    """Identify a lookup by its row and the exact SQL of it and its prefetches"""
+    return (queryset.model, str(pk), _queryset_key(queryset))
+
+
+def _queryset_key(queryset):
+    prefetches = []
+    for lookup in queryset._prefetch_related_lookups:
+        if isinstance(lookup, Prefetch):
+            prefetches.append(
+                (
+                    lookup.prefetch_to,
+                    None
+                    if lookup.queryset is None
+                    else _queryset_key(lookup.queryset),
+                )
+            )
+        else:
+            prefetches.append(lookup)
+    return str(queryset.query), tuple(prefetches)
+
+
+def get_loaders(info):
+    """Return the loaders attached to the GraphQL context, creating them on first use"""
+    return get_context_loaders(info.context)
+
+
+def get_context_loaders(context):
+    """Return the loaders attached to a GraphQL context, creating them on first use"""
+    if context is None:
+        return Loaders()
+    if isinstance(context, dict):
+        if "loaders" not in context:
+            context["loaders"] = Loaders()
+        return context["loaders"]
+
+    loaders = getattr(context, "loaders", None)
+    if loaders is None:
+        loaders = Loaders()
+        context.loaders = loaders
+    return loaders
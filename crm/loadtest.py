@@ -0,0 +1,437 @@
+import contextvars
+import http.client
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from django.db import close_old_connections, connection
+
+from .models import Customer, Order, Product
+from .pagination import encode_keyset_cursor
+from .synthetic import NOUNS
+
+ORDER_FIELDS = """
+        id
+        totalAmount
+        orderDate
+        customer { name email }
+        products { edges { node { name price } } }
+"""
+
+FILTERED_ORDERS = (
+    """
+query FilteredOrders($minTotal: Decimal, $productName: String) {
+  allOrders(
+    first: 20
+    totalAmountGte: $minTotal
+    productName: $productName
+    orderBy: ["-order_date"]
+  ) {
+    totalCount
+    edges { node {%s} }
+  }
+}
+"""
+    % ORDER_FIELDS
+)
+
+DEEP_OFFSET = (
+    """
+query DeepOffset($offset: Int) {
+  allOrders(first: 20, offset: $offset) {
+    edges { node {%s} }
+  }
+}
+"""
+    % ORDER_FIELDS
+)
+
+DEEP_KEYSET = (
+    """
+query DeepKeyset($after: String) {
+  allOrders(first: 20, after: $after, keyset: true) {
+    pageInfo { hasNextPage endCursor }
+    edges { node {%s} }
+  }
+}
+"""
+    % ORDER_FIELDS
+)
+
+BULK_CREATE_CUSTOMERS = """
+mutation BulkCreateCustomers($input: [CustomerInput]!) {
+  bulkCreateCustomers(input: $input) {
+    customers { id }
+    errors
+  }
+}
+"""
+
+CREATE_ORDER = """
+mutation CreateOrder($customerId: ID!, $items: [OrderItemInput]) {
+  createOrder(input: {customerId: $customerId, items: $items}) {
+    order { id totalAmount }
+    success
+    errors
+  }
+}
+"""
+
+UPDATE_LOW_STOCK_PRODUCTS = """
+mutation UpdateLowStockProducts {
+  updateLowStockProducts(threshold: 50, increment: 1) {
+    products { id stock }
+    success
+    errors
+  }
+}
+"""
+
+
+class Operation:
+    """A GraphQL document and the variables of each request sending it"""
+
+    def __init__(self, name, document, variables=None, payload=None):
+        self.name = name
+        self.document = document
+        self.variables = variables or (lambda dataset, rng, request_id: {})
+        # Mutation payload whose success flag and errors count as failures
+        self.payload = payload
+
+
+# Representative reads and writes of the CRM API
+CATALOG = [
+    Operation(
+        "filtered_orders",
+        FILTERED_ORDERS,
+        lambda dataset, rng, request_id: {
+            "minTotal": rng.choice([25, 50, 100, 250]),
+            "productName": rng.choice(NOUNS),
+        },
+    ),
+    Operation(
+        "deep_offset",
+        DEEP_OFFSET,
+        lambda dataset, rng, request_id: {"offset": dataset.deep_offset},
+    ),
+    Operation(
+        "deep_keyset",
+        DEEP_KEYSET,
+        lambda dataset, rng, request_id: {"after": dataset.deep_cursor},
+    ),
+    Operation(
+        "bulk_create_customers",
+        BULK_CREATE_CUSTOMERS,
+        lambda dataset, rng, request_id: {
+            "input": [
+                {
+                    "name": f"Load Test {request_id}-{i}",
+                    "email": f"load.{dataset.run_id}.{request_id}.{i}@example.com",
+                    "phone": f"+1555{rng.randrange(10**7):07d}",
+                }
+                for i in range(20)
+            ]
+        },
+        payload="bulkCreateCustomers",
+    ),
+    Operation(
+        "create_order",
+        CREATE_ORDER,
+        lambda dataset, rng, request_id: {
+            "customerId": rng.choice(dataset.customer_ids),
+            "items": [
+                {"productId": product_id, "quantity": 1}
+                for product_id in rng.sample(dataset.product_ids, rng.randint(1, 3))
+            ],
+        },
+        payload="createOrder",
+    ),
+    Operation(
+        "update_low_stock_products",
+        UPDATE_LOW_STOCK_PRODUCTS,
+        payload="updateLowStockProducts",
+    ),
+]
+
+OPERATIONS = {operation.name: operation for operation in CATALOG}
+
+
+class Dataset:
+    """Ids and cursors the catalog's variables draw from"""
+
+    def __init__(self, depth=0.9):
+        self.run_id = f"{time.time_ns():x}"
+        # Numbers every request of the run, e.g. for unique emails
+        self.request_ids = itertools.count()
+        self.customer_ids = list(Customer.objects.values_list("pk", flat=True))
+        # Products well stocked enough to take every order of a run
+        self.product_ids = list(
+            Product.objects.filter(stock__gte=100).values_list("pk", flat=True)
+        )
+        # A page most of the way through the default ordering
+        self.deep_offset = int(Order.objects.count() * depth)
+        order = Order.objects.order_by("-order_date", "pk")[self.deep_offset]
+        self.deep_cursor = encode_keyset_cursor((order.order_date, order.pk))
+
+
+# Queries of the request running in the current thread or task
+_query_counter = contextvars.ContextVar("query_counter", default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    """Database execute wrapper counting the statements of a measured request"""
+    counter = _query_counter.get()
+    if counter is not None:
+        counter.queries += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """connection_created receiver adding count_query to the connection"""
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def counted(func, *args, **kwargs):
+    """Call func and return (result, SQL statements it ran)
+
+    Statements on other threads count when the context follows the work,
+    as it does onto the write queue and async workers.
+    """
+    counter = SimpleNamespace(queries=0)
+    token = _query_counter.set(counter)
+    try:
+        return func(*args, **kwargs), counter.queries
+    finally:
+        _query_counter.reset(token)
+
+
+def counting_wsgi_app(application, header="X-Benchmark-Queries"):
+    """Wrap a WSGI application to report each request's SQL count in a header"""
+
+    def app(environ, start_response):
+        counter = SimpleNamespace(queries=0)
+        token = _query_counter.set(counter)
+        try:
+
+            def counting_start_response(status, headers, exc_info=None):
+                # Django has run the view by the time it starts the response
+                headers.append((header, str(counter.queries)))
+                return start_response(status, headers, exc_info)
+
+            return application(environ, counting_start_response)
+        finally:
+            _query_counter.reset(token)
+
+    return app
+
+
+class InProcessClient:
+    """Executes documents directly against the schema"""
+
+    transport = "inprocess"
+
+    def __init__(self, schema):
+        self.schema = schema
+
+    def execute(self, document, variables):
+        """Return (data, error messages, SQL statements)"""
+        result, queries = counted(
+            self.schema.execute,
+            document,
+            variable_values=variables,
+            context_value=SimpleNamespace(),
+        )
+        # What request_finished does after every request
+        close_old_connections()
+        return result.data, [error.message for error in result.errors or []], queries
+
+    def close(self):
+        connection.close()
+
+
+class HttpClient:
+    """POSTs documents to a GraphQL endpoint over one keep-alive connection"""
+
+    transport = "http"
+
+    def __init__(self, host, port, path="/graphql", header="X-Benchmark-Queries"):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.header = header
+        self.connection = None
+
+    def execute(self, document, variables):
+        body = json.dumps({"query": document, "variables": variables})
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port)
+            try:
+                self.connection.request(
+                    "POST",
+                    self.path,
+                    body,
+                    {"Content-Type": "application/json"},
+                )
+                response = self.connection.getresponse()
+                content = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the connection between requests
+                self.close()
+                if attempt:
+                    raise
+                continue
+            if response.getheader("Connection", "").lower() == "close":
+                self.close()
+            break
+
+        queries = response.getheader(self.header)
+        try:
+            result = json.loads(content)
+        except ValueError:
+            return None, [f"HTTP {response.status}"], None
+        errors = [error.get("message", "") for error in result.get("errors") or []]
+        return (
+            result.get("data"),
+            errors,
+            int(queries) if queries is not None else None,
+        )
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def failures(operation, data, errors):
+    """GraphQL errors plus the errors of an unsuccessful mutation payload"""
+    failed = list(errors)
+    if operation.payload:
+        payload = (data or {}).get(operation.payload) or {}
+        if payload.get("success") is False or payload.get("errors"):
+            failed.extend(payload.get("errors") or ["unsuccessful"])
+    return failed
+
+
+def run_operation(operation, make_client, dataset, requests, concurrency, seed=0):
+    """Send requests of one operation from concurrent clients and measure them
+
+    make_client is called once per client thread.
+    """
+    barrier = threading.Barrier(concurrency)
+    timings = []
+    query_counts = []
+    errors = []
+    lock = threading.Lock()
+    started = [None]
+    # Spread the requests over the clients, the first ones taking the rest
+    shares = [
+        requests // concurrency + (index < requests % concurrency)
+        for index in range(concurrency)
+    ]
+
+    def client(index):
+        rng = random.Random(f"{seed}:{operation.name}:{index}")
+        graphql_client = make_client()
+        local_timings, local_queries, local_errors = [], [], []
+        try:
+            barrier.wait()
+            with lock:
+                if started[0] is None:
+                    started[0] = time.perf_counter()
+            for _ in range(shares[index]):
+                variables = operation.variables(
+                    dataset, rng, next(dataset.request_ids)
+                )
+                request_started = time.perf_counter()
+                data, messages, queries = graphql_client.execute(
+                    operation.document, variables
+                )
+                local_timings.append(time.perf_counter() - request_started)
+                if queries is not None:
+                    local_queries.append(queries)
+                local_errors.extend(failures(operation, data, messages))
+        finally:
+            graphql_client.close()
+        with lock:
+            timings.extend(local_timings)
+            query_counts.extend(local_queries)
+            errors.extend(local_errors)
+
+    threads = [
+        threading.Thread(target=client, args=(index,)) for index in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started[0] if started[0] else 0.0
+    return summarize(timings, query_counts, errors, elapsed)
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def summarize(timings, query_counts, errors, elapsed):
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "throughput_rps": round(len(timings) / elapsed, 2) if elapsed else 0.0,
+        "queries_per_operation": round(sum(query_counts) / len(query_counts), 2)
+        if query_counts
+        else None,
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compare results with a baseline of the same shape
+
+    Returns (rows, regressions): one row per transport and operation found in
+    both, and a message for each latency or throughput change worse than the
+    tolerance, and for any increase in queries per operation.
+    """
+    rows = []
+    regressions = []
+    for transport, operations in results.items():
+        for name, current in operations.items():
+            previous = baseline.get(transport, {}).get(name)
+            if previous is None:
+                continue
+            row = {"transport": transport, "operation": name}
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+                before, after = previous[metric], current[metric]
+                change = (after - before) / before if before else 0.0
+                row[metric] = change
+                # Gate on p95 and throughput; p50 and p99 are informational
+                if metric == "throughput_rps":
+                    worse = change < -tolerance
+                else:
+                    worse = metric == "p95_ms" and change > tolerance
+                if worse:
+                    regressions.append(
+                        f"{transport} {name}: {metric} {before} -> {after} "
+                        f"({change:+.0%})"
+                    )
+            before = previous.get("queries_per_operation")
+            after = current.get("queries_per_operation")
+            row["queries"] = (before, after)
+            if before is not None and after is not None and after > before:
+                regressions.append(
+                    f"{transport} {name}: queries per operation {before} -> {after}"
+                )
+            rows.append(row)
+    return rows, regressions
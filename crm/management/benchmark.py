@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class BenchmarkCommand(BaseCommand):
+    """Management command running run_benchmark() against a throwaway database"""
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("This benchmark targets the SQLite backend")
+
+        # Run against a throwaway database file so the real data is untouched
+        with tempfile.TemporaryDirectory() as directory:
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                directory, "benchmark.sqlite3"
+            )
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                self.run_benchmark(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_benchmark(self, options):
+        raise NotImplementedError
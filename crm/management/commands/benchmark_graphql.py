@@ -0,0 +1,232 @@
+import datetime
+import json
+import platform
+import threading
+from contextlib import contextmanager
+
+import django
+from django.core.management.base import CommandError
+from django.core.servers.basehttp import (
+    ThreadedWSGIServer,
+    WSGIRequestHandler,
+    get_internal_wsgi_application,
+)
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from alx_backend_graphql_crm.schema import schema
+from crm.loadtest import (
+    OPERATIONS,
+    Dataset,
+    HttpClient,
+    InProcessClient,
+    compare,
+    counting_wsgi_app,
+    install_query_counter,
+    run_operation,
+)
+from crm.management.benchmark import BenchmarkCommand
+from crm.sqlite import write_queue
+from crm.synthetic import DatasetPlan, generate
+
+TRANSPORTS = ("inprocess", "http")
+
+# Fixed so every run seeds the same rows
+DATASET_END = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Load test a catalog of GraphQL operations in-process and over HTTP, "
+        "reporting latency percentiles, throughput and queries per operation"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=2000)
+        parser.add_argument("--products", type=int, default=200)
+        parser.add_argument("--orders", type=int, default=20000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--concurrency", type=int, default=4, help="Concurrent clients"
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Measured requests per operation"
+        )
+        parser.add_argument(
+            "--warmup", type=int, default=10, help="Unmeasured requests per operation"
+        )
+        parser.add_argument(
+            "--transports", nargs="+", default=list(TRANSPORTS), choices=TRANSPORTS
+        )
+        parser.add_argument(
+            "--operations",
+            nargs="+",
+            default=list(OPERATIONS),
+            choices=list(OPERATIONS),
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument(
+            "--baseline", help="Compare with the results JSON of an earlier run"
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.1,
+            help="Relative p95 or throughput change counted as a regression",
+        )
+
+    def run_benchmark(self, options):
+        if options["concurrency"] < 1 or options["requests"] < 1:
+            raise CommandError("--concurrency and --requests must be positive")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)["results"]
+
+        self.stdout.write(
+            f"Seeding {options['customers']} customers, {options['products']} "
+            f"products and {options['orders']} orders"
+        )
+        generate(
+            DatasetPlan(
+                customers=options["customers"],
+                products=options["products"],
+                orders=options["orders"],
+                end=DATASET_END,
+                seed=options["seed"],
+            )
+        )
+        dataset = Dataset()
+
+        # Count the statements of every connection, open or opened later
+        connection_created.connect(install_query_counter)
+        install_query_counter(None, connection)
+        results = {}
+        try:
+            for transport in options["transports"]:
+                with self.clients(transport) as make_client:
+                    results[transport] = self.run_transport(
+                        transport, make_client, dataset, options
+                    )
+        finally:
+            connection_created.disconnect(install_query_counter)
+            # Release the writer's persistent connection to this database
+            write_queue.run(lambda: connection.close())
+
+        report = {
+            "meta": {
+                "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "sqlite": connection.Database.sqlite_version,
+                **{
+                    key: options[key]
+                    for key in (
+                        "customers",
+                        "products",
+                        "orders",
+                        "seed",
+                        "concurrency",
+                        "requests",
+                        "warmup",
+                    )
+                },
+            },
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"\nWrote {options['output']}")
+        if baseline is not None:
+            self.report_comparison(results, baseline, options["tolerance"])
+
+    @contextmanager
+    def clients(self, transport):
+        """Yield a factory making one client of the transport per thread"""
+        if transport == "inprocess":
+            try:
+                yield lambda: InProcessClient(schema)
+            finally:
+                connection.close()
+            return
+
+        # Serve the project on a free local port for the run
+        server = ThreadedWSGIServer(("127.0.0.1", 0), QuietRequestHandler)
+        server.set_app(counting_wsgi_app(get_internal_wsgi_application()))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        host, port = server.server_address[:2]
+        try:
+            yield lambda: HttpClient(host, port)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def run_transport(self, transport, make_client, dataset, options):
+        self.stdout.write(
+            f"\n{transport}: {options['concurrency']} clients, "
+            f"{options['requests']} requests per operation"
+        )
+        self.stdout.write(
+            f"{'operation':<26} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'req/s':>8} {'queries':>8} {'errors':>7}"
+        )
+        results = {}
+        for name in options["operations"]:
+            operation = OPERATIONS[name]
+            if options["warmup"]:
+                run_operation(
+                    operation,
+                    make_client,
+                    dataset,
+                    options["warmup"],
+                    1,
+                    options["seed"] - 1,
+                )
+            result = run_operation(
+                operation,
+                make_client,
+                dataset,
+                options["requests"],
+                options["concurrency"],
+                options["seed"],
+            )
+            results[name] = result
+            queries = result["queries_per_operation"]
+            self.stdout.write(
+                f"{name:<26} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['throughput_rps']:>8.1f} "
+                f"{'-' if queries is None else f'{queries:.1f}':>8} "
+                f"{result['errors']:>7}"
+            )
+            for sample in result["error_samples"]:
+                self.stderr.write(f"  {name}: {sample}")
+        return results
+
+    def report_comparison(self, results, baseline, tolerance):
+        rows, regressions = compare(results, baseline, tolerance)
+        self.stdout.write("\nChange against the baseline")
+        self.stdout.write(
+            f"{'transport':<10} {'operation':<26} {'p50':>7} {'p95':>7} "
+            f"{'p99':>7} {'req/s':>7} {'queries':>12}"
+        )
+        for row in rows:
+            before, after = row["queries"]
+            self.stdout.write(
+                f"{row['transport']:<10} {row['operation']:<26} "
+                f"{row['p50_ms']:>+7.0%} {row['p95_ms']:>+7.0%} "
+                f"{row['p99_ms']:>+7.0%} {row['throughput_rps']:>+7.0%} "
+                f"{f'{before} -> {after}':>12}"
+            )
+        if regressions:
+            raise CommandError(
+                "Regressions against the baseline:\n" + "\n".join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
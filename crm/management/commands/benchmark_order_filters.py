@@ -0,0 +1,121 @@
+import random
+import statistics
+import time
+
+from django.db import connection
+
+from crm.filters import OrderFilter
+from crm.management.benchmark import BenchmarkCommand
+from crm.models import Customer, Order, OrderItem, Product
+
+COLOURS = ["Red", "Blue", "Green", "Black", "White", "Grey", "Pink", "Gold", "Teal", "Navy"]
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Compare OrderFilter's EXISTS and IN subqueries with the join they replace "
+        "on orders that contain many products"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=10000)
+        parser.add_argument("--lines", type=int, default=20, help="Products per order")
+        parser.add_argument("--products", type=int, default=500)
+        parser.add_argument("--customers", type=int, default=1000)
+        parser.add_argument(
+            "--match",
+            default="Blue",
+            help="productName value; one product in ten carries each colour",
+        )
+        parser.add_argument("--page-size", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def run_benchmark(self, options):
+        self.seed(options)
+
+        product_id = (
+            OrderItem.objects.values_list("product_id", flat=True)
+            .order_by("product_id")
+            .first()
+        )
+        cases = [
+            ("productName", {"product_name": options["match"]}, {
+                "products__name__icontains": options["match"]
+            }),
+            ("productId", {"product_id": product_id}, {"products__id": product_id}),
+        ]
+
+        self.stdout.write(
+            f"{options['orders']} orders x {options['lines']} lines, "
+            f"median of {options['repeat']} runs\n"
+        )
+        self.stdout.write(
+            f"{'filter':<12} {'variant':<14} {'count':>7} {'count ms':>9} "
+            f"{'page ms':>8} {'page dups':>10}"
+        )
+        for label, filter_data, join_lookups in cases:
+            filterset = OrderFilter(filter_data, queryset=Order.objects.all())
+            filterset.is_valid()
+            variants = [
+                ("join", Order.objects.filter(**join_lookups)),
+                ("join+distinct", Order.objects.filter(**join_lookups).distinct()),
+                ("OrderFilter", filterset.qs),
+            ]
+            for variant, queryset in variants:
+                result = self.measure(queryset, options)
+                self.stdout.write(
+                    f"{label:<12} {variant:<14} {result['count']:>7} "
+                    f"{result['count_ms']:>9.2f} {result['page_ms']:>8.2f} "
+                    f"{result['duplicates']:>10}"
+                )
+
+    def seed(self, options):
+        rng = random.Random(options["seed"])
+        customers = Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"customer{i}@example.com")
+            for i in range(options["customers"])
+        )
+        products = Product.objects.bulk_create(
+            Product(
+                name=f"{COLOURS[i % len(COLOURS)]} product {i}",
+                price=rng.randint(1, 500),
+                stock=rng.randint(0, 1000),
+            )
+            for i in range(options["products"])
+        )
+        orders = Order.objects.bulk_create(
+            (
+                Order(customer=rng.choice(customers))
+                for _ in range(options["orders"])
+            ),
+            batch_size=1000,
+        )
+        lines = min(options["lines"], len(products))
+        OrderItem.objects.bulk_create(
+            (
+                OrderItem(order=order, product=product, unit_price=product.price)
+                for order in orders
+                for product in rng.sample(products, lines)
+            ),
+            batch_size=5000,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def measure(self, queryset, options):
+        count_times, page_times = [], []
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            count = queryset.count()
+            count_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            page = list(queryset.values_list("pk", flat=True)[: options["page_size"]])
+            page_times.append(time.perf_counter() - started)
+        return {
+            "count": count,
+            "count_ms": statistics.median(count_times) * 1000,
+            "page_ms": statistics.median(page_times) * 1000,
+            "duplicates": len(page) - len(set(page)),
+        }
@@ -0,0 +1,207 @@
+import random
+import statistics
+import threading
+import time
+from types import SimpleNamespace
+
+from django.db import close_old_connections, connection
+from django.test.utils import override_settings
+from graphene_django.settings import graphene_settings
+from graphql import graphql_sync
+
+from crm.management.benchmark import BenchmarkCommand
+from crm.models import Customer, Order, OrderItem, Product
+from crm.sqlite import PROFILES, write_queue
+
+RECENT_ORDERS = """
+query RecentOrders {
+  allOrders(first: 20, orderBy: ["-order_date"]) {
+    totalCount
+    edges {
+      node {
+        id
+        totalAmount
+        customer { name }
+        products { edges { node { name price } } }
+      }
+    }
+  }
+}
+"""
+
+CREATE_ORDER = """
+mutation CreateOrder($customerId: ID!, $items: [OrderItemInput]) {
+  createOrder(input: {customerId: $customerId, items: $items}) {
+    success
+    errors
+  }
+}
+"""
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Measure GraphQL read and write throughput of concurrent clients under "
+        "each CRM_SQLITE profile"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--writers", type=int, default=4)
+        parser.add_argument("--requests", type=int, default=100, help="Per client")
+        parser.add_argument("--orders", type=int, default=2000, help="Seeded orders")
+        parser.add_argument(
+            "--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES)
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def run_benchmark(self, options):
+        self.seed(options)
+        conn_max_age = connection.settings_dict["CONN_MAX_AGE"]
+
+        self.stdout.write(
+            f"{options['readers']} readers, {options['writers']} writers, "
+            f"{options['requests']} requests each\n"
+        )
+        self.stdout.write(
+            f"{'profile':<12} {'phase':<6} {'reads/s':>8} {'read p95':>9} "
+            f"{'writes/s':>9} {'write p95':>10} {'errors':>7} {'locked':>7}"
+        )
+        try:
+            for profile in options["profiles"]:
+                # Worker threads open their connections from this settings dict
+                connection.settings_dict["CONN_MAX_AGE"] = (
+                    600 if profile == "performance" else 0
+                )
+                with override_settings(CRM_SQLITE={"PROFILE": profile}):
+                    connection.close()
+                    # What migrate does when the profile changes
+                    with connection.cursor() as cursor:
+                        journal_mode = PROFILES[profile]["JOURNAL_MODE"]
+                        cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+                    # Warm up code paths and connections, unmeasured
+                    self.run_phase(1, 1, {**options, "requests": 20})
+                    # Every profile starts from the seeded rows
+                    Order.objects.filter(pk__gt=self.last_order_id).delete()
+                    for phase, readers, writers in (
+                        ("reads", options["readers"], 0),
+                        ("mixed", options["readers"], options["writers"]),
+                    ):
+                        result = self.run_phase(readers, writers, options)
+                        self.stdout.write(
+                            f"{profile:<12} {phase:<6} {result['reads']:>8.1f} "
+                            f"{result['read_p95']:>9.2f} {result['writes']:>9.1f} "
+                            f"{result['write_p95']:>10.2f} {result['errors']:>7} "
+                            f"{result['locked']:>7}"
+                        )
+                    # Release the writer's persistent connection to this database
+                    write_queue.run(lambda: connection.close())
+                    connection.close()
+        finally:
+            connection.settings_dict["CONN_MAX_AGE"] = conn_max_age
+
+    def seed(self, options):
+        rng = random.Random(options["seed"])
+        customers = Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"customer{i}@example.com")
+            for i in range(200)
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f"Product {i}", price=rng.randint(1, 500), stock=10**9)
+            for i in range(200)
+        )
+        orders = Order.objects.bulk_create(
+            (Order(customer=rng.choice(customers)) for _ in range(options["orders"])),
+            batch_size=1000,
+        )
+        OrderItem.objects.bulk_create(
+            (
+                OrderItem(order=order, product=product, unit_price=product.price)
+                for order in orders
+                for product in rng.sample(products, 2)
+            ),
+            batch_size=5000,
+        )
+        self.last_order_id = orders[-1].pk
+        self.customer_ids = [customer.pk for customer in customers]
+        self.product_ids = [product.pk for product in products]
+
+    def run_phase(self, readers, writers, options):
+        schema = graphene_settings.SCHEMA.graphql_schema
+        barrier = threading.Barrier(readers + writers)
+        timings = {"read": [], "write": []}
+        elapsed = {"read": 0.0, "write": 0.0}
+        counts = {"errors": 0, "locked": 0}
+        lock = threading.Lock()
+
+        def request(kind, rng):
+            if kind == "read":
+                result = graphql_sync(
+                    schema, RECENT_ORDERS, context_value=SimpleNamespace()
+                )
+                errors = [error.message for error in result.errors or []]
+            else:
+                items = [
+                    {"productId": pk, "quantity": rng.randint(1, 3)}
+                    for pk in rng.sample(self.product_ids, rng.randint(1, 2))
+                ]
+                result = graphql_sync(
+                    schema,
+                    CREATE_ORDER,
+                    variable_values={
+                        "customerId": rng.choice(self.customer_ids),
+                        "items": items,
+                    },
+                    context_value=SimpleNamespace(),
+                )
+                payload = (result.data or {}).get("createOrder") or {}
+                errors = [error.message for error in result.errors or []]
+                if not payload.get("success"):
+                    errors.extend(payload.get("errors") or ["failed"])
+            # What request_finished does after every request
+            close_old_connections()
+            return errors
+
+        def client(kind, index):
+            rng = random.Random(options["seed"] + index)
+            local_timings = []
+            local_counts = dict.fromkeys(counts, 0)
+            try:
+                barrier.wait()
+                started = time.perf_counter()
+                for _ in range(options["requests"]):
+                    request_started = time.perf_counter()
+                    errors = request(kind, rng)
+                    local_timings.append(time.perf_counter() - request_started)
+                    if errors:
+                        local_counts["errors"] += 1
+                        if any("locked" in error for error in errors):
+                            local_counts["locked"] += 1
+                finished = time.perf_counter() - started
+            finally:
+                connection.close()
+            with lock:
+                timings[kind].extend(local_timings)
+                elapsed[kind] = max(elapsed[kind], finished)
+                for key, value in local_counts.items():
+                    counts[key] += value
+
+        threads = [
+            threading.Thread(target=client, args=("read", i)) for i in range(readers)
+        ] + [
+            threading.Thread(target=client, args=("write", readers + i))
+            for i in range(writers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        result = dict(counts)
+        for kind in ("read", "write"):
+            values = sorted(timings[kind])
+            result[f"{kind}s"] = len(values) / elapsed[kind] if elapsed[kind] else 0.0
+            result[f"{kind}_p95"] = (
+                values[int(len(values) * 0.95) - 1] * 1000 if values else 0.0
+            )
+        return result
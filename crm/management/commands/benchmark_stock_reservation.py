@@ -0,0 +1,164 @@
+import random
+import statistics
+import threading
+import time
+from types import SimpleNamespace
+
+from django.db import connection
+from django.test.utils import override_settings
+from graphene_django.settings import graphene_settings
+from graphql import graphql_sync
+
+from crm.management.benchmark import BenchmarkCommand
+from crm.models import Customer, Order, OrderItem, Product
+
+CREATE_ORDER = """
+mutation CreateOrder($customerId: ID!, $items: [OrderItemInput]) {
+  createOrder(input: {customerId: $customerId, items: $items}) {
+    success
+    errors
+  }
+}
+"""
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Measure order throughput of parallel writers reserving stock on a few "
+        "hot products, on SQLite in WAL and rollback-journal mode"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--writers", type=int, default=8)
+        parser.add_argument("--orders", type=int, default=200, help="Orders per writer")
+        parser.add_argument("--skus", type=int, default=3, help="Hot products")
+        parser.add_argument(
+            "--stock",
+            type=int,
+            default=None,
+            help="Initial stock per product (default: enough for about 90%% of orders)",
+        )
+        parser.add_argument(
+            "--journal-modes", nargs="+", default=["wal", "delete"], metavar="MODE"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def run_benchmark(self, options):
+        self.stdout.write(
+            f"{options['writers']} writers x {options['orders']} orders "
+            f"on {options['skus']} hot products\n"
+        )
+        self.stdout.write(
+            f"{'mode':<8} {'orders/s':>9} {'ok':>6} {'no stock':>9} "
+            f"{'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'consistent':>11}"
+        )
+        for mode in options["journal_modes"]:
+            # run_mode switches the database file to the mode, which every
+            # writer connection then uses; writes stay concurrent
+            with override_settings(
+                CRM_SQLITE={"PROFILE": "default", "WRITE_QUEUE": False}
+            ):
+                result = self.run_mode(mode, options)
+            self.stdout.write(
+                f"{result['mode']:<8} {result['throughput']:>9.1f} "
+                f"{result['ok']:>6} {result['insufficient']:>9} "
+                f"{result['errors']:>7} {result['p50']:>8.2f} "
+                f"{result['p95']:>8.2f} {str(result['consistent']):>11}"
+            )
+
+    def run_mode(self, mode, options):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA journal_mode={mode}")
+            mode = cursor.fetchone()[0]
+
+        OrderItem.objects.all().delete()
+        Order.objects.all().delete()
+        Product.objects.all().delete()
+        Customer.objects.all().delete()
+
+        total_orders = options["writers"] * options["orders"]
+        stock = options["stock"]
+        if stock is None:
+            # Orders average about 2.25 units: 1-2 lines of 1-2 units each
+            stock = int(total_orders * 2.25 * 0.9 / options["skus"])
+
+        customer = Customer.objects.create(
+            name="Benchmark", email="benchmark@example.com"
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f"Hot SKU {i}", price="9.99", stock=stock)
+            for i in range(options["skus"])
+        )
+        product_ids = [product.pk for product in products]
+        initial_stock = stock * len(products)
+
+        schema = graphene_settings.SCHEMA.graphql_schema
+        barrier = threading.Barrier(options["writers"])
+        latencies = []
+        counts = {"ok": 0, "insufficient": 0, "errors": 0}
+        lock = threading.Lock()
+
+        def writer(index):
+            rng = random.Random(options["seed"] + index)
+            local_latencies = []
+            local_counts = dict.fromkeys(counts, 0)
+            try:
+                barrier.wait()
+                for _ in range(options["orders"]):
+                    lines = rng.randint(1, min(2, len(product_ids)))
+                    items = [
+                        {"productId": pk, "quantity": rng.randint(1, 2)}
+                        for pk in rng.sample(product_ids, lines)
+                    ]
+                    started = time.perf_counter()
+                    result = graphql_sync(
+                        schema,
+                        CREATE_ORDER,
+                        variable_values={"customerId": customer.pk, "items": items},
+                        context_value=SimpleNamespace(),
+                    )
+                    local_latencies.append(time.perf_counter() - started)
+
+                    payload = (result.data or {}).get("createOrder") or {}
+                    if payload.get("success"):
+                        local_counts["ok"] += 1
+                    elif any(
+                        "Insufficient stock" in error
+                        for error in payload.get("errors") or []
+                    ):
+                        local_counts["insufficient"] += 1
+                    else:
+                        local_counts["errors"] += 1
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(local_latencies)
+                    for key, value in local_counts.items():
+                        counts[key] += value
+
+        threads = [
+            threading.Thread(target=writer, args=(i,))
+            for i in range(options["writers"])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        # Units sold must match the stock that disappeared: no oversell, no lost update
+        remaining = sum(Product.objects.values_list("stock", flat=True))
+        sold = sum(OrderItem.objects.values_list("quantity", flat=True))
+        latencies.sort()
+        return {
+            "mode": mode,
+            "throughput": counts["ok"] / elapsed if elapsed else 0.0,
+            **counts,
+            "p50": statistics.median(latencies) * 1000 if latencies else 0.0,
+            "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000
+            if latencies
+            else 0.0,
+            "consistent": remaining >= 0 and initial_stock - remaining == sold,
+        }
+
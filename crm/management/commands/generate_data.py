@@ -0,0 +1,112 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.synthetic import DatasetPlan, clear, existing_rows, generate
+
+
+def end_date(value):
+    """--end as midnight UTC of an ISO date"""
+    date = datetime.date.fromisoformat(value)
+    return datetime.datetime.combine(date, datetime.time(), datetime.timezone.utc)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic synthetic dataset of customers, products and "
+        "orders at a configurable scale"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=10000)
+        parser.add_argument("--products", type=int, default=1000)
+        parser.add_argument("--orders", type=int, default=100000)
+        parser.add_argument(
+            "--max-lines", type=int, default=5, help="Most line items per order"
+        )
+        parser.add_argument(
+            "--product-skew",
+            type=float,
+            default=1.1,
+            help="Zipf exponent of product popularity",
+        )
+        parser.add_argument(
+            "--customer-skew",
+            type=float,
+            default=0.6,
+            help="Zipf exponent of orders per customer",
+        )
+        parser.add_argument(
+            "--days", type=int, default=730, help="Days of order history"
+        )
+        parser.add_argument(
+            "--end",
+            type=end_date,
+            default=None,
+            help="Last day of order history as YYYY-MM-DD (default: today); "
+            "fix it to regenerate identical data",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Rows generated and inserted per transaction",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Processes building chunks in parallel",
+        )
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Delete existing customers, products and orders first",
+        )
+
+    def handle(self, *args, **options):
+        if options["orders"] and not (options["customers"] and options["products"]):
+            raise CommandError("Orders need at least one customer and one product")
+        if options["clear"]:
+            clear()
+        elif existing_rows():
+            raise CommandError(
+                "The database already holds CRM rows; pass --clear to replace them"
+            )
+
+        plan = DatasetPlan(
+            customers=options["customers"],
+            products=options["products"],
+            orders=options["orders"],
+            max_lines=options["max_lines"],
+            product_skew=options["product_skew"],
+            customer_skew=options["customer_skew"],
+            days=options["days"],
+            end=options["end"],
+            chunk_size=options["chunk_size"],
+            seed=options["seed"],
+        )
+        started = time.perf_counter()
+        self.reported = 0.0
+        generate(plan, workers=options["workers"], progress=self.progress)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {options['customers']} customers, {options['products']} "
+                f"products and {options['orders']} orders in "
+                f"{time.perf_counter() - started:.1f}s"
+            )
+        )
+
+    def progress(self, table, done, total, lines, seconds):
+        # At most once a second, and when a table is complete
+        if done < total and seconds - self.reported < 1:
+            return
+        self.reported = 0.0 if done == total else seconds
+        rate = done / seconds if seconds else 0.0
+        line_items = f", {lines} line items" if lines else ""
+        self.stdout.write(
+            f"{table}: {done}/{total} ({done / total:.0%}){line_items}, "
+            f"{seconds:.1f}s, {rate:,.0f} rows/s"
+        )
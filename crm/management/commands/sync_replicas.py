@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.replication import database_file, replicator
+from crm.routers import get_replica_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database into the local read replicas of "
+        "CRM_REPLICAS, once or continuously"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--watch",
+            action="store_true",
+            help="Keep copying whenever the primary changes",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Seconds between checks with --watch (default: STAND_IN_INTERVAL or 1)",
+        )
+
+    def handle(self, *args, **options):
+        replica_settings = get_replica_settings()
+        if not replica_settings["READ_ALIASES"]:
+            raise CommandError("CRM_REPLICAS has no READ_ALIASES")
+        if database_file(replica_settings["PRIMARY"]) is None:
+            raise CommandError("The stand-in replication copies SQLite files only")
+
+        copied = replicator.sync(replica_settings, force=True)
+        self.stdout.write(f"Copied the primary to {copied} replica(s)")
+        if not options["watch"]:
+            return
+
+        interval = options["interval"] or replica_settings["STAND_IN_INTERVAL"] or 1
+        self.stdout.write(f"Watching for changes every {interval}s, Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(interval)
+                copied = replicator.sync(replica_settings)
+                if copied:
+                    self.stdout.write(f"Copied the primary to {copied} replica(s)")
+        except KeyboardInterrupt:
+            pass
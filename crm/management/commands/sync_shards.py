@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.models import Customer, Product
+from crm.sharding import get_sharding_settings, sync_shared_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy every customer and product from the primary to the order shards "
+        "of CRM_SHARDING, e.g. after enabling sharding on existing data"
+    )
+
+    def handle(self, *args, **options):
+        aliases = get_sharding_settings()["ALIASES"]
+        if not aliases:
+            raise CommandError("CRM_SHARDING has no ALIASES")
+
+        for model in (Customer, Product):
+            copied = sync_shared_rows(model)
+            self.stdout.write(
+                f"Copied {copied} {model._meta.verbose_name_plural} "
+                f"to {len(aliases)} shard(s)"
+            )
@@ -0,0 +1,66 @@
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def fill_unit_prices(apps, schema_editor):
+    OrderItem = apps.get_model("crm", "OrderItem")
+    Product = apps.get_model("crm", "Product")
+    prices = models.Subquery(
+        Product.objects.filter(pk=models.OuterRef("product_id")).values("price")[:1]
+    )
+    OrderItem.objects.filter(unit_price__isnull=True).update(unit_price=prices)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0002_persistedquery'),
+    ]
+
+    operations = [
+        # The existing many-to-many table becomes the OrderItem table in place
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderItem',
+                    fields=[
+                        # The many-to-many table's id column is an integer
+                        ('id', models.AutoField(primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='crm.order')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='crm.product')),
+                    ],
+                    options={
+                        'db_table': 'crm_order_products',
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='products',
+                    field=models.ManyToManyField(related_name='orders', through='crm.OrderItem', to='crm.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(fill_unit_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=10),
+        ),
+    ]
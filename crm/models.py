@@ -1,8 +1,24 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, Value, When
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from decimal import Decimal
 
+from .response_cache import InvalidatingQuerySet
+from .sharding import ReplicatedQuerySet
+
+
+class InsufficientStock(Exception):
+    """Raised when a stock reservation cannot be fully satisfied"""
+
+    def __init__(self, product_ids=()):
+        self.product_ids = list(product_ids)
+        super().__init__(
+            "Insufficient stock for product ID(s): "
+            + ", ".join(str(pk) for pk in self.product_ids)
+        )
+
 
 class Customer(models.Model):
     """Customer model for CRM system"""
@@ -19,8 +35,16 @@ class Customer(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ReplicatedQuerySet.as_manager()
+
     class Meta:
         ordering = ["name"]
+        indexes = [
+            # Default ordering of customer pages
+            models.Index(fields=["name"], name="crm_customer_name_idx"),
+            models.Index(fields=["created_at"], name="crm_customer_created_idx"),
+            models.Index(fields=["phone"], name="crm_customer_phone_idx"),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.email})"
@@ -35,8 +59,24 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ReplicatedQuerySet.as_manager()
+
     class Meta:
         ordering = ["name"]
+        indexes = [
+            # Default ordering of product pages
+            models.Index(fields=["name"], name="crm_product_name_idx"),
+            models.Index(fields=["stock"], name="crm_product_stock_idx"),
+            models.Index(fields=["price"], name="crm_product_price_idx"),
+            models.Index(fields=["created_at"], name="crm_product_created_idx"),
+            # Only the rows matched by ProductFilter.low_stock (stock < 10);
+            # ignored on backends without partial indexes
+            models.Index(
+                fields=["stock"],
+                condition=models.Q(stock__lt=10),
+                name="crm_product_low_stock_idx",
+            ),
+        ]
 
     def clean(self):
         if self.price <= 0:
@@ -46,6 +86,35 @@ class Product(models.Model):
         self.full_clean()
         super().save(*args, **kwargs)
 
+    @classmethod
+    def reserve_stock(cls, quantities):
+        """Decrement stock for {product_id: quantity} with one conditional UPDATE
+
+        The stock check happens in the UPDATE's WHERE clause, so concurrent
+        writers never read-modify-write. Either every product is reserved or
+        none is; InsufficientStock names the products that fell short.
+        """
+        requested = Case(
+            *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+            output_field=models.PositiveIntegerField(),
+        )
+        products = cls.objects.filter(pk__in=list(quantities))
+        try:
+            with transaction.atomic():
+                reserved = products.filter(stock__gte=requested).update(
+                    stock=F("stock") - requested, updated_at=timezone.now()
+                )
+                if reserved != len(quantities):
+                    # Undo the rows that did match
+                    raise InsufficientStock()
+        except InsufficientStock:
+            available = dict(products.values_list("pk", "stock"))
+            raise InsufficientStock(
+                pk
+                for pk, quantity in quantities.items()
+                if available.get(int(pk), 0) < quantity
+            )
+
     def __str__(self):
         return f"{self.name} - ${self.price}"
 
@@ -56,24 +125,100 @@ class Order(models.Model):
     customer = models.ForeignKey(
         Customer, on_delete=models.CASCADE, related_name="orders"
     )
-    products = models.ManyToManyField(Product, related_name="orders")
-    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    products = models.ManyToManyField(
+        Product, through="OrderItem", related_name="orders"
+    )
+    total_amount = models.DecimalField(
+        max_digits=10, decimal_places=2, default=Decimal("0")
+    )
     order_date = models.DateTimeField(auto_now_add=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = InvalidatingQuerySet.as_manager()
+
     class Meta:
         ordering = ["-order_date"]
+        indexes = [
+            # Default ordering and keyset pages: ORDER BY order_date DESC, id
+            models.Index(fields=["-order_date", "id"], name="crm_order_date_id_idx"),
+            # A customer's order history by date
+            models.Index(
+                fields=["customer", "order_date"], name="crm_order_customer_date_idx"
+            ),
+            models.Index(fields=["total_amount"], name="crm_order_total_idx"),
+            models.Index(fields=["created_at"], name="crm_order_created_idx"),
+        ]
 
     def calculate_total(self):
-        """Calculate total amount based on associated products"""
-        return sum(product.price for product in self.products.all())
+        """Calculate total amount from the line items in a single aggregate query"""
+        total = self.items.aggregate(
+            total=Sum(
+                F("quantity") * F("unit_price"),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            )
+        )["total"]
+        return total or Decimal("0")
+
+    def update_total(self):
+        """Recalculate and persist total_amount after the line items changed"""
+        self.total_amount = self.calculate_total()
+        Order.objects.using(self._state.db).filter(pk=self.pk).update(
+            total_amount=self.total_amount
+        )
+
+    def __str__(self):
+        return f"Order #{self.id} - {self.customer.name} - ${self.total_amount}"
+
+
+class OrderItem(models.Model):
+    """Order line item with the quantity and the unit price captured at order time"""
+
+    # The former many-to-many table's integer id, not the app's BigAutoField
+    id = models.AutoField(primary_key=True, verbose_name="ID")
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="order_items"
+    )
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True)
+
+    objects = InvalidatingQuerySet.as_manager()
+
+    class Meta:
+        # Reuses the table of the former auto-created many-to-many
+        db_table = "crm_order_products"
+        unique_together = [("order", "product")]
+        indexes = [
+            # Orders containing a product; the unique constraint covers the
+            # (order, product) direction
+            models.Index(
+                fields=["product", "order"], name="crm_item_product_order_idx"
+            ),
+        ]
 
     def save(self, *args, **kwargs):
+        if self.unit_price is None:
+            self.unit_price = self.product.price
         super().save(*args, **kwargs)
-        self.total_amount = self.calculate_total()
-        if self.total_amount != self.calculate_total():
-            super().save(update_fields=["total_amount"])
+
+    @property
+    def line_total(self):
+        return self.quantity * self.unit_price
 
     def __str__(self):
-        return f"Order #{self.id} - {self.customer.name} - ${self.total_amount}"
+        return f"{self.quantity} x {self.product.name} @ ${self.unit_price}"
+
+
+class PersistedQuery(models.Model):
+    """GraphQL document registered under the SHA-256 hash of its text"""
+
+    sha256_hash = models.CharField(max_length=64, unique=True)
+    query = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return self.sha256_hash
@@ -0,0 +1,154 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+from .sharding import get_sharding_settings, is_sharded
+
+# Columns read by GraphQL fields that are computed from a model's columns,
+# so .only() doesn't defer them and load them one row at a time
+COMPUTED_FIELD_COLUMNS = {
+    "crm.OrderItem": {"line_total": ("quantity", "unit_price")},
+}
+
+
+def optimize_queryset(queryset, info):
+    """Apply select_related/prefetch_related and column projection for the selection set"""
+    selections = _node_selections(info.field_nodes, info)
+    return _apply_plan(queryset, selections, info)
+
+
+def _apply_plan(queryset, selections, info, extra_columns=()):
+    """Optimize a queryset whose rows are resolved with the given selections"""
+    model = queryset.model
+    select_paths, prefetches, columns = _plan(model, selections, info)
+
+    # Keep the columns the queryset sorts by so cursors can be built from rows
+    ordering = queryset.query.order_by or model._meta.ordering
+    columns.extend(
+        _concrete_names(model, (o.lstrip("-") for o in ordering if isinstance(o, str)))
+    )
+    columns.extend(extra_columns)
+
+    if select_paths:
+        queryset = queryset.select_related(*select_paths)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset.only(*dict.fromkeys(columns))
+
+
+def _plan(model, selections, info, prefix=""):
+    """Collect select_related paths, Prefetch objects and columns for a model"""
+    select_paths = []
+    prefetches = []
+    columns = [prefix + model._meta.pk.name]
+
+    computed = COMPUTED_FIELD_COLUMNS.get(model._meta.label, {})
+    for name, nodes in selections.items():
+        field = _model_field(model, name)
+        if field is None:
+            columns.extend(
+                prefix + column for column in computed.get(to_snake_case(name), ())
+            )
+            continue
+        if not field.is_relation:
+            columns.append(prefix + field.name)
+            continue
+
+        child_selections = _node_selections(nodes, info)
+        path = prefix + _lookup_name(field)
+
+        if field.many_to_one or field.one_to_one:
+            # The foreign key column itself is required to traverse the join
+            columns.append(path)
+            child_paths, child_prefetches, child_columns = _plan(
+                field.related_model, child_selections, info, prefix=path + "__"
+            )
+            select_paths.append(path)
+            select_paths.extend(child_paths)
+            prefetches.extend(child_prefetches)
+            columns.extend(child_columns)
+        elif (
+            get_sharding_settings()["ALIASES"]
+            and is_sharded(field.related_model)
+            and not is_sharded(model)
+        ):
+            # One prefetch query can't span the shards; the loaders split it
+            continue
+        elif _selects_connection(nodes, info):
+            # The loaders fetch only each parent's rows in the requested page
+            continue
+        else:
+            # Reverse foreign keys match prefetched rows to parents by that key
+            extra_columns = [field.field.name] if field.one_to_many else []
+            child_queryset = _apply_plan(
+                field.related_model._default_manager.all(),
+                child_selections,
+                info,
+                extra_columns=extra_columns,
+            )
+            prefetches.append(Prefetch(path, queryset=child_queryset))
+
+    return select_paths, prefetches, columns
+
+
+def _model_field(model, name):
+    """Return the model field behind a GraphQL field name, if any"""
+    try:
+        return model._meta.get_field(to_snake_case(name))
+    except FieldDoesNotExist:
+        return None
+
+
+def _concrete_names(model, names):
+    """Keep the names that refer to concrete columns of the model"""
+    for name in names:
+        field = _model_field(model, name)
+        if field is not None and field.concrete:
+            yield field.name
+
+
+def _lookup_name(field):
+    """Name used by select_related/prefetch_related for a forward or reverse relation"""
+    if field.auto_created and not field.concrete:
+        return field.get_accessor_name()
+    return field.name
+
+
+def _selects_connection(field_nodes, info):
+    """Whether the nodes select a relay connection rather than a list"""
+    return any(
+        child.name.value in ("edges", "pageInfo", "totalCount")
+        for field_node in field_nodes
+        if field_node.selection_set is not None
+        for child in _iter_fields(field_node.selection_set, info)
+    )
+
+
+def _node_selections(field_nodes, info):
+    """Map field names to their nodes, unwrapping relay edges/node and fragments"""
+    selections = {}
+    for field_node in field_nodes:
+        if field_node.selection_set is None:
+            continue
+        for child in _iter_fields(field_node.selection_set, info):
+            selections.setdefault(child.name.value, []).append(child)
+
+    # Connections nest the object's own fields under edges { node { ... } }
+    if "edges" in selections:
+        edges = _node_selections(selections["edges"], info)
+        return _node_selections(edges.get("node", []), info)
+    return selections
+
+
+def _iter_fields(selection_set, info):
+    """Yield the field nodes of a selection set, expanding fragments"""
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _iter_fields(selection.selection_set, info)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = info.fragments.get(selection.name.value)
+            if fragment is not None:
+                yield from _iter_fields(fragment.selection_set, info)
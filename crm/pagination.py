@@ -0,0 +1,267 @@
+import base64
+import binascii
+import datetime
+import json
+from decimal import Decimal
+from functools import partial
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import F, Q
+from graphene.relay import PageInfo
+from graphql import GraphQLError
+
+from .async_utils import run_in_worker
+
+KEYSET_CURSOR_PREFIX = "keyset:"
+
+
+def encode_keyset_cursor(values):
+    """Encode a tuple of sort key values as an opaque cursor"""
+    payload = json.dumps([_encode_value(value) for value in values])
+    return base64.b64encode((KEYSET_CURSOR_PREFIX + payload).encode()).decode()
+
+
+def decode_keyset_cursor(cursor, size):
+    """Decode a cursor produced by encode_keyset_cursor for a sort of the given size"""
+    try:
+        decoded = base64.b64decode(cursor.encode(), validate=True).decode()
+        if not decoded.startswith(KEYSET_CURSOR_PREFIX):
+            raise ValueError
+        values = json.loads(decoded[len(KEYSET_CURSOR_PREFIX) :])
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise GraphQLError(f"Invalid keyset cursor: {cursor}")
+
+    if not isinstance(values, list) or len(values) != size:
+        raise GraphQLError("Keyset cursor does not match the requested orderBy")
+    return values
+
+
+def _encode_value(value):
+    # Full precision isoformat: cursors must compare equal to the stored value
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def keyset_ordering(queryset):
+    """Return (field, descending) pairs for the queryset's ordering plus a pk tiebreaker"""
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    keys = []
+    for item in ordering:
+        if not isinstance(item, str) or item == "?":
+            raise GraphQLError("Keyset pagination requires plain field orderBy values")
+        keys.append((item.lstrip("-"), item.startswith("-")))
+
+    pk_names = {"pk", queryset.model._meta.pk.name}
+    if not any(name in pk_names for name, _ in keys):
+        keys.append(("pk", False))
+    return keys
+
+
+class ShardedRows:
+    """Rows of a queryset on several shards, merged in the queryset's order
+
+    Stands in for the queryset in offset and keyset pagination: slices run
+    every shard's query up to the slice's end and merge the results, and
+    count() adds up the shards' counts.
+    """
+
+    def __init__(self, queryset, aliases, start=0):
+        self.queryset = queryset
+        self.aliases = aliases
+        self.start = start
+        self.keys = keyset_ordering(queryset)
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            total = sum(self.queryset.using(alias).count() for alias in self.aliases)
+            self._count = max(total - self.start, 0)
+        return self._count
+
+    async def acount(self):
+        return await run_in_worker(self.count)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self.fetch(None))
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("ShardedRows only supports slices")
+        start = self.start + (item.start or 0)
+        if item.stop is None:
+            # graphene slices off the offset first; stay lazy until the page
+            return ShardedRows(self.queryset, self.aliases, start)
+        return self.fetch(self.start + item.stop)[start:]
+
+    def fetch(self, stop):
+        """The first stop rows of the merge, or all of them"""
+        aliases = [f"merge_{i}" for i in range(len(self.keys))]
+        queryset = self.queryset.annotate(
+            **{alias: F(name) for alias, (name, _) in zip(aliases, self.keys)}
+        )
+        nulls_largest = connections[self.aliases[0]].features.nulls_order_largest
+        rows = []
+        for alias in self.aliases:
+            shard_queryset = queryset.using(alias)
+            rows.extend(shard_queryset if stop is None else shard_queryset[:stop])
+        # One stable sort per key, least significant first
+        for alias, (_, descending) in reversed(list(zip(aliases, self.keys))):
+            rows.sort(
+                key=partial(merge_key, alias, nulls_largest), reverse=descending
+            )
+        return rows[:stop]
+
+
+def merge_key(alias, nulls_largest, row):
+    """Sort key of a row's attribute, NULL sorted where the backend puts it"""
+    value = getattr(row, alias)
+    return ((value is None) == nulls_largest, value)
+
+
+def keyset_connection(connection, args, queryset, max_limit=None, shards=None):
+    """Build a relay connection page by seeking past the cursor's sort key tuple
+
+    With shards, the queryset runs on each of them and the pages are merged.
+    """
+    if args.get("offset"):
+        raise GraphQLError("offset cannot be combined with keyset pagination")
+
+    keys = keyset_ordering(queryset)
+    aliases = [f"keyset_{i}" for i in range(len(keys))]
+    full_queryset = queryset
+    queryset = queryset.annotate(
+        **{alias: F(name) for alias, (name, _) in zip(aliases, keys)}
+    )
+
+    after = args.get("after")
+    before = args.get("before")
+    first = args.get("first")
+    last = args.get("last")
+    database = shards[0] if shards else queryset.db
+    nulls_largest = connections[database].features.nulls_order_largest
+
+    nullable = [_is_nullable(full_queryset.model, name) for name, _ in keys]
+    if after:
+        values = decode_keyset_cursor(after, len(keys))
+        queryset = queryset.filter(
+            _seek_filter(aliases, keys, values, True, nulls_largest, nullable)
+        )
+    if before:
+        values = decode_keyset_cursor(before, len(keys))
+        queryset = queryset.filter(
+            _seek_filter(aliases, keys, values, False, nulls_largest, nullable)
+        )
+
+    forward = first is not None or last is None
+    limit = first if forward else last
+    if limit is None:
+        limit = max_limit
+
+    ordering = [
+        ("-" if descending == forward else "") + alias
+        for alias, (_, descending) in zip(aliases, keys)
+    ]
+    queryset = queryset.order_by(*ordering)
+    if shards:
+        queryset = ShardedRows(queryset, shards)
+        full_queryset = ShardedRows(full_queryset, shards)
+
+    # Fetch one extra row to learn whether another page exists
+    if limit is not None:
+        nodes = list(queryset[: limit + 1])
+        has_more = len(nodes) > limit
+        nodes = nodes[:limit]
+    else:
+        nodes = list(queryset)
+        has_more = False
+    if not forward:
+        nodes.reverse()
+
+    edges = [
+        connection.Edge(
+            node=node,
+            cursor=encode_keyset_cursor(getattr(node, alias) for alias in aliases),
+        )
+        for node in nodes
+    ]
+    page_info = PageInfo(
+        start_cursor=edges[0].cursor if edges else None,
+        end_cursor=edges[-1].cursor if edges else None,
+        has_previous_page=has_more if not forward else bool(after),
+        has_next_page=has_more if forward else bool(before),
+    )
+
+    resolved = connection(edges=edges, page_info=page_info)
+    resolved.iterable = full_queryset
+    # Counted lazily, only when the client selects totalCount
+    resolved.length = None
+    return resolved
+
+
+def _is_nullable(model, name):
+    """Whether a sort key can be NULL: a nullable column or an outer join"""
+    if name == "pk":
+        return False
+    field = None
+    for part in name.split("__"):
+        if field is not None:
+            model = field.related_model
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return True
+        if field.null or not field.concrete:
+            return True
+    return False
+
+
+def _seek_filter(aliases, keys, values, forward, nulls_largest, nullable):
+    """Rows strictly after (or before) the given sort key tuple
+
+    NULL sort keys compare as the backend orders them: larger than any value
+    when nulls_largest, smaller otherwise. The first key is also bounded on
+    its own, so the database seeks into its index instead of scanning it.
+    """
+    condition = Q()
+    for i, (alias, (_, descending)) in enumerate(zip(aliases, keys)):
+        greater = descending != forward
+        branch = _beyond(alias, values[i], greater, nulls_largest, nullable[i])
+        if branch is None:
+            # Nothing sorts beyond NULL in this direction
+            continue
+        for prev_alias, prev_value in zip(aliases[:i], values[:i]):
+            if prev_value is None:
+                branch &= Q(**{f"{prev_alias}__isnull": True})
+            else:
+                branch &= Q(**{prev_alias: prev_value})
+        condition |= branch
+
+    alias, (_, descending), value = aliases[0], keys[0], values[0]
+    greater = descending != forward
+    nulls_beyond = nullable[0] and greater == nulls_largest
+    if value is None:
+        bound = Q(**{f"{alias}__isnull": True}) if nulls_beyond else Q()
+    else:
+        bound = Q(**{f"{alias}__{'gte' if greater else 'lte'}": value})
+        if nulls_beyond:
+            bound |= Q(**{f"{alias}__isnull": True})
+    return bound & condition
+
+
+def _beyond(alias, value, greater, nulls_largest, nullable):
+    """Q for keys greater (or less) than value, or None when there are none"""
+    if value is None:
+        if greater == nulls_largest:
+            return None
+        return Q(**{f"{alias}__isnull": False})
+    branch = Q(**{f"{alias}__{'gt' if greater else 'lt'}": value})
+    if nullable and greater == nulls_largest:
+        branch |= Q(**{f"{alias}__isnull": True})
+    return branch
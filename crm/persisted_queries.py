@@ -0,0 +1,211 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import IntegrityError
+from django.utils.module_loading import import_string
+from graphql import GraphQLError
+
+from .document_cache import DocumentCache
+
+DEFAULT_SETTINGS = {
+    "BACKEND": "crm.persisted_queries.InMemoryPersistedQueryRegistry",
+    "OPTIONS": {},
+    "STRICT": False,
+    "GET_MAX_AGE": 0,
+}
+
+
+class PersistedQueryError(GraphQLError):
+    """Persisted query lookup failure reported in Apollo APQ format"""
+
+    def __init__(self, message, code, status_code=200):
+        super().__init__(message, extensions={"code": code})
+        self.status_code = status_code
+
+
+class BasePersistedQueryRegistry:
+    """Storage for GraphQL documents addressed by their SHA-256 hash"""
+
+    def get(self, query_hash):
+        raise NotImplementedError
+
+    def register(self, query_hash, query):
+        raise NotImplementedError
+
+
+class InMemoryPersistedQueryRegistry(BasePersistedQueryRegistry):
+    """Process-local LRU registry, cleared on restart
+
+    Any client can register documents, so at most max_size are kept; an
+    evicted hash is re-registered by the client's next full-text retry.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, query_hash):
+        with self._lock:
+            query = self._queries.get(query_hash)
+            if query is not None:
+                self._queries.move_to_end(query_hash)
+            return query
+
+    def register(self, query_hash, query):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._queries[query_hash] = query
+            self._queries.move_to_end(query_hash)
+            while len(self._queries) > self.max_size:
+                self._queries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Return the registry counters as a dict"""
+        with self._lock:
+            return {
+                "size": len(self._queries),
+                "max_size": self.max_size,
+                "evictions": self.evictions,
+            }
+
+
+class CachePersistedQueryRegistry(BasePersistedQueryRegistry):
+    """Registry stored in a Django cache, shared between workers"""
+
+    def __init__(self, alias="default", key_prefix="apq", timeout=None):
+        self.cache = caches[alias]
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+
+    def get(self, query_hash):
+        return self.cache.get(f"{self.key_prefix}:{query_hash}")
+
+    def register(self, query_hash, query):
+        self.cache.set(f"{self.key_prefix}:{query_hash}", query, self.timeout)
+
+
+class DatabasePersistedQueryRegistry(BasePersistedQueryRegistry):
+    """Registry backed by the PersistedQuery table, manageable from the admin"""
+
+    def get(self, query_hash):
+        from .models import PersistedQuery
+
+        return (
+            PersistedQuery.objects.filter(sha256_hash=query_hash)
+            .values_list("query", flat=True)
+            .first()
+        )
+
+    def register(self, query_hash, query):
+        from .models import PersistedQuery
+
+        try:
+            PersistedQuery.objects.get_or_create(
+                sha256_hash=query_hash, defaults={"query": query}
+            )
+        except IntegrityError:
+            # Registered concurrently by another request
+            pass
+
+
+# APQ hashes are the document cache's keys: SHA-256 of the query text
+hash_query = DocumentCache.key_for
+
+
+def get_persisted_query_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "GRAPHQL_PERSISTED_QUERIES", {})}
+
+
+def check_strict_registry(app_configs, **kwargs):
+    """System check: STRICT needs a registry that can be filled ahead of time
+
+    STRICT refuses registration by clients, and nothing else can add to a
+    process-local registry, so every query would be rejected.
+    """
+    config = get_persisted_query_settings()
+    if config["STRICT"] and issubclass(
+        import_string(config["BACKEND"]), InMemoryPersistedQueryRegistry
+    ):
+        return [
+            checks.Error(
+                "GRAPHQL_PERSISTED_QUERIES STRICT mode cannot be used with "
+                "InMemoryPersistedQueryRegistry.",
+                hint="Use DatabasePersistedQueryRegistry and register queries "
+                "in the admin, or CachePersistedQueryRegistry.",
+                id="crm.E001",
+            )
+        ]
+    return []
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Return the registry configured by GRAPHQL_PERSISTED_QUERIES"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                config = get_persisted_query_settings()
+                _registry = import_string(config["BACKEND"])(**config["OPTIONS"])
+    return _registry
+
+
+def resolve_persisted_query(query, extensions):
+    """Return the query text to execute for a request's query and extensions"""
+    config = get_persisted_query_settings()
+    registry = get_registry()
+    if query is not None and not isinstance(query, str):
+        raise PersistedQueryError("Query must be a string", "BAD_REQUEST", 400)
+    if extensions and not isinstance(extensions, dict):
+        raise PersistedQueryError("Extensions must be an object", "BAD_REQUEST", 400)
+    persisted = (extensions or {}).get("persistedQuery")
+
+    if not persisted:
+        if query and config["STRICT"] and registry.get(hash_query(query)) is None:
+            raise PersistedQueryError(
+                "Query is not registered", "PERSISTED_QUERY_NOT_ALLOWED", 400
+            )
+        return query
+
+    if not isinstance(persisted, dict):
+        raise PersistedQueryError(
+            "persistedQuery must be an object", "PERSISTED_QUERY_NOT_SUPPORTED", 400
+        )
+    if persisted.get("version") != 1:
+        raise PersistedQueryError(
+            "Unsupported persisted query version", "PERSISTED_QUERY_NOT_SUPPORTED", 400
+        )
+    query_hash = persisted.get("sha256Hash")
+    if not query_hash or not isinstance(query_hash, str):
+        raise PersistedQueryError(
+            "Missing persisted query hash", "PERSISTED_QUERY_NOT_SUPPORTED", 400
+        )
+
+    registered = registry.get(query_hash)
+    if registered is not None:
+        return registered
+
+    if not query:
+        # The client retries with the full text once it sees this code
+        raise PersistedQueryError("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+    if hash_query(query) != query_hash:
+        raise PersistedQueryError(
+            "Provided sha does not match query", "PERSISTED_QUERY_HASH_MISMATCH", 400
+        )
+    if config["STRICT"]:
+        raise PersistedQueryError(
+            "Query is not registered", "PERSISTED_QUERY_NOT_ALLOWED", 400
+        )
+
+    registry.register(query_hash, query)
+    return query
@@ -0,0 +1,149 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def database_file(alias):
+    """Path of an alias's SQLite file, or None for other backends and memory"""
+    settings_dict = connections.settings[alias]
+    name = str(settings_dict["NAME"])
+    if settings_dict["ENGINE"] != "django.db.backends.sqlite3":
+        return None
+    if name == ":memory:" or name.startswith("file:"):
+        return None
+    return name
+
+
+def copy_database(source, target):
+    """Copy one SQLite file into another with the online backup API
+
+    The copy is a consistent snapshot that includes committed WAL frames;
+    readers of the target keep their own snapshot until it completes.
+    """
+    source_connection = sqlite3.connect(source)
+    target_connection = sqlite3.connect(target, timeout=5)
+    try:
+        source_connection.backup(target_connection)
+    finally:
+        target_connection.close()
+        source_connection.close()
+
+
+class StandInReplicator:
+    """Replication stand-in keeping local SQLite replicas in sync
+
+    Copies the primary's file into every read alias whenever the primary
+    changed, at most once per interval; the interval is the lag a real
+    replica would have.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._signature = None
+        self.reset_stats()
+
+    def start(self, replica_settings):
+        """Sync once, then keep syncing in a background thread"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.sync(replica_settings)
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(replica_settings,),
+                name="crm-replicator",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _run(self, replica_settings):
+        while True:
+            time.sleep(replica_settings["STAND_IN_INTERVAL"])
+            try:
+                self.sync(replica_settings)
+            except Exception:
+                logger.exception("Stand-in replication failed")
+
+    def signature(self, path):
+        """Modification times and sizes of a database and its WAL"""
+        signature = []
+        for suffix in ("", "-wal"):
+            try:
+                stat = os.stat(path + suffix)
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def sync(self, replica_settings, force=False):
+        """Copy the primary into every read alias if it changed since the last copy
+
+        Returns the number of replicas copied.
+        """
+        source = database_file(replica_settings["PRIMARY"])
+        if source is None:
+            return 0
+        signature = self.signature(source)
+        if not force and signature == self._signature:
+            return 0
+
+        copied = 0
+        started = time.perf_counter()
+        for alias in replica_settings["READ_ALIASES"]:
+            target = database_file(alias)
+            if target is None:
+                continue
+            try:
+                copy_database(source, target)
+            except sqlite3.OperationalError as e:
+                # A busy replica is caught up on the next run
+                logger.warning("Could not copy %s to %s: %s", source, alias, e)
+                self._count("failures")
+                signature = None
+            else:
+                copied += 1
+        elapsed = time.perf_counter() - started
+
+        self._signature = signature
+        self._count("runs")
+        with self._lock:
+            self.copy_seconds += elapsed
+            self.max_copy_seconds = max(self.max_copy_seconds, elapsed)
+            self.last_sync = time.time()
+        return copied
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def reset_stats(self):
+        with self._lock:
+            self.runs = self.failures = 0
+            self.copy_seconds = self.max_copy_seconds = 0.0
+            self.last_sync = None
+
+    def stats(self):
+        """Return the replication counters as a dict"""
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "failures": self.failures,
+                "avg_copy_ms": self.copy_seconds / self.runs * 1000
+                if self.runs
+                else 0.0,
+                "max_copy_ms": self.max_copy_seconds * 1000,
+                "last_sync": self.last_sync,
+            }
+
+
+# Shared by every thread of the process
+replicator = StandInReplicator()
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.utils.module_loading import import_string
+from graphene.relay import Connection
+from graphene_django import DjangoObjectType
+from graphql import (
+    ExecutionResult,
+    OperationType,
+    TypeInfo,
+    TypeInfoVisitor,
+    Visitor,
+    get_named_type,
+    print_ast,
+    visit,
+)
+
+DEFAULT_SETTINGS = {
+    # Responses are only cached when enabled
+    "ENABLED": False,
+    "CACHE_ALIAS": "default",
+    "KEY_PREFIX": "gqlrc",
+    # Seconds a cached response lives without being invalidated
+    "TIMEOUT": 300,
+    # Callable mapping a request to the scope its responses are shared within
+    "SCOPE": "crm.response_cache.user_scope",
+}
+
+
+def get_response_cache_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "GRAPHQL_RESPONSE_CACHE", {})}
+
+
+def user_scope(request):
+    """Share responses between anonymous users, but never across accounts"""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return "anonymous"
+
+
+def model_tag(model):
+    return model._meta.label_lower
+
+
+class CacheLookup:
+    """Cache key, tags and tag versions of one operation, taken before it runs"""
+
+    def __init__(self, key, tags, versions, bumped_at=0.0):
+        self.key = key
+        self.tags = tags
+        self.versions = versions
+        # When any of the tags was last bumped, as a timestamp
+        self.bumped_at = bumped_at
+        self.started = time.time()
+
+
+class ResponseCache:
+    """Cache of query results in the Django cache, invalidated by model tags
+
+    Each entry records the version of every model tag it read. Writing a
+    model bumps its tag version, which turns every entry that read the model
+    stale at once, without having to find or delete them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models_by_type = {}
+        self.reset_stats()
+
+    @property
+    def settings(self):
+        return get_response_cache_settings()
+
+    @property
+    def cache(self):
+        return caches[self.settings["CACHE_ALIAS"]]
+
+    def tag_key(self, tag):
+        return f"{self.settings['KEY_PREFIX']}:tag:{tag}"
+
+    def bumped_key(self, tag):
+        return f"{self.settings['KEY_PREFIX']}:bumped:{tag}"
+
+    def is_cacheable(self, operation_ast):
+        return (
+            self.settings["ENABLED"]
+            and operation_ast is not None
+            and operation_ast.operation == OperationType.QUERY
+        )
+
+    def lookup(self, request, schema, document, variables, operation_name):
+        """Build the CacheLookup of an operation"""
+        scope = import_string(self.settings["SCOPE"])(request)
+        fingerprint = json.dumps(
+            [print_ast(document), operation_name, variables or {}, scope],
+            sort_keys=True,
+            cls=DjangoJSONEncoder,
+        )
+        key = "{}:response:{}".format(
+            self.settings["KEY_PREFIX"],
+            hashlib.sha256(fingerprint.encode("utf-8")).hexdigest(),
+        )
+        tags = sorted(self.document_tags(schema, document))
+        bumped = self.cache.get_many([self.bumped_key(tag) for tag in tags])
+        return CacheLookup(
+            key, tags, self.tag_versions(tags), max(bumped.values(), default=0.0)
+        )
+
+    def document_tags(self, schema, document):
+        """Tags of the models behind every type a document selects"""
+        type_info = TypeInfo(schema)
+        found = set()
+        models_by_type = self._models_by_type
+        resolve_model = self._model_for_type
+
+        class TagCollector(Visitor):
+            def enter_field(self, node, *args):
+                field_type = type_info.get_type()
+                if field_type is None:
+                    return
+                named_type = get_named_type(field_type)
+                if named_type.name not in models_by_type:
+                    models_by_type[named_type.name] = resolve_model(named_type)
+                model = models_by_type[named_type.name]
+                if model is not None:
+                    found.add(model_tag(model))
+
+        visit(document, TypeInfoVisitor(type_info, TagCollector()))
+        return found
+
+    @staticmethod
+    def _model_for_type(graphql_type):
+        graphene_type = getattr(graphql_type, "graphene_type", None)
+        if not isinstance(graphene_type, type):
+            return None
+        if issubclass(graphene_type, Connection):
+            # Counts and pages change with the rows of the node model
+            graphene_type = graphene_type._meta.node
+        if issubclass(graphene_type, DjangoObjectType):
+            return graphene_type._meta.model
+        return None
+
+    def tag_versions(self, tags):
+        keys = {tag: self.tag_key(tag) for tag in tags}
+        versions = self.cache.get_many(keys.values())
+        missing = [key for key in keys.values() if key not in versions]
+        if missing:
+            # Time based, so a tag evicted and recreated never repeats a version
+            for key in missing:
+                self.cache.add(key, time.time_ns(), None)
+            versions.update(self.cache.get_many(missing))
+        return {tag: versions.get(key) for tag, key in keys.items()}
+
+    def get(self, lookup):
+        """Return the cached ExecutionResult, or None on a miss"""
+        entry = self.cache.get(lookup.key)
+        if entry is None:
+            self._count("misses")
+            return None
+        if entry["versions"] != lookup.versions:
+            # A tag was bumped since the entry was filled
+            self._count("stale")
+            return None
+        self._count("hits")
+        return ExecutionResult(data=entry["data"])
+
+    def set(self, lookup, result, elapsed, lag=0):
+        """Store a successful result with the tag versions read before it ran
+
+        lag is how far behind the primary the rows it read may be, e.g. on a
+        replica. A result read within that long of a write to its models may
+        predate the write, yet carry the bumped versions, so it isn't stored.
+        """
+        if result.errors:
+            return
+        if lag and lookup.bumped_at > lookup.started - lag:
+            self._count("lagged")
+            return
+        self.cache.set(
+            lookup.key,
+            {"data": result.data, "versions": lookup.versions},
+            self.settings["TIMEOUT"],
+        )
+        with self._lock:
+            self.fills += 1
+            self.fill_seconds += elapsed
+            self.max_fill_seconds = max(self.max_fill_seconds, elapsed)
+
+    def invalidate(self, *models, using=None):
+        """Bump the tags of models once the current transaction commits"""
+        if not self.settings["ENABLED"]:
+            return
+        tags = {model_tag(model) for model in models}
+        transaction.on_commit(lambda: self.bump(tags), using=using)
+
+    def bump(self, tags):
+        self.cache.set_many(
+            {self.bumped_key(tag): time.time() for tag in tags}, None
+        )
+        for tag in tags:
+            try:
+                self.cache.incr(self.tag_key(tag))
+            except ValueError:
+                # Never read yet: no entry can depend on it
+                pass
+            with self._lock:
+                self.invalidations[tag] = self.invalidations.get(tag, 0) + 1
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.stale = self.fills = self.lagged = 0
+            self.fill_seconds = self.max_fill_seconds = 0.0
+            self.invalidations = {}
+
+    def stats(self):
+        """Return the cache counters as a dict"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "fills": self.fills,
+                "lagged": self.lagged,
+                "avg_fill_ms": self.fill_seconds / self.fills * 1000
+                if self.fills
+                else 0.0,
+                "max_fill_ms": self.max_fill_seconds * 1000,
+                "invalidations": dict(self.invalidations),
+            }
+
+
+# Shared by every GraphQL view in the process
+response_cache = ResponseCache()
+
+
+class InvalidatingQuerySet(models.QuerySet):
+    """QuerySet whose set-based writes invalidate cached responses
+
+    update() and bulk_create() send no model signals, so they invalidate
+    the model's tag themselves.
+    """
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows:
+            response_cache.invalidate(self.model, using=self.db)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if objs:
+            response_cache.invalidate(self.model, using=self.db)
+        return objs
+
+
+def invalidate_instance(sender, using=None, **kwargs):
+    """post_save/post_delete receiver"""
+    response_cache.invalidate(sender, using=using)
+
+
+def invalidate_relation(sender, instance, action, model, using=None, **kwargs):
+    """m2m_changed receiver: both ends and the through table changed"""
+    if action.startswith("post_"):
+        response_cache.invalidate(sender, type(instance), model, using=using)
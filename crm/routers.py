@@ -0,0 +1,177 @@
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .replication import replicator
+from .sharding import (
+    SHARDED_MODELS,
+    SHARED_MODELS,
+    get_sharding_settings,
+    is_sharded,
+    shard_for_customer,
+    shard_for_instance,
+)
+
+DEFAULT_SETTINGS = {
+    "PRIMARY": "default",
+    # Aliases GraphQL queries read from; empty keeps every read on the primary
+    "READ_ALIASES": [],
+    # Seconds a client keeps reading from the primary after a mutation, so it
+    # sees its own writes; should exceed the replicas' lag
+    "PIN_SECONDS": 5,
+    # Cookie carrying the end of that window between requests
+    "PIN_COOKIE": "crm_primary_until",
+    # Seconds between copies of the stand-in replication; None for real
+    # replicas, which are kept in sync outside Django
+    "STAND_IN_INTERVAL": None,
+}
+
+# Alias the reads of the running GraphQL operation go to; None for the primary
+_read_alias = contextvars.ContextVar("read_alias", default=None)
+
+
+def get_replica_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "CRM_REPLICAS", {})}
+
+
+class ReplicaRouter:
+    """Send the reads of GraphQL queries to a replica, and the rest to the primary
+
+    Reads outside a routed query (mutations, admin, management commands)
+    and every write go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or get_replica_settings()["PRIMARY"]
+
+    def db_for_write(self, model, **hints):
+        return get_replica_settings()["PRIMARY"]
+
+    def allow_relation(self, obj1, obj2, **hints):
+        replica_settings = get_replica_settings()
+        aliases = {replica_settings["PRIMARY"], *replica_settings["READ_ALIASES"]}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            # Copies of the same data
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replica_settings()["READ_ALIASES"]:
+            # Replicas receive the primary's schema with its rows
+            return False
+        return None
+
+
+class ShardRouter:
+    """Send orders and line items to the shard of their customer
+
+    Routes by the instance Django passes as a hint: an order or line item
+    names its own shard, and so does a customer for its orders. Without a
+    hint the next router decides; GraphQL resolvers pick shards themselves.
+    """
+
+    def shard_for_hints(self, model, hints):
+        instance = hints.get("instance")
+        if instance is None or not get_sharding_settings()["ALIASES"]:
+            return None
+        if is_sharded(type(instance)):
+            # Related rows of an order are on its shard, shared copies included
+            return shard_for_instance(instance)
+        if is_sharded(model) and instance._meta.label == "crm.Customer":
+            return shard_for_customer(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.shard_for_hints(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.shard_for_hints(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = get_sharding_settings()["ALIASES"]
+        if obj1._state.db in aliases or obj2._state.db in aliases:
+            # Shared rows have the same primary key everywhere
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in get_sharding_settings()["ALIASES"]:
+            return None
+        if app_label != "crm":
+            return False
+        return model_name is None or f"crm.{model_name}" in {
+            label.lower() for label in SHARDED_MODELS | SHARED_MODELS
+        }
+
+
+def pinned_until(request):
+    """End of the request's read-your-writes window, as a timestamp"""
+    until = getattr(request, "crm_pinned_until", None)
+    if until is None:
+        cookie = request.COOKIES.get(get_replica_settings()["PIN_COOKIE"])
+        try:
+            until = float(cookie)
+        except (TypeError, ValueError):
+            until = 0.0
+        request.crm_pinned_until = until
+    return until
+
+
+def pin_to_primary(request):
+    """Keep the request, and the client for PIN_SECONDS, on the primary"""
+    request.crm_pinned_until = time.time() + get_replica_settings()["PIN_SECONDS"]
+    request.crm_pin_cookie = True
+
+
+def set_pin_cookie(request, response):
+    """Hand the read-your-writes window of a request that wrote to the client"""
+    if getattr(request, "crm_pin_cookie", False):
+        replica_settings = get_replica_settings()
+        response.set_cookie(
+            replica_settings["PIN_COOKIE"],
+            f"{request.crm_pinned_until:.3f}",
+            max_age=replica_settings["PIN_SECONDS"],
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
+
+
+def choose_read_alias(request):
+    """Replica for the reads of a query, or None to read from the primary"""
+    replica_settings = get_replica_settings()
+    if not replica_settings["READ_ALIASES"]:
+        return None
+    if pinned_until(request) > time.time():
+        return None
+    if replica_settings["STAND_IN_INTERVAL"] is not None:
+        replicator.start(replica_settings)
+    return random.choice(replica_settings["READ_ALIASES"])
+
+
+def replica_lag(request):
+    """Seconds a query of the request may read behind the primary, 0 on it"""
+    replica_settings = get_replica_settings()
+    if not replica_settings["READ_ALIASES"] or pinned_until(request) > time.time():
+        return 0
+    return replica_settings["PIN_SECONDS"]
+
+
+@contextmanager
+def route_operation(request, write):
+    """Route the database reads of one GraphQL operation
+
+    Queries read from a random replica unless the client wrote recently;
+    writes go to the primary and pin the client to it.
+    """
+    alias = None if write else choose_read_alias(request)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+        if write:
+            pin_to_primary(request)
@@ -1,14 +1,41 @@
 import graphene
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
 from django.core.exceptions import ValidationError
-from django.db import transaction
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
 from django.utils import timezone
 from decimal import Decimal
 import re
+from collections import defaultdict
 
-from .models import Customer, Product, Order
+from .models import Customer, Product, Order, OrderItem, InsufficientStock
 from .filters import CustomerFilter, ProductFilter, OrderFilter
+from .fields import BatchedConnectionField, BatchedFilterConnectionField
+from .async_utils import is_running_async
+from .loaders import get_loaders
+from .optimizer import optimize_queryset
+from .sharding import shard_atomic, shard_for_customer, shard_for_order
+from .sqlite import serialized_write
+
+
+# GraphQL Connection Types
+class CountableConnection(graphene.relay.Connection):
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(self, info):
+        # Keyset pages leave the length unset until it is actually requested
+        if self.length is None:
+            if is_running_async():
+                return self._acount()
+            self.length = self.iterable.count()
+        return self.length
+
+    async def _acount(self):
+        self.length = await self.iterable.acount()
+        return self.length
 
 
 # GraphQL Object Types
@@ -17,13 +44,36 @@ class CustomerType(DjangoObjectType):
         model = Customer
         fields = "__all__"
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
+
+    orders = BatchedConnectionField("crm.schema.OrderType", required=True)
+
+    def resolve_orders(self, info, **kwargs):
+        return get_loaders(info).customer_orders.page(kwargs).resolve(self)
 
 
 class ProductType(DjangoObjectType):
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ("order_items",)
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
+
+    orders = BatchedConnectionField("crm.schema.OrderType", required=True)
+
+    def resolve_orders(self, info, **kwargs):
+        return get_loaders(info).product_orders.page(kwargs).resolve(self)
+
+
+class OrderItemType(DjangoObjectType):
+    class Meta:
+        model = OrderItem
+        fields = ("id", "product", "quantity", "unit_price")
+
+    line_total = graphene.Decimal(required=True)
+
+    def resolve_line_total(self, info):
+        return self.line_total
 
 
 class OrderType(DjangoObjectType):
@@ -31,6 +81,19 @@ class OrderType(DjangoObjectType):
         model = Order
         fields = "__all__"
         interfaces = (graphene.relay.Node,)
+        connection_class = CountableConnection
+
+    products = BatchedConnectionField(ProductType, required=True)
+    items = graphene.List(graphene.NonNull(OrderItemType), required=True)
+
+    def resolve_customer(self, info):
+        return get_loaders(info).order_customer.resolve(self)
+
+    def resolve_products(self, info, **kwargs):
+        return get_loaders(info).order_products.page(kwargs).resolve(self)
+
+    def resolve_items(self, info):
+        return get_loaders(info).order_items.resolve(self)
 
 
 # Input Types for Mutations
@@ -46,9 +109,23 @@ class ProductInput(graphene.InputObjectType):
     stock = graphene.Int()
 
 
+class ProductFilterInput(graphene.InputObjectType):
+    ids = graphene.List(graphene.ID)
+    name = graphene.String()
+    price_gte = graphene.Decimal()
+    price_lte = graphene.Decimal()
+
+
+class OrderItemInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(default_value=1)
+
+
 class OrderInput(graphene.InputObjectType):
     customer_id = graphene.ID(required=True)
-    product_ids = graphene.List(graphene.ID, required=True)
+    # Each listed product counts as one unit; repeat an ID to order more
+    product_ids = graphene.List(graphene.ID)
+    items = graphene.List(OrderItemInput)
     order_date = graphene.DateTime()
 
 
@@ -81,6 +158,28 @@ class OrderMutationResponse(graphene.ObjectType):
     errors = graphene.List(graphene.String)
 
 
+class BulkOrderMutationResponse(graphene.ObjectType):
+    orders = graphene.List(OrderType)
+    errors = graphene.List(graphene.String)
+    success_count = graphene.Int()
+    error_count = graphene.Int()
+
+
+PHONE_PATTERNS = [
+    re.compile(r"^\+?1?\d{9,15}$"),  # International format
+    re.compile(r"^\d{3}-\d{3}-\d{4}$"),  # US format with dashes
+]
+
+# Rows per INSERT/lookup when creating customers and orders in bulk
+BULK_CREATE_BATCH_SIZE = 1000
+
+
+def _chunks(items, size):
+    """Split a list into consecutive slices of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
 # Mutation Classes
 class CreateCustomer(graphene.Mutation):
     class Arguments:
@@ -94,13 +193,9 @@ class CreateCustomer(graphene.Mutation):
         if not phone:
             return True
 
-        patterns = [
-            r"^\+?1?\d{9,15}$",  # International format
-            r"^\d{3}-\d{3}-\d{4}$",  # US format with dashes
-        ]
-
-        return any(re.match(pattern, phone) for pattern in patterns)
+        return any(pattern.match(phone) for pattern in PHONE_PATTERNS)
 
+    @serialized_write
     def mutate(self, info, input):
         try:
             # Validate email uniqueness
@@ -131,42 +226,76 @@ class CreateCustomer(graphene.Mutation):
 class BulkCreateCustomers(graphene.Mutation):
     class Arguments:
         input = graphene.List(CustomerInput, required=True)
+        batch_size = graphene.Int()
 
     Output = BulkCustomerMutationResponse
 
-    def mutate(self, info, input):
+    @serialized_write
+    def mutate(self, info, input, batch_size=None):
+        batch_size = batch_size or BULK_CREATE_BATCH_SIZE
         created_customers = []
-        errors = []
+        # Row index -> error message, reported in input order
+        errors = {}
+
+        # Look up every already registered email up front
+        emails = list({customer_data.email for customer_data in input})
+        existing_emails = set()
+        for chunk in _chunks(emails, batch_size):
+            existing_emails.update(
+                Customer.objects.filter(email__in=chunk).values_list("email", flat=True)
+            )
 
-        with transaction.atomic():
-            for i, customer_data in enumerate(input):
-                try:
-                    # Validate email uniqueness
-                    if Customer.objects.filter(email=customer_data.email).exists():
-                        errors.append(f"Customer {i+1}: Email already exists")
-                        continue
-
-                    # Validate phone format if provided
-                    if customer_data.phone and not CreateCustomer.validate_phone(
-                        customer_data.phone
-                    ):
-                        errors.append(f"Customer {i+1}: Invalid phone number format")
-                        continue
-
-                    # Create customer
-                    customer = Customer.objects.create(
+        pending = []
+        seen_emails = set()
+        for i, customer_data in enumerate(input):
+            # Validate email uniqueness against the database and the payload
+            if (
+                customer_data.email in existing_emails
+                or customer_data.email in seen_emails
+            ):
+                errors[i] = "Email already exists"
+                continue
+
+            # Validate phone format if provided
+            if customer_data.phone and not CreateCustomer.validate_phone(
+                customer_data.phone
+            ):
+                errors[i] = "Invalid phone number format"
+                continue
+
+            seen_emails.add(customer_data.email)
+            pending.append(
+                (
+                    i,
+                    Customer(
                         name=customer_data.name,
                         email=customer_data.email,
                         phone=customer_data.phone,
-                    )
-                    created_customers.append(customer)
+                    ),
+                )
+            )
 
-                except Exception as e:
-                    errors.append(f"Customer {i+1}: {str(e)}")
+        with transaction.atomic():
+            for chunk in _chunks(pending, batch_size):
+                try:
+                    with transaction.atomic():
+                        Customer.objects.bulk_create(
+                            [customer for _, customer in chunk]
+                        )
+                    created_customers.extend(customer for _, customer in chunk)
+                except IntegrityError:
+                    # A concurrent insert won the race; isolate the failing rows
+                    for i, customer in chunk:
+                        try:
+                            with transaction.atomic():
+                                customer.save(force_insert=True)
+                            created_customers.append(customer)
+                        except Exception as e:
+                            errors[i] = str(e)
 
         return BulkCustomerMutationResponse(
             customers=created_customers,
-            errors=errors,
+            errors=[f"Customer {i+1}: {error}" for i, error in sorted(errors.items())],
             success_count=len(created_customers),
             error_count=len(errors),
         )
@@ -178,6 +307,7 @@ class CreateProduct(graphene.Mutation):
 
     Output = ProductMutationResponse
 
+    @serialized_write
     def mutate(self, info, input):
         try:
             # Validate price is positive
@@ -206,70 +336,145 @@ class CreateProduct(graphene.Mutation):
             return ProductMutationResponse(success=False, errors=[str(e)])
 
 
-class CreateOrder(graphene.Mutation):
-    class Arguments:
-        input = OrderInput(required=True)
+def _in_bulk(model, ids, batch_size=BULK_CREATE_BATCH_SIZE):
+    """Fetch rows by primary key in chunks, keyed by the string form of the ID"""
+    # Malformed IDs cannot match a row; they are reported as invalid by the caller
+    ids = [pk for pk in {str(pk) for pk in ids} if pk.isdigit()]
+    rows = {}
+    for chunk in _chunks(ids, batch_size):
+        rows.update(
+            (str(pk), instance) for pk, instance in model.objects.in_bulk(chunk).items()
+        )
+    return rows
+
+
+def _order_quantities(order_data):
+    """Merge productIds and items into (quantity per product ID, error)"""
+    quantities = {}
+    for product_id in order_data.product_ids or []:
+        quantities[str(product_id)] = quantities.get(str(product_id), 0) + 1
+    for item in order_data.items or []:
+        if item.quantity is None or item.quantity < 1:
+            return None, "Quantity must be at least 1"
+        product_id = str(item.product_id)
+        quantities[product_id] = quantities.get(product_id, 0) + item.quantity
+
+    if not quantities:
+        return None, "At least one product must be selected"
+    return quantities, None
+
+
+def _build_order(order_data, quantities, customers, products):
+    """Build an unsaved order and its line items from prefetched rows
+
+    Returns (order, items, error); prices are captured from the fetched
+    products, so the total needs no further query.
+    """
+    customer = customers.get(str(order_data.customer_id))
+    if customer is None:
+        return None, None, "Invalid customer ID"
+
+    # Find which product IDs are invalid
+    invalid_ids = [pid for pid in quantities if pid not in products]
+    if invalid_ids:
+        return None, None, f"Invalid product ID(s): {', '.join(invalid_ids)}"
+
+    # Capture the current prices as the line items' unit prices
+    items = [
+        OrderItem(
+            product=products[pid],
+            quantity=quantity,
+            unit_price=products[pid].price,
+        )
+        for pid, quantity in quantities.items()
+    ]
+
+    # Validate total amount is positive
+    total_amount = sum(item.line_total for item in items)
+    if total_amount <= 0:
+        return None, None, "Order total must be greater than zero"
+
+    order = Order(
+        customer=customer,
+        total_amount=total_amount,
+        order_date=order_data.order_date or timezone.now(),
+    )
+    return order, items, None
 
-    Output = OrderMutationResponse
 
-    def mutate(self, info, input):
-        try:
-            # Validate customer exists
-            try:
-                customer = Customer.objects.get(id=input.customer_id)
-            except Customer.DoesNotExist:
-                return OrderMutationResponse(
-                    success=False, errors=["Invalid customer ID"]
-                )
+def _reserve_stock(items):
+    """Reserve stock for an order's line items, raising InsufficientStock"""
+    Product.reserve_stock({item.product_id: item.quantity for item in items})
 
-            # Validate products exist
-            if not input.product_ids:
-                return OrderMutationResponse(
-                    success=False, errors=["At least one product must be selected"]
-                )
 
-            products = Product.objects.filter(id__in=input.product_ids)
-            if len(products) != len(input.product_ids):
-                # Find which product IDs are invalid
-                found_ids = set(str(p.id) for p in products)
-                invalid_ids = [pid for pid in input.product_ids if pid not in found_ids]
-                return OrderMutationResponse(
-                    success=False,
-                    errors=[f"Invalid product ID(s): {', '.join(invalid_ids)}"],
-                )
+def _insert_orders(entries, batch_size=BULK_CREATE_BATCH_SIZE):
+    """Insert (order, items) pairs with one bulk_create per table and database"""
+    by_database = defaultdict(list)
+    for order, items in entries:
+        # Rows from a rolled back attempt must be inserted afresh
+        order.pk = None
+        for item in items:
+            item.pk = None
+        by_database[router.db_for_write(Order, instance=order)].append((order, items))
 
-            # Calculate total amount
-            total_amount = sum(product.price for product in products)
+    for using, database_entries in by_database.items():
+        with shard_atomic(using):
+            Order.objects.using(using).bulk_create(
+                [order for order, _ in database_entries], batch_size=batch_size
+            )
 
-            # Validate total amount is positive
-            if total_amount <= 0:
-                return OrderMutationResponse(
-                    success=False, errors=["Order total must be greater than zero"]
-                )
+            line_items = []
+            for order, items in database_entries:
+                for item in items:
+                    item.order = order
+                line_items.extend(items)
+            OrderItem.objects.using(using).bulk_create(
+                line_items, batch_size=batch_size
+            )
 
-            # Create order with transaction to ensure data consistency
-            with transaction.atomic():
-                order = Order.objects.create(
-                    customer=customer,
-                    total_amount=total_amount,
-                    order_date=input.order_date or timezone.now(),
-                )
 
-                # Associate products
-                order.products.set(products)
+class CreateOrder(graphene.Mutation):
+    class Arguments:
+        input = OrderInput(required=True)
 
-                # Verify total amount calculation
-                calculated_total = order.calculate_total()
-                if calculated_total != total_amount:
-                    # Update with correct total
-                    order.total_amount = calculated_total
-                    order.save(update_fields=["total_amount"])
+    Output = OrderMutationResponse
+
+    @serialized_write
+    def mutate(self, info, input):
+        try:
+            # Merge product IDs and line items into a quantity per product
+            quantities, error = _order_quantities(input)
+            if error:
+                return OrderMutationResponse(success=False, errors=[error])
+
+            # Validate customer and products exist
+            order, items, error = _build_order(
+                input,
+                quantities,
+                _in_bulk(Customer, [input.customer_id]),
+                _in_bulk(Product, quantities),
+            )
+            if error:
+                return OrderMutationResponse(success=False, errors=[error])
+
+            # Create order with transaction to ensure data consistency; under
+            # sharding the order goes to its customer's shard
+            using = router.db_for_write(Order, instance=order)
+            with transaction.atomic(), shard_atomic(using):
+                # Reserve first so the write lock is taken before anything else
+                _reserve_stock(items)
+                order.save(using=using)
+
+                # Insert every line item in one statement
+                for item in items:
+                    item.order = order
+                OrderItem.objects.using(using).bulk_create(items)
 
             return OrderMutationResponse(
                 order=order, message="Order created successfully", success=True
             )
 
-        except ValidationError as e:
+        except (InsufficientStock, ValidationError) as e:
             return OrderMutationResponse(success=False, errors=[str(e)])
         except Exception as e:
             return OrderMutationResponse(
@@ -278,6 +483,90 @@ class CreateOrder(graphene.Mutation):
             )
 
 
+class BulkCreateOrders(graphene.Mutation):
+    class Arguments:
+        input = graphene.List(OrderInput, required=True)
+        batch_size = graphene.Int()
+
+    Output = BulkOrderMutationResponse
+
+    @serialized_write
+    def mutate(self, info, input, batch_size=None):
+        batch_size = batch_size or BULK_CREATE_BATCH_SIZE
+        # Row index -> created order / error message, reported in input order
+        created_orders = {}
+        errors = {}
+
+        quantities = {}
+        for i, order_data in enumerate(input):
+            order_quantities, error = _order_quantities(order_data)
+            if error:
+                errors[i] = error
+            else:
+                quantities[i] = order_quantities
+
+        # Resolve every referenced customer and product up front
+        customers = _in_bulk(
+            Customer, [input[i].customer_id for i in quantities], batch_size
+        )
+        products = _in_bulk(
+            Product,
+            {pid for line in quantities.values() for pid in line},
+            batch_size,
+        )
+
+        pending = []
+        for i, order_quantities in quantities.items():
+            order, items, error = _build_order(
+                input[i], order_quantities, customers, products
+            )
+            if error:
+                errors[i] = error
+            else:
+                pending.append((i, order, items))
+
+        with transaction.atomic():
+            for chunk in _chunks(pending, batch_size):
+                reserved = []
+                chunk_errors = {}
+                try:
+                    with transaction.atomic():
+                        # Each reservation is all-or-nothing for its own order
+                        for i, order, items in chunk:
+                            try:
+                                _reserve_stock(items)
+                                reserved.append((i, order, items))
+                            except InsufficientStock as e:
+                                chunk_errors[i] = str(e)
+                        _insert_orders(
+                            [(order, items) for _, order, items in reserved],
+                            batch_size,
+                        )
+                    created_orders.update((i, order) for i, order, _ in reserved)
+                    errors.update(chunk_errors)
+                except IntegrityError:
+                    # A referenced row vanished mid-replay; isolate the failing orders
+                    for i, order, items in chunk:
+                        try:
+                            with transaction.atomic():
+                                _reserve_stock(items)
+                                _insert_orders([(order, items)])
+                            created_orders[i] = order
+                        except Exception as e:
+                            errors[i] = str(e)
+
+        orders = [order for _, order in sorted(created_orders.items())]
+        # Let the response's nested fields load for all orders at once
+        get_loaders(info).register(orders)
+
+        return BulkOrderMutationResponse(
+            orders=orders,
+            errors=[f"Order {i+1}: {error}" for i, error in sorted(errors.items())],
+            success_count=len(created_orders),
+            error_count=len(errors),
+        )
+
+
 # Query Class
 class Query(graphene.ObjectType):
     # Basic greeting query
@@ -289,60 +578,66 @@ class Query(graphene.ObjectType):
     order = graphene.Field(OrderType, id=graphene.ID(required=True))
 
     # Filtered list queries with ordering support
-    all_customers = DjangoFilterConnectionField(
+    all_customers = BatchedFilterConnectionField(
         CustomerType,
         filterset_class=CustomerFilter,
         orderBy=graphene.List(of_type=graphene.String),
+        keyset=graphene.Boolean(),
     )
-    all_products = DjangoFilterConnectionField(
+    all_products = BatchedFilterConnectionField(
         ProductType,
         filterset_class=ProductFilter,
         orderBy=graphene.List(of_type=graphene.String),
+        keyset=graphene.Boolean(),
     )
-    all_orders = DjangoFilterConnectionField(
+    all_orders = BatchedFilterConnectionField(
         OrderType,
         filterset_class=OrderFilter,
         orderBy=graphene.List(of_type=graphene.String),
+        keyset=graphene.Boolean(),
     )
 
     def resolve_hello(self, info):
         return "Hello, GraphQL!"
 
     def resolve_customer(self, info, id):
-        try:
-            return Customer.objects.get(id=id)
-        except Customer.DoesNotExist:
-            return None
+        queryset = optimize_queryset(Customer.objects.all(), info)
+        if is_running_async():
+            return get_loaders(info).aget_object(queryset, id)
+        return get_loaders(info).get_object(queryset, id)
 
     def resolve_product(self, info, id):
-        try:
-            return Product.objects.get(id=id)
-        except Product.DoesNotExist:
-            return None
+        queryset = optimize_queryset(Product.objects.all(), info)
+        if is_running_async():
+            return get_loaders(info).aget_object(queryset, id)
+        return get_loaders(info).get_object(queryset, id)
 
     def resolve_order(self, info, id):
-        try:
-            return Order.objects.get(id=id)
-        except Order.DoesNotExist:
-            return None
+        # The id names the order's shard
+        queryset = optimize_queryset(Order.objects.using(shard_for_order(id)), info)
+        if is_running_async():
+            return get_loaders(info).aget_object(queryset, id)
+        return get_loaders(info).get_object(queryset, id)
 
     def resolve_all_customers(self, info, orderBy=None, **kwargs):
         queryset = Customer.objects.all()
         if orderBy:
             queryset = queryset.order_by(*orderBy)
-        return queryset
+        return optimize_queryset(queryset, info)
 
     def resolve_all_products(self, info, orderBy=None, **kwargs):
         queryset = Product.objects.all()
         if orderBy:
             queryset = queryset.order_by(*orderBy)
-        return queryset
+        return optimize_queryset(queryset, info)
 
     def resolve_all_orders(self, info, orderBy=None, **kwargs):
-        queryset = Order.objects.all()
+        # One customer's orders are on a single shard; the rest are read
+        # from every shard and merged
+        queryset = Order.objects.using(shard_for_customer(kwargs.get("customer_id")))
         if orderBy:
             queryset = queryset.order_by(*orderBy)
-        return queryset
+        return optimize_queryset(queryset, info)
 
 
 class UpdateLowStockProductsResponse(graphene.ObjectType):
@@ -353,16 +648,62 @@ class UpdateLowStockProductsResponse(graphene.ObjectType):
 
 
 class UpdateLowStockProducts(graphene.Mutation):
+    class Arguments:
+        threshold = graphene.Int(default_value=10)
+        increment = graphene.Int(default_value=10)
+        filter = ProductFilterInput()
+
     Output = UpdateLowStockProductsResponse
 
     @staticmethod
-    def mutate(root, info):
-        low_stock_products = Product.objects.filter(stock__lt=10)
-        updated_products = []
-        for product in low_stock_products:
-            product.stock += 10
-            product.save(update_fields=["stock"])
-            updated_products.append(product)
+    @serialized_write
+    def mutate(root, info, threshold, increment, filter=None):
+        if threshold < 0:
+            return UpdateLowStockProductsResponse(
+                success=False, errors=["Threshold cannot be negative"]
+            )
+        if increment <= 0:
+            return UpdateLowStockProductsResponse(
+                success=False, errors=["Increment must be positive"]
+            )
+
+        queryset = Product.objects.filter(stock__lt=threshold)
+        if filter:
+            if filter.ids:
+                invalid_ids = [str(pk) for pk in filter.ids if not str(pk).isdigit()]
+                if invalid_ids:
+                    return UpdateLowStockProductsResponse(
+                        success=False,
+                        errors=[f"Invalid product ID(s): {', '.join(invalid_ids)}"],
+                    )
+                queryset = queryset.filter(id__in=filter.ids)
+            filterset = ProductFilter(
+                data={
+                    key: value
+                    for key, value in filter.items()
+                    if key != "ids" and value is not None
+                },
+                queryset=queryset,
+            )
+            if not filterset.is_valid():
+                return UpdateLowStockProductsResponse(
+                    success=False, errors=[filterset.form.errors.as_json()]
+                )
+            queryset = filterset.qs
+
+        # One UPDATE ... WHERE stock < threshold; the rows it stamped are read
+        # back in the same transaction, which holds the write lock until then
+        restocked_at = timezone.now()
+        with transaction.atomic():
+            updated_count = queryset.update(
+                stock=F("stock") + increment, updated_at=restocked_at
+            )
+            updated_products = (
+                list(Product.objects.filter(updated_at=restocked_at))
+                if updated_count
+                else []
+            )
+
         return UpdateLowStockProductsResponse(
             products=updated_products,
             message=f"Restocked {len(updated_products)} product(s) successfully.",
@@ -376,4 +717,5 @@ class Mutation(graphene.ObjectType):
     bulk_create_customers = BulkCreateCustomers.Field()
     create_product = CreateProduct.Field()
     create_order = CreateOrder.Field()
+    bulk_create_orders = BulkCreateOrders.Field()
     update_low_stock_products = UpdateLowStockProducts.Field()
@@ -0,0 +1,223 @@
+import zlib
+from collections import defaultdict
+from contextlib import nullcontext
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import QuerySet
+
+from .response_cache import InvalidatingQuerySet
+
+DEFAULT_SETTINGS = {
+    # Databases holding orders and their line items; empty keeps every order
+    # on the primary
+    "ALIASES": [],
+    # Primary keys of shard k start above k * ID_SPAN, so an order's id names
+    # its shard
+    "ID_SPAN": 10**12,
+}
+
+# Split over the shards by customer
+SHARDED_MODELS = {"crm.Order", "crm.OrderItem"}
+# Copied from the primary to every shard, so shard queries can join them
+SHARED_MODELS = {"crm.Customer", "crm.Product"}
+
+# Rows per statement when copying shared rows
+COPY_BATCH_SIZE = 500
+
+
+def get_sharding_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "CRM_SHARDING", {})}
+
+
+def is_sharded(model):
+    return model._meta.label in SHARDED_MODELS
+
+
+def shard_for_customer(customer_id):
+    """Shard holding a customer's orders, or None when sharding is off"""
+    aliases = get_sharding_settings()["ALIASES"]
+    if not aliases or customer_id is None:
+        return None
+    try:
+        key = str(int(customer_id))
+    except (TypeError, ValueError):
+        return None
+    # A stable hash: Python's hash() of strings changes between processes
+    return aliases[zlib.crc32(key.encode()) % len(aliases)]
+
+
+def shard_for_order(order_id):
+    """Shard an order id was allocated on, or None when sharding is off"""
+    sharding_settings = get_sharding_settings()
+    aliases = sharding_settings["ALIASES"]
+    try:
+        index = int(order_id) // sharding_settings["ID_SPAN"]
+    except (TypeError, ValueError):
+        return None
+    if not aliases or not 0 <= index < len(aliases):
+        return None
+    return aliases[index]
+
+
+def shard_for_instance(instance):
+    """Shard of an order or line item, saved or not"""
+    if instance._state.db in get_sharding_settings()["ALIASES"]:
+        return instance._state.db
+    if instance._meta.label == "crm.Order":
+        return shard_for_customer(instance.customer_id)
+    return shard_for_order(instance.order_id)
+
+
+def shard_atomic(alias):
+    """atomic() on an order shard; elsewhere the caller's own transaction applies
+
+    Writes spanning the primary and a shard nest this inside atomic() on the
+    primary. The shard commits first, so a failed shard write rolls the
+    primary back; the reverse, a primary failing after the shard committed,
+    is not covered.
+    """
+    if alias in get_sharding_settings()["ALIASES"]:
+        return transaction.atomic(using=alias)
+    return nullcontext()
+
+
+def scatter_aliases(queryset):
+    """Shards a queryset has to be run on, or None when it runs on one database"""
+    aliases = get_sharding_settings()["ALIASES"]
+    if (
+        aliases
+        and isinstance(queryset, QuerySet)
+        and queryset._db is None
+        and is_sharded(queryset.model)
+    ):
+        return aliases
+    return None
+
+
+def split_keys(sharded_by, keys):
+    """Group loader keys into (alias, keys) pairs, one per shard they live on
+
+    sharded_by names what the keys are: "order" ids, "customer" ids, or
+    "all" for keys whose rows may be on any shard. The alias is None when
+    sharding is off or the rows aren't sharded.
+    """
+    aliases = get_sharding_settings()["ALIASES"]
+    if not aliases or sharded_by is None:
+        return [(None, keys)]
+    if sharded_by == "all":
+        return [(alias, keys) for alias in aliases]
+
+    shard_of = shard_for_order if sharded_by == "order" else shard_for_customer
+    grouped = defaultdict(list)
+    for key in keys:
+        grouped[shard_of(key)].append(key)
+    return list(grouped.items())
+
+
+def copy_rows(model, pks):
+    """Make every shard's copy of the given shared rows match the primary"""
+    aliases = get_sharding_settings()["ALIASES"]
+    primary = router.db_for_write(model)
+    fields = [
+        field.name for field in model._meta.concrete_fields if not field.primary_key
+    ]
+    pks = list(dict.fromkeys(pks))
+    for start in range(0, len(pks), COPY_BATCH_SIZE):
+        batch = pks[start : start + COPY_BATCH_SIZE]
+        rows = list(model._base_manager.using(primary).filter(pk__in=batch))
+        deleted = set(batch) - {row.pk for row in rows}
+        for alias in aliases:
+            if rows:
+                model._base_manager.using(alias).bulk_create(
+                    rows,
+                    update_conflicts=True,
+                    unique_fields=[model._meta.pk.name],
+                    update_fields=fields,
+                )
+            if deleted:
+                # Cascades to the shard's orders of a deleted customer
+                model._base_manager.using(alias).filter(pk__in=deleted).delete()
+
+
+def replicate(model, pks, using):
+    """Copy shared rows written on the primary to the shards once committed"""
+    if not get_sharding_settings()["ALIASES"] or using != router.db_for_write(model):
+        return
+    pks = [pk for pk in pks if pk is not None]
+    if pks:
+        transaction.on_commit(partial(copy_rows, model, pks), using=using)
+
+
+def replicate_instance(sender, instance, using=None, **kwargs):
+    """post_save/post_delete receiver for the shared models"""
+    replicate(sender, [instance.pk], using)
+
+
+class ReplicatedQuerySet(InvalidatingQuerySet):
+    """QuerySet of a shared model whose set-based writes reach the shards
+
+    update() and bulk_create() send no model signals, so they replicate the
+    rows they wrote themselves.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        replicate(self.model, [obj.pk for obj in objs], self.db)
+        return objs
+
+    def update(self, **kwargs):
+        if not get_sharding_settings()["ALIASES"]:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            # Read under a row lock (a shared lock on SQLite), so no other
+            # writer changes which of these rows the UPDATE below matches
+            pks = list(self.select_for_update().values_list("pk", flat=True))
+            rows = 0
+            for start in range(0, len(pks), COPY_BATCH_SIZE):
+                # The queryset's own filters still guard every statement
+                batch = self.filter(pk__in=pks[start : start + COPY_BATCH_SIZE])
+                rows += super(ReplicatedQuerySet, batch).update(**kwargs)
+            replicate(self.model, pks, self.db)
+        return rows
+
+
+def sync_shared_rows(model):
+    """Copy every row of a shared model to the shards, returning the row count"""
+    pks = list(
+        model._base_manager.using(router.db_for_write(model)).values_list(
+            "pk", flat=True
+        )
+    )
+    copy_rows(model, pks)
+    return len(pks)
+
+
+def seed_shard_sequences(sender, using, **kwargs):
+    """post_migrate receiver starting each shard's order ids in its own range
+
+    SQLite's AUTOINCREMENT continues from sqlite_sequence, so raising the
+    stored value to k * ID_SPAN makes shard k allocate ids only it uses.
+    """
+    sharding_settings = get_sharding_settings()
+    if sender.name != "crm" or using not in sharding_settings["ALIASES"]:
+        return
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+    base = sharding_settings["ALIASES"].index(using) * sharding_settings["ID_SPAN"]
+    if not base:
+        return
+    with connection.cursor() as cursor:
+        for model in (sender.get_model("Order"), sender.get_model("OrderItem")):
+            table = model._meta.db_table
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s",
+                [base, table, base],
+            )
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, base, table],
+            )
@@ -0,0 +1,198 @@
+import contextvars
+import json
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+from graphql import print_ast
+
+DEFAULT_SETTINGS = {
+    # Operations taking at least this long are logged; None disables the log
+    "THRESHOLD_MS": None,
+    # Callable returning a copy of the variables that is safe to log
+    "REDACT_VARIABLES": "crm.slow_log.redact_variables",
+    # Run EXPLAIN (EXPLAIN QUERY PLAN on SQLite) for each distinct SELECT; the
+    # plans are queried before the slow response is returned, so it's opt-in
+    "EXPLAIN": False,
+    # Statements recorded per operation
+    "MAX_QUERIES": 100,
+    # SQL parameters may hold the same personal data the variables redact
+    "LOG_SQL_PARAMS": False,
+}
+
+logger = logging.getLogger("crm.slow_operations")
+
+# OperationCapture of the operation running in the current thread or task
+_current_capture = contextvars.ContextVar("current_capture", default=None)
+
+SENSITIVE_VARIABLE = re.compile(r"email|phone|password|token|secret", re.IGNORECASE)
+
+
+def get_slow_log_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "GRAPHQL_SLOW_LOG", {})}
+
+
+def redact_variables(variables):
+    """Mask values of variables and input fields that look like personal data"""
+    if isinstance(variables, dict):
+        return {
+            key: "[redacted]"
+            if SENSITIVE_VARIABLE.search(key)
+            else redact_variables(value)
+            for key, value in variables.items()
+        }
+    if isinstance(variables, list):
+        return [redact_variables(value) for value in variables]
+    return variables
+
+
+def capture_query(execute, sql, params, many, context):
+    """Database execute wrapper recording statements of a timed operation"""
+    capture = _current_capture.get()
+    if capture is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        capture.add(context["connection"].alias, sql, params, many, duration)
+
+
+def install_query_capture(sender, connection, **kwargs):
+    """connection_created receiver adding capture_query to the connection"""
+    if capture_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(capture_query)
+
+
+def start_capture():
+    """Return an OperationCapture, or None when the slow log is off"""
+    slow_log_settings = get_slow_log_settings()
+    if slow_log_settings["THRESHOLD_MS"] is None:
+        return None
+    return OperationCapture(slow_log_settings)
+
+
+class OperationCapture:
+    """Statements and duration of one operation, logged if it was slow
+
+    Used as a context manager around execution; statements are recorded from
+    any thread the operation's context reaches.
+    """
+
+    def __init__(self, slow_log_settings):
+        self.settings = slow_log_settings
+        self.statements = []
+        self.dropped = 0
+        self.duration = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.token = _current_capture.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self.started
+        _current_capture.reset(self.token)
+
+    def add(self, alias, sql, params, many, duration):
+        if len(self.statements) >= self.settings["MAX_QUERIES"]:
+            self.dropped += 1
+            return
+        self.statements.append(
+            {
+                "database": alias,
+                "sql": sql,
+                "params": None if many else params,
+                "time_ms": duration * 1000,
+            }
+        )
+
+    @property
+    def is_slow(self):
+        return self.duration * 1000 >= self.settings["THRESHOLD_MS"]
+
+    def report(self, document, operation_name, variables):
+        """Write the operation to the slow log"""
+        redact = import_string(self.settings["REDACT_VARIABLES"])
+        if self.settings["EXPLAIN"]:
+            explain_statements(self.statements)
+        if not self.settings["LOG_SQL_PARAMS"]:
+            for statement in self.statements:
+                statement.pop("params")
+        duration_ms = self.duration * 1000
+        logger.warning(
+            "Slow GraphQL operation %s took %.1f ms",
+            operation_name or "<anonymous>",
+            duration_ms,
+            extra={
+                "operation": {
+                    "operation_name": operation_name,
+                    "duration_ms": round(duration_ms, 3),
+                    "document": print_ast(document),
+                    "variables": redact(variables or {}),
+                    "sql_count": len(self.statements) + self.dropped,
+                    "sql_time_ms": round(
+                        sum(statement["time_ms"] for statement in self.statements), 3
+                    ),
+                    "statements": self.statements,
+                }
+            },
+        )
+
+
+def explain_statements(statements):
+    """Attach the query plan of every distinct SELECT to its statements
+
+    Each statement is explained on the database it ran on.
+    """
+    plans = {}
+    for statement in statements:
+        sql = statement["sql"]
+        if not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        key = (statement["database"], sql)
+        if key not in plans:
+            connection = connections[statement["database"]]
+            prefix = connection.ops.explain_query_prefix()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"{prefix} {sql}", statement["params"])
+                    rows = cursor.fetchall()
+            except Exception as e:
+                plans[key] = {"error": str(e)}
+            else:
+                if connection.vendor == "sqlite":
+                    # (id, parent, notused, detail)
+                    plan = [row[3] for row in rows]
+                else:
+                    plan = [" ".join(str(column) for column in row) for row in rows]
+                plans[key] = {"plan": plan, "full_scan": is_full_scan(plan)}
+        statement.update(plans[key])
+
+
+def is_full_scan(plan):
+    """Whether a plan reads a whole table instead of using an index"""
+    for line in plan:
+        # SQLite: "SCAN crm_order", also "SCAN ... USING COVERING INDEX", which
+        # walks a whole index rather than searching it; PostgreSQL: "Seq Scan"
+        if line.startswith("SCAN ") or "Seq Scan" in line:
+            return True
+    return False
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, merging a record's "operation" extra"""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "operation", {}),
+        }
+        return json.dumps(data, default=str)
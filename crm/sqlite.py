@@ -0,0 +1,209 @@
+import contextvars
+import functools
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from django.conf import settings
+from django.db import close_old_connections, connection, connections
+
+# Named sets of per-connection PRAGMAs, journal mode and write handling
+PROFILES = {
+    # SQLite's own behaviour: rollback journal, full syncs, small page cache
+    "default": {
+        "JOURNAL_MODE": "delete",
+        "PRAGMAS": {},
+        "WRITE_QUEUE": False,
+    },
+    # Readers never block the writer in WAL mode, and NORMAL only syncs at
+    # checkpoints, which stays durable against application crashes
+    "performance": {
+        "JOURNAL_MODE": "wal",
+        "PRAGMAS": {
+            "synchronous": "normal",
+            "busy_timeout": 5000,
+            "mmap_size": 256 * 1024 * 1024,
+            # Negative: KiB rather than pages
+            "cache_size": -64 * 1024,
+            "temp_store": "memory",
+        },
+        "WRITE_QUEUE": True,
+    },
+}
+
+DEFAULT_SETTINGS = {
+    "PROFILE": "default",
+    # Stored in the database file and set by migrate; None follows the profile
+    "JOURNAL_MODE": None,
+    # PRAGMAs applied on top of the profile's own
+    "PRAGMAS": {},
+    # Run mutations on one writer thread; None follows the profile
+    "WRITE_QUEUE": None,
+    # Seconds a mutation waits for the writer before giving up
+    "WRITE_TIMEOUT": 30,
+}
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueueTimeout(Exception):
+    pass
+
+
+def get_sqlite_settings():
+    """CRM_SQLITE merged over its profile"""
+    sqlite_settings = {**DEFAULT_SETTINGS, **getattr(settings, "CRM_SQLITE", {})}
+    profile = PROFILES[sqlite_settings["PROFILE"]]
+    sqlite_settings["PRAGMAS"] = {**profile["PRAGMAS"], **sqlite_settings["PRAGMAS"]}
+    for name in ("JOURNAL_MODE", "WRITE_QUEUE"):
+        if sqlite_settings[name] is None:
+            sqlite_settings[name] = profile[name]
+    return sqlite_settings
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """connection_created receiver running the profile's PRAGMAs"""
+    if connection.vendor != "sqlite":
+        return
+    # On the raw connection, so tracing and the slow log don't count them
+    raw = connection.connection
+    for name, value in get_sqlite_settings()["PRAGMAS"].items():
+        raw.execute(f"PRAGMA {name} = {value}")
+
+
+def apply_journal_mode(sender, using, **kwargs):
+    """post_migrate receiver switching the database to the profile's journal
+
+    The journal mode is stored in the database file, so it is set once here
+    rather than on every connection; switching it needs an exclusive lock.
+    """
+    if sender.name != "crm":
+        return
+    connection = connections[using]
+    if connection.vendor != "sqlite" or connection.is_in_memory_db():
+        return
+    mode = get_sqlite_settings()["JOURNAL_MODE"]
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        if cursor.fetchone()[0].lower() == mode.lower():
+            return
+        try:
+            cursor.execute(f"PRAGMA journal_mode = {mode}")
+        except sqlite3.OperationalError as e:
+            # Another process holds the database; migrate again to retry
+            logger.warning("Could not switch SQLite to %s journal: %s", mode, e)
+
+
+class WriteQueue:
+    """One writer thread running queued writes in arrival order
+
+    SQLite allows a single writer at a time; threads writing concurrently
+    wait on the database lock and fail with "database is locked" once the
+    busy timeout expires. Funnelling writes through one thread turns that
+    contention into an in-process queue.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reset_stats()
+
+    def run(self, func, *args, **kwargs):
+        """Call func on the writer thread and return its result"""
+        sqlite_settings = get_sqlite_settings()
+        if (
+            not sqlite_settings["WRITE_QUEUE"]
+            or connection.vendor != "sqlite"
+            or threading.current_thread() is self._thread
+            # The caller's transaction can't be handed to another connection
+            or connection.in_atomic_block
+        ):
+            return func(*args, **kwargs)
+
+        future = Future()
+        self._start()
+        with self._lock:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize() + 1)
+        # Tracing and slow-log state follow the write onto the writer thread
+        context = contextvars.copy_context()
+        self._queue.put((future, context, func, args, kwargs, time.perf_counter()))
+        try:
+            return future.result(sqlite_settings["WRITE_TIMEOUT"])
+        except TimeoutError:
+            if future.cancel():
+                with self._lock:
+                    self.timeouts += 1
+                raise WriteQueueTimeout("Timed out waiting for the database writer")
+            # Already running on the writer; let it finish
+            return future.result()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name="crm-sqlite-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            future, context, func, args, kwargs, enqueued = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            waited = time.perf_counter() - enqueued
+            with self._lock:
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            # Honour CONN_MAX_AGE as a request would, keeping the connection
+            # open between writes when persistent connections are on
+            close_old_connections()
+            try:
+                result = context.run(func, *args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                close_old_connections()
+                with self._lock:
+                    self.completed += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.submitted = self.completed = self.timeouts = self.max_depth = 0
+            self.wait_seconds = self.max_wait_seconds = 0.0
+
+    def stats(self):
+        """Return the queue counters as a dict"""
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "depth": self._queue.qsize(),
+                "max_depth": self.max_depth,
+                "avg_wait_ms": self.wait_seconds / self.completed * 1000
+                if self.completed
+                else 0.0,
+                "max_wait_ms": self.max_wait_seconds * 1000,
+            }
+
+
+# Shared by every thread of the process
+write_queue = WriteQueue()
+
+
+def serialized_write(mutate):
+    """Decorator running a mutation through the write queue"""
+
+    @functools.wraps(mutate)
+    def wrapper(*args, **kwargs):
+        return write_queue.run(mutate, *args, **kwargs)
+
+    return wrapper
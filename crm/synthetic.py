@@ -0,0 +1,365 @@
+import datetime
+import itertools
+import math
+import multiprocessing
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal
+
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+
+from .models import Customer, Order, OrderItem, Product
+from .sharding import get_sharding_settings, shard_for_customer
+
+FIRST_NAMES = [
+    "Ada", "Alan", "Alice", "Amara", "Ben", "Bob", "Carla", "Carol", "Chen", "Dana",
+    "David", "Diego", "Elena", "Emeka", "Eva", "Farah", "Grace", "Hana", "Ivan",
+    "Jamal", "Jin", "Julia", "Kofi", "Lars", "Leila", "Lucia", "Mark", "Maya",
+    "Nadia", "Noah", "Olga", "Omar", "Priya", "Quinn", "Ravi", "Rosa", "Sam",
+    "Sara", "Tariq", "Tom", "Uma", "Victor", "Wei", "Yara", "Yusuf", "Zoe",
+]
+LAST_NAMES = [
+    "Adams", "Brown", "Chen", "Costa", "Davis", "Dubois", "Garcia", "Haddad",
+    "Ibrahim", "Ito", "Johnson", "Kim", "Kowalski", "Larsen", "Lopez", "Mensah",
+    "Moreau", "Nakamura", "Nguyen", "Novak", "Okafor", "Patel", "Petrov", "Rossi",
+    "Schmidt", "Silva", "Singh", "Smith", "Tanaka", "Taylor", "Wilson", "Zhang",
+]
+ADJECTIVES = [
+    "Compact", "Deluxe", "Ergonomic", "Portable", "Pro", "Rugged", "Smart",
+    "Slim", "Ultra", "Wireless", "Classic", "Eco",
+]
+NOUNS = [
+    "Backpack", "Cable", "Camera", "Charger", "Desk Lamp", "Dock", "Headphones",
+    "Keyboard", "Laptop", "Microphone", "Monitor", "Mouse", "Router", "Speaker",
+    "Stand", "Tablet", "Webcam", "USB-C Hub",
+]
+COUNTRY_CODES = ["33", "44", "49", "61", "81", "91"]
+
+# Line items per order: P(n) halves with every extra line
+LINE_WEIGHTS = [0.5**lines for lines in range(1, 9)]
+QUANTITIES = [1, 2, 3, 4, 5]
+# Cumulative, as random.choices takes them without summing on every draw
+QUANTITY_WEIGHTS = list(itertools.accumulate([70, 15, 8, 4, 3]))
+# Orders per hour of the day, UTC
+HOUR_WEIGHTS = list(
+    itertools.accumulate(
+        [1, 1, 1, 1, 1, 2, 3, 5, 7, 8, 9, 9, 10, 9, 9, 8, 8, 8, 9, 10, 9, 7, 4, 2]
+    )
+)
+
+TABLES = ("customers", "products", "orders")
+
+
+class DatasetPlan:
+    """Sizes and distributions of a synthetic dataset
+
+    Every chunk of rows draws from its own random stream derived from the
+    seed, so the data is the same however the chunks are spread over worker
+    processes. Primary keys are explicit: customers and products are
+    numbered from 1, and orders from 1 within their shard's id range.
+    """
+
+    def __init__(
+        self,
+        customers=10000,
+        products=1000,
+        orders=100000,
+        max_lines=5,
+        product_skew=1.1,
+        customer_skew=0.6,
+        days=730,
+        end=None,
+        chunk_size=5000,
+        seed=0,
+    ):
+        self.counts = {"customers": customers, "products": products, "orders": orders}
+        self.max_lines = max(1, min(max_lines, len(LINE_WEIGHTS), products))
+        self.days = days
+        if end is None:
+            end = datetime.datetime.now(datetime.timezone.utc).replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+        self.end = end
+        self.start = end - datetime.timedelta(days=days)
+        self.chunk_size = chunk_size
+        self.seed = seed
+
+        rng = random.Random(f"{seed}:plan")
+        # Prices are needed again by the order lines
+        self.prices = [_price(rng) for _ in range(products)]
+        # Zipf's law: the product at popularity rank r sells in proportion to
+        # 1 / r ** skew; ranks are shuffled so popularity doesn't follow ids
+        self.product_ids, self.product_weights = _zipf(rng, products, product_skew)
+        # Customers order at a milder skew: a few regulars, a long tail
+        self.customer_ids, self.customer_weights = _zipf(
+            rng, customers, customer_skew
+        )
+
+    def chunks(self, table):
+        """(table, start, stop) of every chunk of a table"""
+        total = self.counts[table]
+        for start in range(0, total, self.chunk_size):
+            yield table, start, min(start + self.chunk_size, total)
+
+    def rng(self, table, start):
+        return random.Random(f"{self.seed}:{table}:{start}")
+
+    def customers(self, start, stop):
+        rng = self.rng("customers", start)
+        for index in range(start, stop):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            yield Customer(
+                pk=index + 1,
+                name=f"{first} {last}",
+                email=f"{first}.{last}.{index + 1}@example.com".lower(),
+                phone=_phone(rng),
+                **self.signup_times(rng),
+            )
+
+    def products(self, start, stop):
+        rng = self.rng("products", start)
+        for index in range(start, stop):
+            # One product in ten runs low, for the restock mutation
+            low = rng.random() < 0.1
+            stock = rng.randrange(10) if low else rng.randrange(10, 1000)
+            yield Product(
+                pk=index + 1,
+                name=f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {index + 1}",
+                price=self.prices[index],
+                stock=stock,
+                **self.signup_times(rng),
+            )
+
+    def signup_times(self, rng):
+        """Created and updated times within the year before the order window"""
+        created = self.start - datetime.timedelta(seconds=rng.randrange(86400 * 365))
+        return {"created_at": created, "updated_at": created}
+
+    def orders(self, start, stop):
+        """(order, line items) pairs, with totals computed from the lines"""
+        rng = self.rng("orders", start)
+        line_counts = range(1, self.max_lines + 1)
+        line_weights = list(itertools.accumulate(LINE_WEIGHTS[: self.max_lines]))
+        for index in range(start, stop):
+            customer_id = rng.choices(
+                self.customer_ids, cum_weights=self.customer_weights
+            )[0]
+            lines = rng.choices(line_counts, cum_weights=line_weights)[0]
+            product_ids = set()
+            while len(product_ids) < lines:
+                product_ids.add(
+                    rng.choices(self.product_ids, cum_weights=self.product_weights)[0]
+                )
+
+            items = [
+                OrderItem(
+                    product_id=product_id,
+                    quantity=rng.choices(QUANTITIES, cum_weights=QUANTITY_WEIGHTS)[0],
+                    unit_price=self.prices[product_id - 1],
+                )
+                for product_id in sorted(product_ids)
+            ]
+            order_date = self.order_date(rng)
+            order = Order(
+                pk=index + 1,
+                customer_id=customer_id,
+                total_amount=sum(item.quantity * item.unit_price for item in items),
+                order_date=order_date,
+                created_at=order_date,
+                updated_at=order_date,
+            )
+            yield order, items
+
+    def order_date(self, rng):
+        # Volume grows linearly over the window: the density of the fraction
+        # elapsed is 2x, i.e. the square root of a uniform draw
+        day = int(math.sqrt(rng.random()) * self.days)
+        hour = rng.choices(range(24), cum_weights=HOUR_WEIGHTS)[0]
+        return self.start + datetime.timedelta(
+            days=day,
+            hours=hour,
+            seconds=rng.randrange(3600),
+            microseconds=rng.randrange(1000000),
+        )
+
+
+def _zipf(rng, size, skew):
+    """Shuffled ids 1..size and the cumulative Zipf weights of their ranks"""
+    ids = list(range(1, size + 1))
+    rng.shuffle(ids)
+    weights = list(itertools.accumulate(1 / rank**skew for rank in range(1, size + 1)))
+    return ids, weights
+
+
+def _price(rng):
+    # Log-normal: mostly tens of dollars, a tail into the thousands
+    price = min(max(rng.lognormvariate(3.5, 1.0), 1), 9999)
+    return Decimal(f"{price:.2f}")
+
+
+def _phone(rng):
+    """A phone number matching Customer.phone_regex, or None"""
+    kind = rng.random()
+    if kind < 0.1:
+        return None
+    area, exchange = rng.randint(200, 999), rng.randint(200, 999)
+    line = rng.randrange(10000)
+    if kind < 0.5:
+        return f"{area}-{exchange}-{line:04d}"
+    if kind < 0.85:
+        return f"+1{area}{exchange}{line:04d}"
+    digits = "".join(str(rng.randrange(10)) for _ in range(rng.randint(9, 10)))
+    return f"+{rng.choice(COUNTRY_CODES)}{digits}"
+
+
+@contextmanager
+def explicit_timestamps():
+    """Let bulk_create keep the created/updated times set on the instances"""
+    fields = [
+        field
+        for model in (Customer, Product, Order)
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def order_databases():
+    """Databases holding orders: the shards, or the primary"""
+    return get_sharding_settings()["ALIASES"] or [router.db_for_write(Order)]
+
+
+def existing_rows():
+    """Whether any database already holds CRM rows"""
+    return (
+        Customer.objects.using(router.db_for_write(Customer)).exists()
+        or Product.objects.using(router.db_for_write(Product)).exists()
+        or any(Order.objects.using(alias).exists() for alias in order_databases())
+    )
+
+
+def crm_databases():
+    """The primary and the order shards"""
+    return list(dict.fromkeys([router.db_for_write(Customer), *order_databases()]))
+
+
+def clear():
+    """Empty the CRM tables on the primary and every shard, without cascades"""
+    for alias in crm_databases():
+        connection = connections[alias]
+        tables = [
+            model._meta.db_table
+            for model in (OrderItem, Order, Customer, Product)
+            if router.allow_migrate_model(alias, model)
+        ]
+        connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables))
+
+
+# Set before forking, so worker processes inherit them
+_plan = None
+_write_lock = None
+
+
+def insert_chunk(chunk):
+    """Build and insert one chunk of a table; returns (rows, line items)"""
+    table, start, stop = chunk
+    if table == "customers":
+        _insert(Customer, {router.db_for_write(Customer): _plan.customers(start, stop)})
+        return stop - start, 0
+    if table == "products":
+        _insert(Product, {router.db_for_write(Product): _plan.products(start, stop)})
+        return stop - start, 0
+
+    sharding_settings = get_sharding_settings()
+    aliases = sharding_settings["ALIASES"]
+    orders = defaultdict(list)
+    items = defaultdict(list)
+    for order, order_items in _plan.orders(start, stop):
+        alias = shard_for_customer(order.customer_id)
+        if alias is None:
+            alias = router.db_for_write(Order)
+        else:
+            # Into the shard's id range, as its sequence would allocate
+            order.pk += aliases.index(alias) * sharding_settings["ID_SPAN"]
+        for item in order_items:
+            item.order_id = order.pk
+        orders[alias].append(order)
+        items[alias].extend(order_items)
+    _insert(Order, orders, items)
+    return stop - start, sum(len(alias_items) for alias_items in items.values())
+
+
+def _insert(model, rows, items=None):
+    """bulk_create each database's rows, and line items, in one transaction"""
+    for alias, objs in rows.items():
+        objs = list(objs)
+        # SQLite takes one writer at a time: workers build rows in parallel
+        # and take turns inserting them
+        lock = _write_lock if connections[alias].vendor == "sqlite" else None
+        with lock or nullcontext(), transaction.atomic(using=alias):
+            model.objects.using(alias).bulk_create(objs, batch_size=_plan.chunk_size)
+            if items:
+                OrderItem.objects.using(alias).bulk_create(
+                    items[alias], batch_size=_plan.chunk_size
+                )
+
+
+def generate(plan, workers=1, progress=None):
+    """Insert a plan's rows table by table, fanning chunks out to worker processes
+
+    progress is called after every chunk with the table, rows done, rows in
+    total, line items done and seconds elapsed.
+    """
+    global _plan, _write_lock
+    _plan = plan
+    context = multiprocessing.get_context("fork") if workers > 1 else None
+    _write_lock = context.Lock() if context else None
+
+    with explicit_timestamps():
+        for table in TABLES:
+            started = time.perf_counter()
+            done = lines = 0
+            pool = None
+            if context:
+                # Children open their own connections
+                connections.close_all()
+                pool = context.Pool(workers)
+            try:
+                imap = pool.imap_unordered if pool else map
+                for rows, line_items in imap(insert_chunk, plan.chunks(table)):
+                    done += rows
+                    lines += line_items
+                    if progress:
+                        progress(
+                            table,
+                            done,
+                            plan.counts[table],
+                            lines,
+                            time.perf_counter() - started,
+                        )
+            finally:
+                if pool:
+                    pool.close()
+                    pool.join()
+
+    # Explicit ids leave the sequences of other backends behind
+    for alias in crm_databases():
+        connection = connections[alias]
+        models = [
+            model
+            for model in (Customer, Product, Order)
+            if router.allow_migrate_model(alias, model)
+        ]
+        with connection.cursor() as cursor:
+            for statement in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(statement)
@@ -1,3 +1,1636 @@
-from django.test import TestCase
+import csv
+import datetime
+import hashlib
+import io
+import json
+import random
+import time
+import unittest
+from decimal import Decimal
+from types import SimpleNamespace
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_relay import offset_to_cursor, to_global_id
+
+from alx_backend_graphql_crm.schema import schema
+
+from .fields import BatchedConnectionField
+from .filters import CustomerFilter, OrderFilter, ProductFilter
+from .models import (
+    Customer,
+    InsufficientStock,
+    Order,
+    OrderItem,
+    PersistedQuery,
+    Product,
+)
+from . import persisted_queries
+from .document_cache import DocumentCache, document_cache
+from .response_cache import response_cache
+from .pagination import encode_keyset_cursor
+from .routers import (
+    ReplicaRouter,
+    choose_read_alias,
+    replica_lag,
+    route_operation,
+    set_pin_cookie,
+)
+from .schema import OrderType
+from .sqlite import PROFILES, get_sqlite_settings
+from .tracing import tracing_metrics
+from .views import AsyncCRMGraphQLView, CRMGraphQLView
+
+NOW = timezone.now()
+RECENT = (NOW - datetime.timedelta(days=5)).isoformat()
+OLD = (NOW - datetime.timedelta(days=995)).isoformat()
+
+# A selective value for every filter that an index can serve
+INDEXED_FILTERS = {
+    CustomerFilter: {
+        "created_at": RECENT,
+        "created_at_gte": RECENT,
+        "created_at_lte": OLD,
+        "phone": "+15550000001",
+    },
+    ProductFilter: {
+        "price": "10",
+        "price_gte": "990",
+        "price_lte": "5",
+        "stock": "7",
+        "stock_gte": "495",
+        "stock_lte": "3",
+        "low_stock": "true",
+        "created_at_gte": RECENT,
+        "created_at_lte": OLD,
+    },
+    OrderFilter: {
+        "total_amount": "77",
+        "total_amount_gte": "4990",
+        "total_amount_lte": "5",
+        "order_date": RECENT,
+        "order_date_gte": RECENT,
+        "order_date_lte": OLD,
+        "customer_id": "5",
+        "product_id": "5",
+        "created_at_gte": RECENT,
+        "created_at_lte": OLD,
+    },
+}
+
+# Substring matches (LIKE '%...%', or LIKE with ESCAPE on SQLite) cannot use a
+# B-tree index; they are listed so every declared filter is accounted for
+UNINDEXED_FILTERS = {
+    CustomerFilter: {
+        "name",
+        "name_icontains",
+        "email",
+        "email_icontains",
+        "phone_pattern",
+    },
+    ProductFilter: {"name", "name_icontains"},
+    OrderFilter: {"customer_name", "customer_email", "product_name"},
+}
+
+ORDERINGS = {
+    Customer: ["name", "-name", "created_at", "-created_at"],
+    Product: ["name", "-name", "price", "-price", "stock", "-stock", "-created_at"],
+    Order: [
+        "total_amount",
+        "-total_amount",
+        "order_date",
+        "-order_date",
+        "-created_at",
+    ],
+}
+
+
+def query_plan(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[3] for row in cursor.fetchall()]
+
+
+def table_scans(plan):
+    """Plan steps reading a whole table, as opposed to an index"""
+    return [line for line in plan if line.startswith("SCAN ") and "INDEX" not in line]
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "Parses SQLite query plans")
+class FilterIndexTests(TestCase):
+    """Every exposed filter and ordering is served by an index at scale"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        customers = Customer.objects.bulk_create(
+            Customer(
+                name=f"Customer {i}", email=f"c{i}@example.com", phone=f"+1555{i:07d}"
+            )
+            for i in range(2000)
+        )
+        products = Product.objects.bulk_create(
+            Product(
+                name=f"Product {i}",
+                price=Decimal(rng.randint(1, 1000)),
+                stock=rng.randint(0, 500),
+            )
+            for i in range(300)
+        )
+        orders = Order.objects.bulk_create(
+            Order(
+                customer=rng.choice(customers),
+                total_amount=Decimal(rng.randint(1, 5000)),
+            )
+            for _ in range(5000)
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, unit_price=product.price)
+            for order in orders
+            for product in rng.sample(products, 2)
+        )
+        with connection.cursor() as cursor:
+            # Spread dates over ~3 years so date ranges are selective
+            for table in ("crm_customer", "crm_product", "crm_order"):
+                cursor.execute(
+                    f"UPDATE {table} SET created_at = "
+                    "datetime('now', '-' || (id % 1000) || ' days')"
+                )
+            cursor.execute("UPDATE crm_order SET order_date = created_at")
+            cursor.execute("ANALYZE")
+
+    def filtered(self, filterset_class, name, value):
+        filterset = filterset_class(
+            {name: value}, queryset=filterset_class._meta.model.objects.all()
+        )
+        self.assertTrue(filterset.is_valid(), filterset.errors)
+        return filterset.qs
+
+    def test_every_filter_is_classified(self):
+        for filterset_class, values in INDEXED_FILTERS.items():
+            self.assertEqual(
+                set(filterset_class.base_filters),
+                set(values) | UNINDEXED_FILTERS[filterset_class],
+            )
+
+    def test_filters_search_an_index(self):
+        for filterset_class, values in INDEXED_FILTERS.items():
+            for name, value in values.items():
+                with self.subTest(filterset=filterset_class.__name__, filter=name):
+                    # The shape of totalCount: the predicate alone
+                    plan = query_plan(
+                        self.filtered(filterset_class, name, value).order_by()
+                    )
+                    self.assertEqual(table_scans(plan), [], plan)
+                    self.assertTrue(
+                        any(line.startswith("SEARCH ") for line in plan), plan
+                    )
+
+    def test_filtered_pages_avoid_table_scans(self):
+        for filterset_class, values in INDEXED_FILTERS.items():
+            for name, value in values.items():
+                with self.subTest(filterset=filterset_class.__name__, filter=name):
+                    # A connection page in the default ordering
+                    plan = query_plan(
+                        self.filtered(filterset_class, name, value)[:100]
+                    )
+                    self.assertEqual(table_scans(plan), [], plan)
+
+    def test_orderings_avoid_table_scans(self):
+        for model, orderings in ORDERINGS.items():
+            for ordering in orderings:
+                with self.subTest(model=model.__name__, ordering=ordering):
+                    plan = query_plan(model.objects.order_by(ordering, "pk")[:100])
+                    self.assertEqual(table_scans(plan), [], plan)
+                    self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan)
+
+
+class OptimizerQueryCountTests(TestCase):
+    """Selections resolve in a fixed number of queries however many rows match"""
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        products = Product.objects.bulk_create(
+            Product(name=f"Product {i}", price=Decimal(i + 1), stock=10)
+            for i in range(3)
+        )
+        cls.orders = Order.objects.bulk_create(
+            Order(customer=customer) for _ in range(5)
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order, product=product, quantity=2, unit_price=product.price
+            )
+            for order in cls.orders
+            for product in products
+        )
+
+    def execute(self, query):
+        result = schema.execute(query, context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        return result.data
+
+    def test_line_total_loads_its_columns_with_the_items(self):
+        # The connection's count, the page and its items with products joined
+        with self.assertNumQueries(3):
+            data = self.execute(
+                "{ allOrders(first: 5) { edges { node {"
+                " items { quantity lineTotal product { name } } } } } }"
+            )
+        items = data["allOrders"]["edges"][0]["node"]["items"]
+        self.assertEqual(
+            sorted(item["lineTotal"] for item in items), ["2.00", "4.00", "6.00"]
+        )
+
+        with self.assertNumQueries(2):
+            data = self.execute(
+                "{ order(id: %d) { items { lineTotal } } }" % self.orders[0].pk
+            )
+        self.assertEqual(len(data["order"]["items"]), 3)
+
+
+class ColumnProjectionTests(TestCase):
+    """List queries read only the columns of the selected fields"""
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(
+            name="Ada", email="ada@example.com", phone="+15550000001"
+        )
+        Order.objects.bulk_create(Order(customer=customer) for _ in range(3))
+
+    def selected_columns(self, query, table):
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(query, context_value=SimpleNamespace())
+        self.assertIsNone(result.errors)
+        (sql,) = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT") and "COUNT(" not in query["sql"]
+        ]
+        select = sql[: sql.index(" FROM ")]
+        return {
+            column.strip().split(".")[1].strip('"')
+            for column in select[len("SELECT ") :].split(",")
+            if column.strip().startswith(f'"{table}".')
+        }
+
+    def test_reads_the_selected_columns(self):
+        columns = self.selected_columns(
+            "{ allCustomers(first: 5) { edges { node { name } } } }", "crm_customer"
+        )
+        self.assertEqual(columns, {"id", "name"})
+
+    def test_reads_the_selected_columns_of_joined_rows(self):
+        query = (
+            "{ allOrders(first: 5) { edges { node {"
+            " totalAmount customer { email } } } } }"
+        )
+        self.assertEqual(self.selected_columns(query, "crm_customer"), {"id", "email"})
+        # The foreign key for the join, and the ordering's column for cursors
+        self.assertEqual(
+            self.selected_columns(query, "crm_order"),
+            {"id", "total_amount", "customer_id", "order_date"},
+        )
+
+    def test_unselected_columns_are_not_loaded_row_by_row(self):
+        with self.assertNumQueries(2):
+            result = schema.execute(
+                "{ allOrders(first: 5) { edges { node { id customer { name } } } } }",
+                context_value=SimpleNamespace(),
+            )
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(result.data["allOrders"]["edges"]), 3)
+
+
+class KeysetPaginationTests(TestCase):
+    """Keyset pages cover every row exactly once, NULL sort keys included"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Customer.objects.bulk_create(
+            Customer(
+                name=f"Customer {i}",
+                email=f"c{i}@example.com",
+                phone=None if i % 3 == 0 else f"+1555{i % 4:07d}",
+            )
+            for i in range(20)
+        )
+
+    def page(self, ordering, forward, cursor):
+        args = "first: 4" if forward else "last: 4"
+        if cursor:
+            args += f', {"after" if forward else "before"}: "{cursor}"'
+        result = schema.execute(
+            "{ allCustomers(keyset: true, orderBy: %s, %s) {"
+            " pageInfo { hasNextPage hasPreviousPage startCursor endCursor }"
+            " edges { node { name } } } }" % (json.dumps([ordering]), args),
+            context_value=SimpleNamespace(),
+        )
+        self.assertIsNone(result.errors)
+        return result.data["allCustomers"]
+
+    def test_pages_through_null_sort_keys(self):
+        for ordering in ("phone", "-phone"):
+            for forward in (True, False):
+                with self.subTest(ordering=ordering, forward=forward):
+                    names, cursor = [], None
+                    while True:
+                        page = self.page(ordering, forward, cursor)
+                        page_names = [edge["node"]["name"] for edge in page["edges"]]
+                        names = names + page_names if forward else page_names + names
+                        page_info = page["pageInfo"]
+                        if forward and page_info["hasNextPage"]:
+                            cursor = page_info["endCursor"]
+                        elif not forward and page_info["hasPreviousPage"]:
+                            cursor = page_info["startCursor"]
+                        else:
+                            break
+                    expected = Customer.objects.order_by(ordering, "pk")
+                    self.assertEqual(
+                        names, list(expected.values_list("name", flat=True))
+                    )
+
+
+@override_settings(CRM_SHARDING={"ALIASES": ["orders0", "orders1"]})
+class ShardedStockReservationTests(TestCase):
+    """Stock reservations keep their guard and replicate what they reserved"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Product {i}", price=Decimal("5"), stock=3)
+            for i in range(3)
+        )
+
+    def replicated(self, callbacks):
+        return sorted(pk for callback in callbacks for pk in callback.args[1])
+
+    def test_reserves_and_replicates_the_reserved_products(self):
+        first, second, _ = self.products
+        with self.captureOnCommitCallbacks() as callbacks:
+            Product.reserve_stock({first.pk: 2, second.pk: 3})
+        self.assertEqual(
+            dict(Product.objects.values_list("pk", "stock")),
+            {first.pk: 1, second.pk: 0, self.products[2].pk: 3},
+        )
+        self.assertEqual(self.replicated(callbacks), [first.pk, second.pk])
+
+    def test_insufficient_stock_is_not_reserved(self):
+        first, second, _ = self.products
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(InsufficientStock) as raised:
+                Product.reserve_stock({first.pk: 2, second.pk: 4})
+        self.assertEqual(raised.exception.product_ids, [second.pk])
+        self.assertEqual(
+            set(Product.objects.values_list("stock", flat=True)), {3}
+        )
+        self.assertEqual(callbacks, [])
+
+
+class StockReservationTests(TestCase):
+    """Orders reserve all of their stock or none of it"""
+
+    create_order = """
+        mutation ($input: OrderInput!) {
+            createOrder(input: $input) {
+                success
+                errors
+                order { items { quantity product { name } } }
+            }
+        }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Product {i}", price=Decimal("5"), stock=3)
+            for i in range(3)
+        )
+
+    def stock(self):
+        return [
+            product.stock
+            for product in Product.objects.filter(
+                pk__in=[product.pk for product in self.products]
+            ).order_by("pk")
+        ]
+
+    def order(self, items):
+        result = schema.execute(
+            self.create_order,
+            variable_values={
+                "input": {
+                    "customerId": str(self.customer.pk),
+                    "items": [
+                        {"productId": str(product.pk), "quantity": quantity}
+                        for product, quantity in items
+                    ],
+                }
+            },
+            context_value=SimpleNamespace(),
+        )
+        self.assertIsNone(result.errors)
+        return result.data["createOrder"]
+
+    def test_reserve_stock_decrements_every_product(self):
+        first, second, _ = self.products
+        Product.reserve_stock({first.pk: 1, second.pk: 3})
+        self.assertEqual(self.stock(), [2, 0, 3])
+
+    def test_insufficient_stock_rolls_back_partial_reservations(self):
+        first, second, third = self.products
+        with self.assertRaises(InsufficientStock) as raised:
+            Product.reserve_stock({first.pk: 1, second.pk: 4, third.pk: 5})
+        self.assertEqual(raised.exception.product_ids, [second.pk, third.pk])
+        # The first product's row matched the UPDATE, and was rolled back
+        self.assertEqual(self.stock(), [3, 3, 3])
+
+    def test_create_order_reserves_its_items(self):
+        first, second, _ = self.products
+        data = self.order([(first, 2), (second, 1)])
+        self.assertTrue(data["success"])
+        self.assertEqual(
+            sorted(
+                (item["product"]["name"], item["quantity"])
+                for item in data["order"]["items"]
+            ),
+            [("Product 0", 2), ("Product 1", 1)],
+        )
+        self.assertEqual(self.stock(), [1, 2, 3])
+
+    def test_create_order_without_stock_creates_nothing(self):
+        first, second, _ = self.products
+        data = self.order([(first, 2), (second, 4)])
+        self.assertFalse(data["success"])
+        self.assertEqual(
+            data["errors"], [f"Insufficient stock for product ID(s): {second.pk}"]
+        )
+        self.assertIsNone(data["order"])
+        self.assertEqual(self.stock(), [3, 3, 3])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class UpdateLowStockProductsTests(TestCase):
+    """Restocks update exactly the products under the threshold and return them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Product {stock}", price=Decimal("5"), stock=stock)
+            for stock in (0, 4, 9, 10, 50)
+        )
+
+    def restock(self, arguments):
+        result = schema.execute(
+            "mutation { updateLowStockProducts(%s) {"
+            " products { name stock } success errors } }" % arguments,
+            context_value=SimpleNamespace(),
+        )
+        self.assertIsNone(result.errors)
+        return result.data["updateLowStockProducts"]
+
+    def stocks(self):
+        return dict(Product.objects.values_list("name", "stock"))
+
+    def test_restocks_products_under_the_threshold(self):
+        payload = self.restock("threshold: 10, increment: 5")
+        self.assertTrue(payload["success"])
+        self.assertEqual(
+            sorted((p["name"], p["stock"]) for p in payload["products"]),
+            [("Product 0", 5), ("Product 4", 9), ("Product 9", 14)],
+        )
+        # Again: only what is still under the threshold is topped up
+        payload = self.restock("threshold: 10, increment: 5")
+        self.assertEqual(
+            sorted(p["name"] for p in payload["products"]), ["Product 0", "Product 4"]
+        )
+        self.assertEqual(
+            self.stocks(),
+            {
+                "Product 0": 10,
+                "Product 4": 14,
+                "Product 9": 14,
+                "Product 10": 10,
+                "Product 50": 50,
+            },
+        )
+
+    def test_filters_by_ids(self):
+        payload = self.restock(
+            'increment: 1, filter: {ids: ["%d", "%d"]}'
+            % (self.products[0].pk, self.products[3].pk)
+        )
+        self.assertEqual(
+            [(p["name"], p["stock"]) for p in payload["products"]], [("Product 0", 1)]
+        )
+
+    def test_rejects_invalid_ids(self):
+        payload = self.restock('filter: {ids: ["1", "abc"]}')
+        self.assertFalse(payload["success"])
+        self.assertEqual(payload["errors"], ["Invalid product ID(s): abc"])
+        self.assertEqual(self.stocks()["Product 0"], 0)
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "Parses SQLite query plans")
+class KeysetSeekPlanTests(TestCase):
+    """A deep keyset page seeks into the ordering's index like the first page"""
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Ada", email="ada@example.com")
+        Order.objects.bulk_create(Order(customer=customer) for _ in range(2000))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE crm_order SET "
+                "order_date = datetime('now', '-' || (id % 700) || ' hours')"
+            )
+            cursor.execute("ANALYZE")
+
+    def page_plan(self, cursor):
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(
+                '{ allOrders(keyset: true, first: 20, after: "%s") {'
+                " edges { node { totalAmount } } } }" % cursor,
+                context_value=SimpleNamespace(),
+            )
+        self.assertIsNone(result.errors)
+        (sql,) = [query["sql"] for query in queries if "keyset_0" in query["sql"]]
+        with connection.cursor() as db_cursor:
+            db_cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[3] for row in db_cursor.fetchall()]
+
+    def test_deep_page_searches_the_index(self):
+        order = Order.objects.order_by("-order_date", "pk")[1500]
+        plan = self.page_plan(encode_keyset_cursor((order.order_date, order.pk)))
+        self.assertEqual(table_scans(plan), [], plan)
+        self.assertTrue(
+            any(
+                line.startswith("SEARCH crm_order USING INDEX crm_order_date_id_idx")
+                for line in plan
+            ),
+            plan,
+        )
+
+
+class NestedConnectionPageTests(TestCase):
+    """Nested connections page like a full list but load only the page's rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"c{i}@example.com") for i in range(3)
+        )
+        for count, customer in zip((7, 2, 0), cls.customers):
+            Order.objects.bulk_create(Order(customer=customer) for _ in range(count))
+        # Distinct dates, so the ordering doesn't depend on the tiebreaker
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE crm_order SET order_date = datetime('now', '-' || id || ' hours')"
+            )
+
+    def execute(self, arguments, context=None):
+        result = schema.execute(
+            "{ allCustomers(first: 3, orderBy: [\"name\"]) { edges { node {"
+            " orders(%s) { totalCount"
+            " pageInfo { hasNextPage hasPreviousPage startCursor endCursor }"
+            " edges { cursor node { id } } } } } } }" % arguments,
+            context_value=context or SimpleNamespace(),
+        )
+        self.assertIsNone(result.errors)
+        return [edge["node"]["orders"] for edge in result.data["allCustomers"]["edges"]]
+
+    def expected(self, customer, args):
+        """The page graphene builds from the customer's full list of orders"""
+        ids = [
+            to_global_id("OrderType", pk)
+            for pk in customer.orders.order_by("-order_date", "pk").values_list(
+                "pk", flat=True
+            )
+        ]
+        page = BatchedConnectionField.resolve_connection(
+            OrderType._meta.connection, dict(args), ids
+        )
+        return {
+            "totalCount": len(ids),
+            "pageInfo": {
+                "hasNextPage": page.page_info.has_next_page,
+                "hasPreviousPage": page.page_info.has_previous_page,
+                "startCursor": page.page_info.start_cursor,
+                "endCursor": page.page_info.end_cursor,
+            },
+            "edges": [
+                {"cursor": edge.cursor, "node": {"id": edge.node}}
+                for edge in page.edges
+            ],
+        }
+
+    def test_pages_match_the_full_list(self):
+        cursor = offset_to_cursor
+        for args in (
+            {"first": 3},
+            {"first": 3, "after": cursor(1)},
+            {"first": 3, "after": cursor(5)},
+            {"first": 3, "after": cursor(9)},
+            {"first": 0},
+            {"last": 3},
+            {"last": 3, "before": cursor(5)},
+            {"last": 3, "before": cursor(1)},
+            {"last": 3, "before": cursor(20)},
+            {"first": 4, "last": 2, "after": cursor(0)},
+            {"first": 2, "before": cursor(4), "after": cursor(0)},
+        ):
+            with self.subTest(args=args):
+                arguments = ", ".join(
+                    f"{name}: {json.dumps(value)}" for name, value in args.items()
+                )
+                pages = self.execute(arguments)
+                self.assertEqual(
+                    pages,
+                    [self.expected(customer, args) for customer in self.customers],
+                )
+
+    def test_loads_only_the_rows_of_the_page(self):
+        context = SimpleNamespace()
+        with self.assertNumQueries(3):
+            self.execute("first: 2", context)
+        (loader,) = context.loaders.customer_orders._pages.values()
+        self.assertEqual(
+            sorted(len(list(page)) for page in loader._cache.values()), [0, 2, 2]
+        )
+
+
+class SlowOperationLogTests(TestCase):
+    """Slow operations are logged with their statements when a threshold is set"""
+
+    query = "{ allCustomers(first: 5) { edges { node { name } } } }"
+
+    @classmethod
+    def setUpTestData(cls):
+        Customer.objects.create(name="Ada", email="ada@example.com")
+
+    def post(self):
+        response = self.client.post(
+            "/graphql", {"query": self.query}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def logged_operation(self):
+        with self.assertLogs("crm.slow_operations", "WARNING") as logs:
+            self.post()
+        (record,) = logs.records
+        return record.operation
+
+    def test_off_by_default(self):
+        with self.assertNoLogs("crm.slow_operations"):
+            self.post()
+
+    @override_settings(GRAPHQL_SLOW_LOG={"THRESHOLD_MS": 0})
+    def test_logs_statements_with_their_database(self):
+        operation = self.logged_operation()
+        self.assertEqual(operation["sql_count"], len(operation["statements"]))
+        self.assertGreater(operation["sql_count"], 0)
+        for statement in operation["statements"]:
+            self.assertEqual(statement["database"], "default")
+            # EXPLAIN and SQL parameters are opt-in
+            self.assertNotIn("plan", statement)
+            self.assertNotIn("params", statement)
+
+    @unittest.skipUnless(connection.vendor == "sqlite", "Parses SQLite query plans")
+    @override_settings(GRAPHQL_SLOW_LOG={"THRESHOLD_MS": 0, "EXPLAIN": True})
+    def test_explains_each_select(self):
+        operation = self.logged_operation()
+        selects = [
+            statement
+            for statement in operation["statements"]
+            if statement["sql"].startswith("SELECT")
+        ]
+        self.assertTrue(selects)
+        for statement in selects:
+            self.assertNotIn("error", statement)
+            self.assertTrue(statement["plan"])
+            self.assertIn("full_scan", statement)
+
+
+class MetricsViewTests(TestCase):
+    """/metrics serves the Prometheus text format only while metrics are on"""
+
+    def setUp(self):
+        tracing_metrics.clear()
+        self.addCleanup(tracing_metrics.clear)
+
+    def test_not_found_with_metrics_off(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    @override_settings(GRAPHQL_TRACING={"METRICS": True})
+    def test_exposition_format(self):
+        Customer.objects.create(name="Ada", email="ada@example.com")
+        self.client.post(
+            "/graphql",
+            {"query": "{ allCustomers(first: 2) { edges { node { name } } } }"},
+            content_type="application/json",
+        )
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8"
+        )
+
+        samples = {}
+        types = {}
+        for line in response.content.decode().splitlines():
+            if line.startswith("# TYPE "):
+                name, metric_type = line[len("# TYPE ") :].split()
+                types[name] = metric_type
+            elif not line.startswith("# HELP "):
+                sample, value = line.rsplit(" ", 1)
+                samples[sample] = float(value)
+        self.assertEqual(types["graphql_resolver_duration_seconds"], "histogram")
+        self.assertEqual(types["graphql_document_cache_hits_total"], "counter")
+
+        labels = 'field="Query.allCustomers"'
+        name = "graphql_resolver_result_size"
+        self.assertEqual(samples[f"{name}_count{{{labels}}}"], 1)
+        self.assertEqual(samples[f'{name}_bucket{{{labels},le="+Inf"}}'], 1)
+        buckets = [
+            value
+            for sample, value in samples.items()
+            if sample.startswith(f"{name}_bucket{{{labels},")
+        ]
+        # Cumulative buckets never decrease
+        self.assertEqual(buckets, sorted(buckets))
+
+
+class PersistedQueryTests(TestCase):
+    """Automatic persisted queries: registration, lookup and request errors"""
+
+    query = "{ allProducts(first: 1) { edges { node { name } } } }"
+
+    def setUp(self):
+        # Every test starts with an empty registry of the configured backend
+        persisted_queries._registry = None
+        self.addCleanup(setattr, persisted_queries, "_registry", None)
+
+    def post(self, extensions, query=None):
+        data = {"extensions": extensions}
+        if query is not None:
+            data["query"] = query
+        response = self.client.post("/graphql", data, content_type="application/json")
+        return response.status_code, response.json()
+
+    def apq(self, query_hash=None):
+        return {
+            "persistedQuery": {
+                "version": 1,
+                "sha256Hash": query_hash or persisted_queries.hash_query(self.query),
+            }
+        }
+
+    def error_code(self, body):
+        (error,) = body["errors"]
+        return error["extensions"]["code"]
+
+    def test_unknown_hash_asks_for_the_query(self):
+        status, body = self.post(self.apq())
+        self.assertEqual(status, 200)
+        self.assertEqual(self.error_code(body), "PERSISTED_QUERY_NOT_FOUND")
+
+    def test_registers_and_looks_up_by_hash(self):
+        Product.objects.create(name="Widget", price=Decimal("5"), stock=1)
+        expected = {"allProducts": {"edges": [{"node": {"name": "Widget"}}]}}
+        status, body = self.post(self.apq(), self.query)
+        self.assertEqual(status, 200)
+        self.assertEqual(body["data"], expected)
+
+        status, body = self.post(self.apq())
+        self.assertEqual(status, 200)
+        self.assertEqual(body["data"], expected)
+
+    def test_hash_is_the_document_cache_key(self):
+        self.assertEqual(
+            persisted_queries.hash_query(self.query),
+            hashlib.sha256(self.query.encode()).hexdigest(),
+        )
+
+    def test_rejects_a_hash_that_does_not_match(self):
+        status, body = self.post(self.apq("0" * 64), self.query)
+        self.assertEqual(status, 400)
+        self.assertEqual(self.error_code(body), "PERSISTED_QUERY_HASH_MISMATCH")
+        # Nothing was registered under either hash
+        status, body = self.post(self.apq("0" * 64))
+        self.assertEqual(self.error_code(body), "PERSISTED_QUERY_NOT_FOUND")
+
+    def test_rejects_malformed_extensions(self):
+        for extensions, code in (
+            ("{not json", None),
+            ([1], "BAD_REQUEST"),
+            ({"persistedQuery": "abc"}, "PERSISTED_QUERY_NOT_SUPPORTED"),
+            ({"persistedQuery": {"version": 2}}, "PERSISTED_QUERY_NOT_SUPPORTED"),
+            ({"persistedQuery": {"version": 1}}, "PERSISTED_QUERY_NOT_SUPPORTED"),
+        ):
+            with self.subTest(extensions=extensions):
+                response = self.client.post(
+                    "/graphql",
+                    {"query": self.query, "extensions": extensions},
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 400)
+                if code is not None:
+                    self.assertEqual(self.error_code(response.json()), code)
+
+    @override_settings(
+        GRAPHQL_PERSISTED_QUERIES={
+            "BACKEND": "crm.persisted_queries.DatabasePersistedQueryRegistry",
+            "STRICT": True,
+        }
+    )
+    def test_strict_mode_serves_only_registered_queries(self):
+        status, body = self.post(self.apq(), self.query)
+        self.assertEqual(status, 400)
+        self.assertEqual(self.error_code(body), "PERSISTED_QUERY_NOT_ALLOWED")
+
+        PersistedQuery.objects.create(
+            sha256_hash=persisted_queries.hash_query(self.query), query=self.query
+        )
+        status, body = self.post(self.apq())
+        self.assertEqual(status, 200)
+        self.assertNotIn("errors", body)
+        self.assertEqual(persisted_queries.check_strict_registry(None), [])
+
+    @override_settings(GRAPHQL_PERSISTED_QUERIES={"STRICT": True})
+    def test_strict_mode_rejects_the_in_memory_registry(self):
+        (error,) = persisted_queries.check_strict_registry(None)
+        self.assertEqual(error.id, "crm.E001")
+
+
+class SQLiteProfileTests(TestCase):
+    """Per-connection PRAGMAs leave the journal mode to migrate"""
+
+    def test_journal_mode_is_not_a_connection_pragma(self):
+        for profile in PROFILES:
+            with self.subTest(profile=profile):
+                with override_settings(CRM_SQLITE={"PROFILE": profile}):
+                    sqlite_settings = get_sqlite_settings()
+                self.assertNotIn("journal_mode", sqlite_settings["PRAGMAS"])
+                self.assertEqual(
+                    sqlite_settings["JOURNAL_MODE"], PROFILES[profile]["JOURNAL_MODE"]
+                )
+
+    def test_journal_mode_setting_overrides_the_profile(self):
+        with override_settings(
+            CRM_SQLITE={"PROFILE": "performance", "JOURNAL_MODE": "delete"}
+        ):
+            self.assertEqual(get_sqlite_settings()["JOURNAL_MODE"], "delete")
+
+
+class DocumentCacheTests(TestCase):
+    """Parsed documents are reused by hash and evicted least recently used"""
+
+    def setUp(self):
+        document_cache.clear()
+        self.addCleanup(document_cache.clear)
+
+    def post(self, query):
+        return self.client.post(
+            "/graphql", {"query": query}, content_type="application/json"
+        )
+
+    def test_repeated_queries_hit_the_cache(self):
+        query = "{ allProducts(first: 1) { edges { node { name } } } }"
+        for _ in range(3):
+            self.assertEqual(self.post(query).status_code, 200)
+        stats = document_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (2, 1, 1))
+
+    def test_invalid_documents_are_not_cached(self):
+        for _ in range(2):
+            self.assertEqual(self.post("{ allProducts { nope } }").status_code, 400)
+        stats = document_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (0, 2, 0))
+
+    def test_evicts_the_least_recently_used_document(self):
+        cache = DocumentCache(max_size=2)
+        cache.set("a", "document a")
+        cache.set("b", "document b")
+        self.assertEqual(cache.get("a"), "document a")
+        cache.set("c", "document c")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "document a")
+        self.assertEqual(cache.get("c"), "document c")
+        self.assertEqual(
+            cache.stats(),
+            {"hits": 3, "misses": 1, "evictions": 1, "size": 2, "max_size": 2},
+        )
+
+    def test_size_zero_disables_the_cache(self):
+        cache = DocumentCache(max_size=0)
+        cache.set("a", "document a")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["size"], 0)
+
+
+class QueryCostTests(TestCase):
+    """Operations over the cost, depth or page size budget never execute"""
+
+    query = """
+        query ($first: Int) {
+            allCustomers(first: $first) {
+                edges { node { name orders(first: 10) { edges { node { id } } } } }
+            }
+        }
+    """
+
+    def post(self, variables=None):
+        response = self.client.post(
+            "/graphql",
+            {"query": self.query, "variables": variables or {}},
+            content_type="application/json",
+        )
+        return response.status_code, response.json()
+
+    def rejection(self, variables=None):
+        with self.assertNumQueries(0):
+            status, body = self.post(variables)
+        self.assertEqual(status, 400)
+        self.assertIsNone(body.get("data"))
+        (error,) = body["errors"]
+        return error["extensions"]
+
+    def test_reports_the_cost_of_executed_operations(self):
+        status, body = self.post({"first": 20})
+        self.assertEqual(status, 200)
+        # allCustomers, plus the orders connection of each of 20 customers
+        self.assertEqual(body["extensions"]["cost"], {"requested": 21, "depth": 3})
+
+    @override_settings(GRAPHQL_QUERY_COST={"MAX_COST": 15})
+    def test_rejects_costly_operations(self):
+        self.assertEqual(self.post({"first": 10})[0], 200)
+        self.assertEqual(
+            self.rejection({"first": 20}),
+            {"code": "QUERY_TOO_COSTLY", "cost": 21, "maxCost": 15},
+        )
+
+    @override_settings(GRAPHQL_QUERY_COST={"MAX_DEPTH": 2})
+    def test_rejects_deep_operations(self):
+        self.assertEqual(
+            self.rejection({"first": 1}),
+            {"code": "QUERY_TOO_DEEP", "depth": 3, "maxDepth": 2},
+        )
+
+    def test_rejects_pages_over_the_connection_limit(self):
+        self.assertEqual(
+            self.rejection({"first": 5000}),
+            {"code": "PAGE_SIZE_TOO_LARGE", "pageSize": 5000, "maxPageSize": 1000},
+        )
+
+
+class BulkCreateCustomersTests(TestCase):
+    """Bulk customer creation checks duplicates per set and reports rows in order"""
+
+    mutation = """
+        mutation ($input: [CustomerInput]!, $batchSize: Int) {
+            bulkCreateCustomers(input: $input, batchSize: $batchSize) {
+                customers { email }
+                errors
+                successCount
+                errorCount
+            }
+        }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Customer.objects.create(name="Ada", email="ada@example.com")
+
+    def create(self, customers, batch_size=None):
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(
+                self.mutation,
+                variable_values={"input": customers, "batchSize": batch_size},
+                context_value=SimpleNamespace(),
+            )
+        self.assertIsNone(result.errors)
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        return result.data["bulkCreateCustomers"], statements
+
+    def test_reports_each_rejected_row(self):
+        data, _ = self.create(
+            [
+                {"name": "Ada", "email": "ada@example.com"},
+                {"name": "Bob", "email": "bob@example.com", "phone": "+15550000001"},
+                {"name": "Bob again", "email": "bob@example.com"},
+                {"name": "Cy", "email": "cy@example.com", "phone": "call me"},
+                {"name": "Di", "email": "di@example.com"},
+            ]
+        )
+        self.assertEqual(
+            data,
+            {
+                "customers": [
+                    {"email": "bob@example.com"},
+                    {"email": "di@example.com"},
+                ],
+                "errors": [
+                    "Customer 1: Email already exists",
+                    "Customer 3: Email already exists",
+                    "Customer 4: Invalid phone number format",
+                ],
+                "successCount": 2,
+                "errorCount": 3,
+            },
+        )
+        self.assertEqual(Customer.objects.count(), 3)
+
+    def test_queries_and_inserts_in_batches(self):
+        customers = [
+            {"name": f"Customer {i}", "email": f"customer{i}@example.com"}
+            for i in range(5)
+        ]
+        data, statements = self.create(customers, batch_size=2)
+        self.assertEqual(data["successCount"], 5)
+        # Email lookups and inserts of at most two rows each
+        self.assertEqual(statements.count("SELECT"), 3)
+        self.assertEqual(statements.count("INSERT"), 3)
+        self.assertEqual(Customer.objects.count(), 6)
+
+
+class BulkCreateOrdersTests(TestCase):
+    """Bulk orders are validated and reserved per order, and inserted in batches"""
+
+    mutation = """
+        mutation ($input: [OrderInput]!, $batchSize: Int) {
+            bulkCreateOrders(input: $input, batchSize: $batchSize) {
+                orders { customer { name } items { quantity product { name } } }
+                errors
+                successCount
+                errorCount
+            }
+        }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"customer{i}@example.com")
+            for i in range(3)
+        )
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Product {i}", price=Decimal("5"), stock=3)
+            for i in range(2)
+        )
+
+    def create(self, orders, batch_size=None):
+        result = schema.execute(
+            self.mutation,
+            variable_values={"input": orders, "batchSize": batch_size},
+            context_value=SimpleNamespace(),
+        )
+        self.assertIsNone(result.errors)
+        return result.data["bulkCreateOrders"]
+
+    def order(self, customer, *items):
+        return {
+            "customerId": str(customer.pk),
+            "items": [
+                {"productId": str(product.pk), "quantity": quantity}
+                for product, quantity in items
+            ],
+        }
+
+    def test_creates_valid_orders_and_reports_the_others(self):
+        first, second = self.products
+        data = self.create(
+            [
+                self.order(self.customers[0], (first, 2)),
+                {"customerId": "0", "productIds": [str(first.pk)]},
+                self.order(self.customers[1], (first, 2), (second, 1)),
+                self.order(self.customers[2], (second, 2)),
+                {"customerId": str(self.customers[0].pk), "productIds": []},
+            ]
+        )
+        self.assertEqual(
+            data["errors"],
+            [
+                "Order 2: Invalid customer ID",
+                f"Order 3: Insufficient stock for product ID(s): {first.pk}",
+                "Order 5: At least one product must be selected",
+            ],
+        )
+        self.assertEqual((data["successCount"], data["errorCount"]), (2, 3))
+        self.assertEqual(
+            [order["customer"]["name"] for order in data["orders"]],
+            ["Customer 0", "Customer 2"],
+        )
+        # The failed order's reservation of the second product was undone
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("stock", flat=True)),
+            [1, 1],
+        )
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_response_loads_in_a_fixed_number_of_queries(self):
+        first, second = self.products
+        Product.objects.update(stock=100)
+        queries = []
+        for count in (2, 6):
+            orders = [
+                self.order(self.customers[i % 3], (first, 1), (second, 1))
+                for i in range(count)
+            ]
+            with CaptureQueriesContext(connection) as captured:
+                data = self.create(orders, batch_size=20)
+            self.assertEqual(data["successCount"], count)
+            self.assertEqual({len(order["items"]) for order in data["orders"]}, {2})
+            # Stock is reserved one order at a time; lookups, inserts (one
+            # per table for a single batch) and the response are batched
+            queries.append(
+                [
+                    query["sql"].split()[0]
+                    for query in captured.captured_queries
+                    if query["sql"].startswith(("SELECT", "INSERT"))
+                ]
+            )
+        self.assertEqual(queries[0], queries[1])
+
+
+class AsyncViewParityTests(TransactionTestCase):
+    """The async view answers exactly as the sync view does
+
+    Its resolvers run on worker threads with their own connections, which
+    only see committed rows.
+    """
+
+    def setUp(self):
+        customers = Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"customer{i}@example.com")
+            for i in range(3)
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f"Product {i}", price=Decimal(i + 1), stock=10)
+            for i in range(3)
+        )
+        for i, customer in enumerate(customers):
+            for product in products[: i + 1]:
+                order = Order.objects.create(customer=customer)
+                OrderItem.objects.create(
+                    order=order, product=product, quantity=2, unit_price=product.price
+                )
+        self.customer_id = customers[1].pk
+
+    def responses(self, data):
+        body = json.dumps(data)
+        sync_response = CRMGraphQLView.as_view()(
+            RequestFactory().post("/graphql", body, content_type="application/json")
+        )
+        async_response = async_to_sync(AsyncCRMGraphQLView.as_view())(
+            AsyncRequestFactory().post(
+                "/graphql", body, content_type="application/json"
+            )
+        )
+        return [
+            (response.status_code, json.loads(response.content))
+            for response in (sync_response, async_response)
+        ]
+
+    def assertParity(self, data):
+        sync_response, async_response = self.responses(data)
+        self.assertEqual(async_response, sync_response)
+        return sync_response
+
+    def test_queries(self):
+        for query in (
+            "{ allCustomers(first: 2, orderBy: [\"-name\"]) { totalCount edges {"
+            " node { name orders(first: 1) { totalCount edges { node {"
+            " totalAmount items { quantity product { name } } } } } } } } }",
+            "{ customer(id: %d) { name } allProducts(first: 2) {"
+            " edges { node { name price } } } }" % self.customer_id,
+            "{ allOrders(first: 2, keyset: true) { pageInfo { hasNextPage }"
+            " edges { node { customer { email } } } } }",
+        ):
+            with self.subTest(query=query):
+                status, body = self.assertParity({"query": query})
+                self.assertEqual(status, 200)
+                self.assertNotIn("errors", body)
+
+    def test_errors(self):
+        for query, expected_status in (
+            ("{ allProducts { nope } }", 400),
+            ("{ product(id: 0) { name } }", 200),
+            ("{ allOrders(first: 5000) { edges { node { id } } } }", 400),
+        ):
+            with self.subTest(query=query):
+                status, body = self.assertParity({"query": query})
+                self.assertEqual(status, expected_status)
+
+    def test_batches(self):
+        status, body = self.assertParity(
+            [
+                {"id": "a", "query": "{ allProducts(first: 1) { totalCount } }"},
+                {"id": "b", "query": "{ allCustomers { nope } }"},
+            ]
+        )
+        # The batch answers with its worst entry's status
+        self.assertEqual(status, 400)
+        self.assertEqual([entry["status"] for entry in body], [200, 400])
+
+    def test_mutations(self):
+        mutation = """
+            mutation { createProduct(input: {name: "New", price: 5, stock: 1}) {
+                success product { name stock } } }
+        """
+        sync_response, async_response = self.responses({"query": mutation})
+        self.assertEqual(async_response, sync_response)
+        self.assertTrue(sync_response[1]["data"]["createProduct"]["success"])
+        self.assertEqual(Product.objects.filter(name="New").count(), 2)
+
+
+class BatchedOperationsTests(TransactionTestCase):
+    """Batched operations share loaders across the pool and report per entry
+
+    The parallel operations run on pool threads with their own connections,
+    which only see committed rows.
+    """
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Ada", email="ada@example.com")
+
+    def post(self, data):
+        response = self.client.post("/graphql", data, content_type="application/json")
+        return response.status_code, response.json()
+
+    def record_pool_queries(self):
+        """SQL run on connections opened from now on, i.e. by pool threads"""
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append(sql)
+            return execute(sql, params, many, context)
+
+        def install(sender, connection, **kwargs):
+            connection.execute_wrappers.append(record)
+
+        connection_created.connect(install)
+        self.addCleanup(connection_created.disconnect, install)
+        return statements
+
+    def test_identical_lookups_load_once_across_threads(self):
+        statements = self.record_pool_queries()
+        query = "{ customer(id: %d) { name } }" % self.customer.pk
+        status, body = self.post([{"id": str(i), "query": query} for i in range(4)])
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            [(entry["id"], entry["data"]["customer"]["name"]) for entry in body],
+            [(str(i), "Ada") for i in range(4)],
+        )
+        self.assertEqual(len([sql for sql in statements if '"crm_customer"' in sql]), 1)
+
+    def test_reads_after_a_write_see_it(self):
+        query = "{ customer(id: %d) { name } }" % self.customer.pk
+        status, body = self.post(
+            [
+                {"query": query},
+                {
+                    "query": 'mutation { createCustomer(input: {name: "Bo",'
+                    ' email: "bo@example.com"}) { success } }'
+                },
+                {"query": "{ allCustomers { totalCount } }"},
+            ]
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(body[1]["data"], {"createCustomer": {"success": True}})
+        self.assertEqual(body[2]["data"], {"allCustomers": {"totalCount": 2}})
+
+    def test_reports_each_entry_status(self):
+        status, body = self.post(
+            [
+                {"id": "ok", "query": "{ hello }"},
+                {"id": "invalid", "query": "{ nope }"},
+                {"id": "missing"},
+            ]
+        )
+        self.assertEqual(status, 400)
+        self.assertEqual(
+            [(entry["id"], entry["status"]) for entry in body],
+            [("ok", 200), ("invalid", 400), ("missing", 400)],
+        )
+        self.assertEqual(body[0]["data"], {"hello": "Hello, GraphQL!"})
+
+    @override_settings(GRAPHQL_BATCH={"MAX_SIZE": 2})
+    def test_rejects_batches_over_the_size_limit(self):
+        status, body = self.post([{"query": "{ hello }"}] * 3)
+        self.assertEqual(status, 400)
+        self.assertEqual(
+            body["errors"][0]["message"],
+            "Batch of 3 operations exceeds the maximum of 2.",
+        )
+        self.assertEqual(self.post([{"query": "{ hello }"}] * 2)[0], 200)
+
+    def test_rejects_empty_batches(self):
+        status, body = self.post([])
+        self.assertEqual(status, 400)
+        self.assertEqual(
+            body["errors"][0]["message"],
+            "Received an empty list in the batch request.",
+        )
+
+
+class ExportTests(TestCase):
+    """Exports stream filtered, ordered rows as NDJSON or CSV"""
+
+    @classmethod
+    def setUpTestData(cls):
+        ada = Customer.objects.create(name="Ada, Countess", email="ada@example.com")
+        bob = Customer.objects.create(name='Bob "B"', email="bob@example.com")
+        cls.orders = [
+            Order.objects.create(customer=customer, total_amount=Decimal(amount))
+            for customer, amount in ((ada, "12.50"), (bob, "3.00"), (ada, "7.25"))
+        ]
+
+    def export(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        parts = list(response.streaming_content)
+        return response, b"".join(parts).decode(), parts
+
+    def test_ndjson(self):
+        response, content, _ = self.export(
+            "/export/orders?customerName=ada&orderBy=-totalAmount"
+        )
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="orders.ndjson"'
+        )
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(
+            [(row["id"], row["customer_name"], row["total_amount"]) for row in rows],
+            [
+                (self.orders[0].pk, "Ada, Countess", "12.50"),
+                (self.orders[2].pk, "Ada, Countess", "7.25"),
+            ],
+        )
+        self.assertEqual(
+            list(rows[0]),
+            [
+                "id",
+                "customer_id",
+                "customer_name",
+                "customer_email",
+                "total_amount",
+                "order_date",
+                "created_at",
+                "updated_at",
+            ],
+        )
+
+    def test_csv(self):
+        response, content, _ = self.export("/export/customers?format=csv")
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(
+            rows[0], ["id", "name", "email", "phone", "created_at", "updated_at"]
+        )
+        # Quoted as needed, and in primary key order by default
+        self.assertEqual(
+            [row[1:3] for row in rows[1:]],
+            [["Ada, Countess", "ada@example.com"], ['Bob "B"', "bob@example.com"]],
+        )
+        self.assertIn('"Bob ""B"""', content)
+
+    @override_settings(CRM_EXPORT={"FLUSH_SIZE": 1})
+    def test_streams_in_parts(self):
+        _, content, parts = self.export("/export/orders")
+        # One part per row once a row fills the buffer
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(len(content.splitlines()), 3)
+
+    def test_errors(self):
+        for path, status in (
+            ("/export/invoices", 404),
+            ("/export/orders?format=xml", 400),
+            ("/export/orders?totalAmountGte=lots", 400),
+            ("/export/orders?orderBy=nope", 400),
+        ):
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, status)
+                self.assertTrue(response.json()["errors"])
+
+
+@override_settings(GRAPHQL_RESPONSE_CACHE={"ENABLED": True})
+class ResponseCacheTests(TestCase):
+    """Cached query responses are served until a write to a model they read"""
+
+    query = "{ allProducts(first: 5) { edges { node { name stock } } } }"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name="Widget", price=Decimal("5"), stock=1)
+
+    def setUp(self):
+        cache.clear()
+        response_cache.reset_stats()
+        self.addCleanup(cache.clear)
+        self.addCleanup(response_cache.reset_stats)
+
+    def stocks(self):
+        response = self.client.post(
+            "/graphql", {"query": self.query}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        edges = response.json()["data"]["allProducts"]["edges"]
+        return [edge["node"]["stock"] for edge in edges]
+
+    def counters(self):
+        stats = response_cache.stats()
+        return {name: stats[name] for name in ("hits", "misses", "stale", "lagged")}
+
+    def test_serves_repeated_queries_from_the_cache(self):
+        self.assertEqual(self.stocks(), [1])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.stocks(), [1])
+        self.assertEqual(
+            self.counters(), {"hits": 1, "misses": 1, "stale": 0, "lagged": 0}
+        )
+
+    def test_writes_invalidate_the_responses_that_read_the_model(self):
+        self.stocks()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(stock=7)
+        self.assertEqual(self.stocks(), [7])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Gadget", price=Decimal("5"), stock=2)
+        self.assertEqual(sorted(self.stocks()), [2, 7])
+        self.assertEqual(
+            self.counters(), {"hits": 0, "misses": 1, "stale": 2, "lagged": 0}
+        )
+        self.assertEqual(response_cache.stats()["invalidations"], {"crm.product": 2})
+
+    def test_writes_to_other_models_keep_the_responses(self):
+        self.stocks()
+        with self.captureOnCommitCallbacks(execute=True):
+            Customer.objects.create(name="Ada", email="ada@example.com")
+        self.assertEqual(self.stocks(), [1])
+        self.assertEqual(self.counters()["hits"], 1)
+
+    @override_settings(CRM_REPLICAS={"READ_ALIASES": ["default"], "PIN_SECONDS": 5})
+    def test_replica_reads_right_after_a_write_are_not_stored(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(stock=7)
+        # The replica may not have the write yet, so the result isn't cached
+        self.assertEqual(self.stocks(), [7])
+        self.assertEqual(self.stocks(), [7])
+        self.assertEqual(
+            self.counters(), {"hits": 0, "misses": 2, "stale": 0, "lagged": 2}
+        )
+
+
+@override_settings(CRM_REPLICAS={"READ_ALIASES": ["replica1"], "PIN_SECONDS": 5})
+class ReplicaRoutingTests(TestCase):
+    """Queries read from replicas unless the client wrote within PIN_SECONDS"""
+
+    router = ReplicaRouter()
+
+    def request(self, cookie=None):
+        request = RequestFactory().post("/graphql")
+        if cookie is not None:
+            request.COOKIES["crm_primary_until"] = cookie
+        return request
+
+    def test_queries_read_from_a_replica(self):
+        request = self.request()
+        with route_operation(request, False) as alias:
+            self.assertEqual(alias, "replica1")
+            self.assertEqual(self.router.db_for_read(Product), "replica1")
+            self.assertEqual(self.router.db_for_write(Product), "default")
+        self.assertEqual(self.router.db_for_read(Product), "default")
+        self.assertEqual(replica_lag(request), 5)
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        request = self.request()
+        with route_operation(request, True) as alias:
+            self.assertIsNone(alias)
+            self.assertEqual(self.router.db_for_read(Product), "default")
+        # Later operations of the same request read from the primary
+        self.assertIsNone(choose_read_alias(request))
+
+        cookie = set_pin_cookie(request, HttpResponse()).cookies["crm_primary_until"]
+        self.assertEqual(cookie["max-age"], 5)
+        self.assertTrue(cookie["httponly"])
+        self.assertAlmostEqual(float(cookie.value), time.time() + 5, delta=1)
+
+        # and so do the client's next requests, until the cookie expires
+        request = self.request(cookie.value)
+        self.assertIsNone(choose_read_alias(request))
+        self.assertEqual(replica_lag(request), 0)
+        expired = self.request(f"{time.time() - 1:.3f}")
+        self.assertEqual(choose_read_alias(expired), "replica1")
+
+    def test_ignores_malformed_cookies(self):
+        self.assertEqual(choose_read_alias(self.request("soon")), "replica1")
+
+    def test_queries_read_the_primary_after_a_mutation(self):
+        response = self.client.post(
+            "/graphql",
+            {
+                "query": 'mutation { createCustomer(input: {name: "Ada",'
+                ' email: "ada@example.com"}) { success } }'
+            },
+            content_type="application/json",
+        )
+        self.assertTrue(response.json()["data"]["createCustomer"]["success"])
+        self.assertIn("crm_primary_until", response.cookies)
+
+        # The test client sends the cookie back; "replica1" doesn't exist, so
+        # the query only succeeds on the primary
+        response = self.client.post(
+            "/graphql",
+            {"query": "{ allCustomers { edges { node { name } } } }"},
+            content_type="application/json",
+        )
+        self.assertEqual(
+            response.json()["data"],
+            {"allCustomers": {"edges": [{"node": {"name": "Ada"}}]}},
+        )
+        self.assertNotIn("crm_primary_until", response.cookies)
+
+
+class GenerateDataTests(TestCase):
+    """generate_data builds the same dataset from the same seed and options"""
+
+    options = [
+        "--customers=30",
+        "--products=10",
+        "--orders=60",
+        "--chunk-size=25",
+        "--end=2025-01-01",
+    ]
+
+    def generate(self, *options):
+        call_command("generate_data", *self.options, *options, stdout=io.StringIO())
+        return {
+            "customers": list(
+                Customer.objects.order_by("pk").values_list(
+                    "pk", "name", "email", "phone", "created_at"
+                )
+            ),
+            "products": list(
+                Product.objects.order_by("pk").values_list(
+                    "pk", "name", "price", "stock", "created_at"
+                )
+            ),
+            "orders": list(
+                Order.objects.order_by("pk").values_list(
+                    "pk", "customer_id", "total_amount", "order_date"
+                )
+            ),
+            "items": list(
+                OrderItem.objects.order_by("order_id", "product_id").values_list(
+                    "order_id", "product_id", "quantity", "unit_price"
+                )
+            ),
+        }
+
+    def test_same_seed_same_data(self):
+        first = self.generate("--seed=7")
+        self.assertEqual(
+            {table: len(rows) for table, rows in first.items() if table != "items"},
+            {"customers": 30, "products": 10, "orders": 60},
+        )
+        self.assertEqual(self.generate("--seed=7", "--clear"), first)
+        self.assertNotEqual(self.generate("--seed=8", "--clear"), first)
+
+    def test_orders_are_consistent(self):
+        data = self.generate()
+        end = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        prices = {pk: price for pk, _, price, _, _ in data["products"]}
+        totals = {}
+        for order_id, product_id, quantity, unit_price in data["items"]:
+            self.assertEqual(unit_price, prices[product_id])
+            totals[order_id] = totals.get(order_id, 0) + quantity * unit_price
+        for pk, _, total_amount, order_date in data["orders"]:
+            self.assertEqual(total_amount, totals[pk])
+            self.assertLess(order_date, end)
+            self.assertGreaterEqual(order_date, end - datetime.timedelta(days=730))
+
+    def test_refuses_to_add_to_existing_rows(self):
+        self.generate()
+        with self.assertRaisesMessage(CommandError, "pass --clear"):
+            self.generate()
@@ -0,0 +1,381 @@
+import bisect
+import contextvars
+import inspect
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.utils import timezone
+from graphql import get_named_type, is_leaf_type
+
+from .document_cache import document_cache
+from .response_cache import response_cache
+from .sqlite import write_queue
+
+DEFAULT_SETTINGS = {
+    # Request header asking for per-resolver timings in the response extensions
+    "HEADER": "X-GraphQL-Tracing",
+    # Whether the header is honoured at all
+    "EXTENSIONS": False,
+    # Aggregate object and list fields of every operation into histograms
+    "METRICS": False,
+    # Histogram upper bounds: seconds, SQL queries and returned items
+    "DURATION_BUCKETS": [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5],
+    "QUERY_COUNT_BUCKETS": [0, 1, 2, 5, 10, 25, 50, 100],
+    "RESULT_SIZE_BUCKETS": [0, 1, 10, 100, 1000, 10000],
+}
+
+# FieldTrace of the resolver running in the current thread or task
+_current_field = contextvars.ContextVar("current_field", default=None)
+
+
+def get_tracing_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, "GRAPHQL_TRACING", {})}
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper charging queries to the running resolver"""
+    field = _current_field.get()
+    if field is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter_ns()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        field.sql_queries += 1
+        field.sql_duration += time.perf_counter_ns() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver adding record_query to the connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def result_size(result):
+    """Number of items a resolver returned: edges, rows or a single object"""
+    if result is None:
+        return 0
+    edges = getattr(result, "edges", None)
+    if edges is not None:
+        return len(edges)
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+class FieldTrace:
+    """Timing, SQL and size of one resolver call"""
+
+    __slots__ = (
+        "path",
+        "parent_type",
+        "field_name",
+        "return_type",
+        "start_offset",
+        "duration",
+        "sql_queries",
+        "sql_duration",
+        "result_size",
+    )
+
+    def __init__(self, info, start_offset):
+        self.path = info.path.as_list()
+        self.parent_type = info.parent_type.name
+        self.field_name = info.field_name
+        self.return_type = str(info.return_type)
+        self.start_offset = start_offset
+        self.duration = 0
+        self.sql_queries = 0
+        self.sql_duration = 0
+        self.result_size = 0
+
+    def as_apollo(self):
+        return {
+            "path": self.path,
+            "parentType": self.parent_type,
+            "fieldName": self.field_name,
+            "returnType": self.return_type,
+            "startOffset": self.start_offset,
+            "duration": self.duration,
+            "sqlQueries": self.sql_queries,
+            "sqlDuration": self.sql_duration,
+            "resultSize": self.result_size,
+        }
+
+
+class OperationTrace:
+    """Resolver traces of one GraphQL operation
+
+    detailed traces every field for the response extensions; otherwise only
+    object and list fields, where the database work happens, are timed for
+    the histograms.
+    """
+
+    def __init__(self, detailed=False, metrics=None):
+        self.detailed = detailed
+        self.metrics = metrics
+        self.start_time = timezone.now()
+        self.start = time.perf_counter_ns()
+        self.end_time = None
+        self.resolvers = []
+
+    def should_trace(self, info):
+        if self.detailed:
+            return True
+        return not info.field_name.startswith("__") and not is_leaf_type(
+            get_named_type(info.return_type)
+        )
+
+    def start_field(self, info):
+        return FieldTrace(info, time.perf_counter_ns() - self.start)
+
+    def finish_field(self, field, result):
+        field.duration = time.perf_counter_ns() - self.start - field.start_offset
+        field.result_size = result_size(result)
+        if self.detailed:
+            self.resolvers.append(field)
+        if self.metrics is not None:
+            self.metrics.observe(field)
+
+    def finish(self):
+        self.end_time = timezone.now()
+        self.duration = time.perf_counter_ns() - self.start
+
+    def as_apollo(self):
+        """The trace in the Apollo tracing extension format"""
+        return {
+            "version": 1,
+            "startTime": self.start_time.isoformat(),
+            "endTime": self.end_time.isoformat(),
+            "duration": self.duration,
+            "execution": {
+                "resolvers": [field.as_apollo() for field in self.resolvers]
+            },
+        }
+
+
+class TracingMiddleware:
+    """Graphene middleware timing resolvers into an OperationTrace"""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def resolve(self, next, root, info, **args):
+        trace = self.trace
+        if not trace.should_trace(info):
+            return next(root, info, **args)
+
+        field = trace.start_field(info)
+        token = _current_field.set(field)
+        try:
+            result = next(root, info, **args)
+            if inspect.isawaitable(result):
+                return self.resolve_async(field, result)
+            if isinstance(result, QuerySet):
+                # Evaluated when the list is completed, after this returns
+                return TracedRows(trace, field, result)
+        except Exception:
+            trace.finish_field(field, None)
+            raise
+        finally:
+            _current_field.reset(token)
+        trace.finish_field(field, result)
+        return result
+
+    async def resolve_async(self, field, awaitable):
+        token = _current_field.set(field)
+        result = None
+        try:
+            result = await awaitable
+            return result
+        finally:
+            _current_field.reset(token)
+            self.trace.finish_field(field, result)
+
+
+class TracedRows:
+    """A resolver's QuerySet result, traced when graphql-core iterates it
+
+    The rows are fetched when they would have been without tracing, and
+    their SQL is charged to the field that returned them.
+    """
+
+    def __init__(self, trace, field, queryset):
+        self.trace = trace
+        self.field = field
+        self.queryset = queryset
+
+    def __iter__(self):
+        token = _current_field.set(self.field)
+        try:
+            rows = list(self.queryset)
+        except Exception:
+            self.trace.finish_field(self.field, None)
+            raise
+        finally:
+            _current_field.reset(token)
+        self.trace.finish_field(self.field, rows)
+        return iter(rows)
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus exposition model"""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class TracingMetrics:
+    """Per-field histograms of resolver time, SQL queries, SQL time and result size"""
+
+    # (metric name, help text, bucket setting)
+    METRICS = (
+        (
+            "graphql_resolver_duration_seconds",
+            "Resolver wall time",
+            "DURATION_BUCKETS",
+        ),
+        (
+            "graphql_resolver_sql_queries",
+            "SQL queries per resolver call",
+            "QUERY_COUNT_BUCKETS",
+        ),
+        (
+            "graphql_resolver_sql_duration_seconds",
+            "SQL time per resolver call",
+            "DURATION_BUCKETS",
+        ),
+        (
+            "graphql_resolver_result_size",
+            "Items returned per resolver call",
+            "RESULT_SIZE_BUCKETS",
+        ),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fields = {}
+
+    def observe(self, field):
+        key = f"{field.parent_type}.{field.field_name}"
+        values = (
+            field.duration / 1e9,
+            field.sql_queries,
+            field.sql_duration / 1e9,
+            field.result_size,
+        )
+        with self._lock:
+            histograms = self._fields.get(key)
+            if histograms is None:
+                tracing_settings = get_tracing_settings()
+                histograms = self._fields[key] = [
+                    Histogram(tracing_settings[buckets])
+                    for _, _, buckets in self.METRICS
+                ]
+            for histogram, value in zip(histograms, values):
+                histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._fields.clear()
+
+    def render(self):
+        """The histograms in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for index, (name, description, _) in enumerate(self.METRICS):
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histograms in sorted(self._fields.items()):
+                    lines.extend(histograms[index].render(name, f'field="{key}"'))
+        return lines
+
+
+# Shared by every GraphQL view in the process
+tracing_metrics = TracingMetrics()
+
+
+def start_trace(request):
+    """Return the OperationTrace for a request, or None when tracing is off"""
+    tracing_settings = get_tracing_settings()
+    detailed = bool(
+        tracing_settings["EXTENSIONS"]
+        and request.headers.get(tracing_settings["HEADER"])
+    )
+    metrics = tracing_metrics if tracing_settings["METRICS"] else None
+    if not detailed and metrics is None:
+        return None
+    return OperationTrace(detailed, metrics)
+
+
+def _counter(lines, name, description, value, labels=""):
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} counter")
+    lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+
+def render_metrics():
+    """Resolver histograms plus cache and write queue counters"""
+    lines = tracing_metrics.render()
+
+    stats = document_cache.stats()
+    for counter in ("hits", "misses", "evictions"):
+        _counter(
+            lines,
+            f"graphql_document_cache_{counter}_total",
+            f"Document cache {counter}",
+            stats[counter],
+        )
+
+    stats = response_cache.stats()
+    for counter in ("hits", "misses", "stale", "fills"):
+        _counter(
+            lines,
+            f"graphql_response_cache_{counter}_total",
+            f"Response cache {counter}",
+            stats[counter],
+        )
+    _counter(
+        lines,
+        "graphql_response_cache_fill_seconds_total",
+        "Time spent executing queries to fill the response cache",
+        stats["avg_fill_ms"] * stats["fills"] / 1000,
+    )
+    lines.append(
+        "# HELP graphql_response_cache_invalidations_total Tag invalidations per model"
+    )
+    lines.append("# TYPE graphql_response_cache_invalidations_total counter")
+    for tag, count in sorted(stats["invalidations"].items()):
+        lines.append(
+            f'graphql_response_cache_invalidations_total{{tag="{tag}"}} {count}'
+        )
+
+    stats = write_queue.stats()
+    for counter in ("submitted", "timeouts"):
+        _counter(
+            lines,
+            f"crm_sqlite_write_queue_{counter}_total",
+            f"Mutations {counter} to the SQLite write queue",
+            stats[counter],
+        )
+    return "\n".join(lines) + "\n"
@@ -1,3 +1,689 @@
-from django.shortcuts import render
+import asyncio
+import inspect
+import json
+import time
+from contextlib import nullcontext
+from functools import partial
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.http.response import HttpResponseBadRequest
+from django.utils.cache import patch_cache_control
+from django.views import View
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import (
+    ExecutionResult,
+    MiddlewareManager,
+    OperationType,
+    execute,
+    get_operation_ast,
+    parse,
+    validate_schema,
+)
+from graphql.validation import validate
+
+from .batching import BatchEntry, get_batch_settings, run_parallel, split_batch
+from .cost import QueryCost, QueryCostError
+from .document_cache import document_cache
+from .exports import (
+    ExportError,
+    astream_rows,
+    build_export,
+    get_export_settings,
+    stream_rows,
+)
+from .loaders import get_context_loaders
+from .persisted_queries import (
+    PersistedQueryError,
+    get_persisted_query_settings,
+    resolve_persisted_query,
+)
+from .response_cache import response_cache
+from .routers import replica_lag, route_operation, set_pin_cookie
+from .slow_log import start_capture
+from .tracing import (
+    TracingMiddleware,
+    get_tracing_settings,
+    render_metrics,
+    start_trace,
+)
+
+
+class CRMGraphQLView(GraphQLView):
+    """GraphQL view with document caching, persisted queries and cost limits
+
+    A JSON array POSTed to the view is a batch of operations that share one
+    set of loaders; consecutive read operations run in parallel.
+    """
+
+    document_cache = document_cache
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            data = self.parse_body(request) if request.method == "POST" else None
+        except HttpError as e:
+            return self.error_response(request, e)
+
+        if isinstance(data, list):
+            response = self.get_batch_response(request, data)
+        else:
+            response = super().dispatch(request, *args, **kwargs)
+        return self.patch_response(request, response)
+
+    def error_response(self, request, error):
+        response = error.response
+        response["Content-Type"] = "application/json"
+        response.content = self.json_encode(
+            request, {"errors": [self.format_error(error)]}
+        )
+        return response
+
+    def parse_body(self, request):
+        # Parsed once per request: dispatch looks at it to detect batches
+        if not hasattr(self, "_parsed_body"):
+            self._parsed_body = self._parse_body(request)
+        return self._parsed_body
+
+    def _parse_body(self, request):
+        if self.batch or self.get_content_type(request) != "application/json":
+            return super().parse_body(request)
+
+        try:
+            data = json.loads(request.body.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            data = None
+        if isinstance(data, list):
+            self.check_batch_size(data)
+            return data
+        if isinstance(data, dict):
+            return data
+        return super().parse_body(request)
+
+    def check_batch_size(self, data):
+        max_size = get_batch_settings()["MAX_SIZE"]
+        if not data:
+            raise HttpError(
+                HttpResponseBadRequest("Received an empty list in the batch request.")
+            )
+        if len(data) > max_size:
+            raise HttpError(
+                HttpResponseBadRequest(
+                    f"Batch of {len(data)} operations exceeds the maximum of {max_size}."
+                )
+            )
+
+    def patch_response(self, request, response):
+        # Hash-only GET requests have stable URLs that intermediaries can cache
+        max_age = get_persisted_query_settings()["GET_MAX_AGE"]
+        if (
+            max_age
+            and request.method == "GET"
+            and response.status_code == 200
+            and getattr(request, "persisted_query", False)
+        ):
+            patch_cache_control(response, public=True, max_age=max_age)
+        return set_pin_cookie(request, response)
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(
+            request, data
+        )
+
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if extensions and isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except Exception:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+
+        query = resolve_persisted_query(query, extensions)
+        request.persisted_query = bool(
+            isinstance(extensions, dict) and extensions.get("persistedQuery")
+        )
+        return query, variables, operation_name, id
+
+    def get_response(self, request, data, show_graphiql=False):
+        try:
+            query, variables, operation_name, id = self.get_graphql_params(
+                request, data
+            )
+        except PersistedQueryError as e:
+            result = self.json_encode(request, {"errors": [e.formatted]})
+            return result, e.status_code
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        return self.format_execution_result(
+            request, execution_result, id, show_graphiql, batched=self.batch
+        )
+
+    def format_execution_result(
+        self, request, execution_result, id, show_graphiql=False, batched=False
+    ):
+        """Serialize an execution result, returning (body, status code)"""
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                set_rollback()
+                response["errors"] = [
+                    self.format_error(e) for e in execution_result.errors
+                ]
+
+            if execution_result.errors and any(
+                not getattr(e, "path", None) for e in execution_result.errors
+            ):
+                status_code = 400
+            else:
+                response["data"] = execution_result.data
+
+            if execution_result.extensions:
+                response["extensions"] = execution_result.extensions
+
+            if batched:
+                response["id"] = id
+                response["status"] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+        else:
+            result = None
+
+        return result, status_code
+
+    def get_document(self, query):
+        """Return (document, errors) for a query, parsing and validating on a cache miss"""
+        key = self.document_cache.key_for(query)
+        document = self.document_cache.get(key)
+        if document is not None:
+            return document, None
+
+        try:
+            document = parse(query)
+        except Exception as e:
+            return None, [e]
+
+        validation_errors = validate(
+            self.schema.graphql_schema,
+            document,
+            self.validation_rules,
+            graphene_settings.MAX_VALIDATION_ERRORS,
+        )
+        if validation_errors:
+            return None, validation_errors
+
+        self.document_cache.set(key, document)
+        return document, None
+
+    def prepare_execution(
+        self, request, query, variables, operation_name, show_graphiql=False
+    ):
+        """Parse, validate and cost a request before anything runs
+
+        Returns (document, operation_ast, cost, result); when document is
+        None the operation must not execute and result is returned instead.
+        """
+        if not query:
+            if show_graphiql:
+                return None, None, None, None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        schema = self.schema.graphql_schema
+
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            result = ExecutionResult(data=None, errors=schema_validation_errors)
+            return None, None, None, result
+
+        document, errors = self.get_document(query)
+        if errors:
+            return None, None, None, ExecutionResult(data=None, errors=errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None, None, None, None
+
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        cost = None
+        if operation_ast is not None:
+            try:
+                cost = QueryCost(schema, document, variables).analyze(operation_ast)
+            except QueryCostError as e:
+                return None, None, None, ExecutionResult(data=None, errors=[e])
+
+        return document, operation_ast, cost, None
+
+    def get_execute_options(self, request, variables, operation_name, trace=None):
+        execute_options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request),
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": self.get_traced_middleware(request, trace),
+        }
+        if self.execution_context_class:
+            execute_options["execution_context_class"] = self.execution_context_class
+        return execute_options
+
+    def get_traced_middleware(self, request, trace):
+        middleware = self.get_middleware(request)
+        if trace is None:
+            return middleware
+        # Innermost, so other middleware doesn't count towards resolver time
+        if isinstance(middleware, MiddlewareManager):
+            middleware = middleware.middlewares
+        return [*(middleware or []), TracingMiddleware(trace)]
+
+    def add_trace_extension(self, result, trace):
+        if trace is not None:
+            trace.finish()
+            if trace.detailed:
+                result.extensions = {
+                    **(result.extensions or {}),
+                    "tracing": trace.as_apollo(),
+                }
+        return result
+
+    def add_cost_extension(self, result, cost):
+        if cost is not None:
+            result.extensions = {
+                **(result.extensions or {}),
+                "cost": {"requested": cost[0], "depth": cost[1]},
+            }
+        return result
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        document, operation_ast, cost, result = self.prepare_execution(
+            request, query, variables, operation_name, show_graphiql
+        )
+        if document is None:
+            return result
+
+        result = self.execute_operation(
+            request, document, operation_ast, variables, operation_name
+        )
+        return self.add_cost_extension(result, cost)
+
+    def execute_operation(
+        self, request, document, operation_ast, variables, operation_name
+    ):
+        """Execute a prepared document, returning its ExecutionResult
+
+        Queries are answered from the response cache when it is enabled.
+        """
+        if not response_cache.is_cacheable(operation_ast):
+            return self.execute_uncached(
+                request, document, operation_ast, variables, operation_name
+            )
+
+        lookup = response_cache.lookup(
+            request, self.schema.graphql_schema, document, variables, operation_name
+        )
+        result = response_cache.get(lookup)
+        if result is None:
+            started = time.perf_counter()
+            result = self.execute_uncached(
+                request, document, operation_ast, variables, operation_name
+            )
+            response_cache.set(
+                lookup, result, time.perf_counter() - started, replica_lag(request)
+            )
+        return result
+
+    def execute_uncached(
+        self, request, document, operation_ast, variables, operation_name
+    ):
+        schema = self.schema.graphql_schema
+        trace = start_trace(request)
+        capture = start_capture()
+        try:
+            execute_options = self.get_execute_options(
+                request, variables, operation_name, trace
+            )
+
+            is_read = (
+                operation_ast is not None
+                and operation_ast.operation == OperationType.QUERY
+            )
+            with capture or nullcontext(), route_operation(request, not is_read):
+                if (
+                    operation_ast is not None
+                    and operation_ast.operation == OperationType.MUTATION
+                    and (
+                        graphene_settings.ATOMIC_MUTATIONS is True
+                        or connection.settings_dict.get("ATOMIC_MUTATIONS", False)
+                        is True
+                    )
+                ):
+                    with transaction.atomic():
+                        result = execute(schema, document, **execute_options)
+                        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                            transaction.set_rollback(True)
+                else:
+                    result = execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+        if capture is not None and capture.is_slow:
+            capture.report(document, operation_name, variables)
+        return self.add_trace_extension(result, trace)
+
+    def prepare_batch(self, request, data):
+        """Resolve, validate and cost every operation of a batch before any runs"""
+        entries = []
+        for item in data:
+            entry = BatchEntry()
+            entries.append(entry)
+            try:
+                if not isinstance(item, dict):
+                    raise HttpError(
+                        HttpResponseBadRequest("Batch entries must be JSON objects.")
+                    )
+                query, entry.variables, entry.operation_name, entry.id = (
+                    self.get_graphql_params(request, item)
+                )
+                entry.document, entry.operation_ast, entry.cost, entry.result = (
+                    self.prepare_execution(
+                        request, query, entry.variables, entry.operation_name
+                    )
+                )
+            except (HttpError, PersistedQueryError) as e:
+                entry.error = e
+        return entries
+
+    def execute_entry(self, request, entry):
+        result = self.execute_operation(
+            request,
+            entry.document,
+            entry.operation_ast,
+            entry.variables,
+            entry.operation_name,
+        )
+        return self.add_cost_extension(result, entry.cost)
+
+    def get_batch_response(self, request, data):
+        entries = self.prepare_batch(request, data)
+        max_workers = get_batch_settings()["MAX_WORKERS"]
+        # Created up front so parallel operations share a single cache
+        loaders = get_context_loaders(self.get_context(request))
+
+        for step in split_batch(entries):
+            results = run_parallel(
+                [partial(self.execute_entry, request, entry) for entry in step],
+                max_workers,
+            )
+            for entry, result in zip(step, results):
+                entry.result = result
+            if not step[0].is_read:
+                # Later operations must not see rows cached before the write
+                loaders.clear()
+
+        return self.get_batch_http_response(request, entries)
+
+    def get_batch_http_response(self, request, entries):
+        responses = []
+        for entry in entries:
+            if entry.error is not None:
+                status_code = getattr(entry.error, "status_code", None) or (
+                    entry.error.response.status_code
+                )
+                body = self.json_encode(
+                    request,
+                    {
+                        "errors": [self.format_error(entry.error)],
+                        "id": entry.id,
+                        "status": status_code,
+                    },
+                )
+                responses.append((body, status_code))
+            else:
+                responses.append(
+                    self.format_execution_result(
+                        request, entry.result, entry.id, batched=True
+                    )
+                )
+
+        return HttpResponse(
+            status=max(status_code for _, status_code in responses),
+            content="[{}]".format(",".join(body for body, _ in responses)),
+            content_type="application/json",
+        )
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """CRMGraphQLView for ASGI servers, executing queries on the event loop
+
+    Resolvers return awaitables here, so independent root fields and the
+    read operations of a batch resolve concurrently. GraphiQL and mutations,
+    which need serial transactional execution, go through the synchronous
+    view on a thread.
+    """
+
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ("get", "post"):
+                raise HttpError(
+                    HttpResponseNotAllowed(
+                        ["GET", "POST"], "GraphQL only supports GET and POST requests."
+                    )
+                )
+
+            data = self.parse_body(request)
+            if isinstance(data, list):
+                response = await self.get_batch_response_async(request, data)
+                return self.patch_response(request, response)
+
+            if self.graphiql and self.can_display_graphiql(request, data):
+                return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+
+            result, status_code = await self.get_response_async(request, data)
+            response = HttpResponse(
+                status=status_code, content=result, content_type="application/json"
+            )
+        except HttpError as e:
+            return self.error_response(request, e)
+        return self.patch_response(request, response)
+
+    async def get_response_async(self, request, data):
+        try:
+            # Persisted query registries may hit the database or cache
+            query, variables, operation_name, id = await sync_to_async(
+                self.get_graphql_params
+            )(request, data)
+        except PersistedQueryError as e:
+            result = self.json_encode(request, {"errors": [e.formatted]})
+            return result, e.status_code
+
+        execution_result = await self.execute_graphql_request_async(
+            request, data, query, variables, operation_name
+        )
+        return self.format_execution_result(request, execution_result, id, False)
+
+    async def execute_graphql_request_async(
+        self, request, data, query, variables, operation_name
+    ):
+        document, operation_ast, cost, result = self.prepare_execution(
+            request, query, variables, operation_name
+        )
+        if document is None:
+            return result
+
+        if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+            result = await sync_to_async(self.execute_operation)(
+                request, document, operation_ast, variables, operation_name
+            )
+        else:
+            result = await self.execute_query_async(
+                request, document, operation_ast, variables, operation_name
+            )
+        return self.add_cost_extension(result, cost)
+
+    async def execute_query_async(
+        self, request, document, operation_ast, variables, operation_name
+    ):
+        if not response_cache.is_cacheable(operation_ast):
+            return await self.execute_uncached_async(
+                request, document, variables, operation_name
+            )
+
+        lookup = await sync_to_async(response_cache.lookup)(
+            request, self.schema.graphql_schema, document, variables, operation_name
+        )
+        result = await sync_to_async(response_cache.get)(lookup)
+        if result is None:
+            started = time.perf_counter()
+            result = await self.execute_uncached_async(
+                request, document, variables, operation_name
+            )
+            await sync_to_async(response_cache.set)(
+                lookup, result, time.perf_counter() - started, replica_lag(request)
+            )
+        return result
+
+    async def execute_uncached_async(
+        self, request, document, variables, operation_name
+    ):
+        trace = start_trace(request)
+        capture = start_capture()
+        try:
+            with capture or nullcontext(), route_operation(request, False):
+                result = execute(
+                    self.schema.graphql_schema,
+                    document,
+                    **self.get_execute_options(
+                        request, variables, operation_name, trace
+                    ),
+                )
+                if inspect.isawaitable(result):
+                    result = await result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+        if capture is not None and capture.is_slow:
+            # EXPLAIN runs queries, which the event loop thread must not
+            await sync_to_async(capture.report)(document, operation_name, variables)
+        return self.add_trace_extension(result, trace)
+
+    async def execute_entry_async(self, request, entry):
+        result = await self.execute_query_async(
+            request,
+            entry.document,
+            entry.operation_ast,
+            entry.variables,
+            entry.operation_name,
+        )
+        return self.add_cost_extension(result, entry.cost)
+
+    async def get_batch_response_async(self, request, data):
+        entries = await sync_to_async(self.prepare_batch)(request, data)
+        loaders = get_context_loaders(self.get_context(request))
+
+        for step in split_batch(entries):
+            if step[0].is_read:
+                results = await asyncio.gather(
+                    *[self.execute_entry_async(request, entry) for entry in step]
+                )
+            else:
+                results = [await sync_to_async(self.execute_entry)(request, step[0])]
+                # Later operations must not see rows cached before the write
+                loaders.clear()
+            for entry, result in zip(step, results):
+                entry.result = result
+
+        return self.get_batch_http_response(request, entries)
+
+
+class ExportView(View):
+    """Stream a filtered table as NDJSON or CSV
+
+    Accepts the same filter arguments as the matching GraphQL connection plus
+    ``format`` and ``orderBy``. Rows are read in chunks from a values()
+    queryset and encoded as they arrive, so memory stays flat for any size.
+    """
+
+    http_method_names = ["get", "head", "options"]
+
+    def get(self, request, resource):
+        try:
+            queryset, encoder = build_export(resource, request.GET)
+        except ExportError as e:
+            return JsonResponse({"errors": e.errors}, status=e.status)
+
+        export_settings = get_export_settings()
+        rows = queryset.iterator(chunk_size=export_settings["CHUNK_SIZE"])
+        return self.streaming_response(
+            stream_rows(rows, encoder, export_settings["FLUSH_SIZE"]),
+            resource,
+            encoder,
+        )
+
+    def streaming_response(self, content, resource, encoder):
+        response = StreamingHttpResponse(content, content_type=encoder.content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="{resource}.{encoder.extension}"'
+        )
+        return response
+
+
+class AsyncExportView(ExportView):
+    """Export view for ASGI servers
+
+    Django buffers synchronous streaming content in full under ASGI, so rows
+    come from the async ORM iterator instead.
+    """
+
+    async def get(self, request, resource):
+        try:
+            queryset, encoder = build_export(resource, request.GET)
+        except ExportError as e:
+            return JsonResponse({"errors": e.errors}, status=e.status)
+
+        export_settings = get_export_settings()
+        rows = queryset.aiterator(chunk_size=export_settings["CHUNK_SIZE"])
+        return self.streaming_response(
+            astream_rows(rows, encoder, export_settings["FLUSH_SIZE"]),
+            resource,
+            encoder,
+        )
+
+
+def metrics_view(request):
+    """Resolver histograms and cache counters for Prometheus to scrape"""
+    # Not served unless metrics are collected
+    if not get_tracing_settings()["METRICS"]:
+        raise Http404
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -78,13 +79,27 @@ WSGI_APPLICATION = 'alx_backend_graphql_crm.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuning applied to every connection by crm.sqlite: 'performance' (WAL,
+# synchronous=NORMAL, mmap and a larger page cache, persistent connections and
+# mutations funnelled through one writer thread) or 'default' (SQLite's own)
+CRM_SQLITE_PROFILE = os.environ.get('CRM_SQLITE_PROFILE', 'default')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections, with their page cache and mmap, across requests
+        'CONN_MAX_AGE': 600 if CRM_SQLITE_PROFILE == 'performance' else 0,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+CRM_SQLITE = {
+    'PROFILE': CRM_SQLITE_PROFILE,
+    'PRAGMAS': {},
+    'WRITE_TIMEOUT': 30,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -13,7 +13,7 @@ from decimal import Decimal
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql_crm.settings')
 django.setup()
 
-from crm.models import Customer, Product, Order
+from crm.models import Customer, Product, Order, OrderItem
 
 
 def clear_database():
@@ -122,6 +122,15 @@ def create_products():
     return products
 
 
+def add_items(order, products):
+    """Add one unit of each product to an order and store its total"""
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product=product, unit_price=product.price)
+        for product in products
+    )
+    order.update_total()
+
+
 def create_orders(customers, products):
     """Create sample orders"""
     print("Creating orders...")
@@ -131,9 +140,7 @@ def create_orders(customers, products):
         customer=customers[0],  # Alice
         total_amount=Decimal('0')  # Will be calculated
     )
-    order1.products.set([products[0], products[1]])  # Laptop Pro, Wireless Mouse
-    order1.total_amount = order1.calculate_total()
-    order1.save()
+    add_items(order1, [products[0], products[1]])  # Laptop Pro, Wireless Mouse
     print(f"Created order #{order1.id} for {order1.customer.name} - ${order1.total_amount}")
     
     # Order 2: Bob buys keyboard and USB hub
@@ -141,9 +148,7 @@ def create_orders(customers, products):
         customer=customers[1],  # Bob
         total_amount=Decimal('0')
     )
-    order2.products.set([products[2], products[3]])  # Mechanical Keyboard, USB-C Hub
-    order2.total_amount = order2.calculate_total()
-    order2.save()
+    add_items(order2, [products[2], products[3]])  # Mechanical Keyboard, USB-C Hub
     print(f"Created order #{order2.id} for {order2.customer.name} - ${order2.total_amount}")
     
     # Order 3: Carol buys monitor and webcam
@@ -151,9 +156,7 @@ def create_orders(customers, products):
         customer=customers[2],  # Carol
         total_amount=Decimal('0')
     )
-    order3.products.set([products[4], products[5]])  # Monitor 27", Webcam HD
-    order3.total_amount = order3.calculate_total()
-    order3.save()
+    add_items(order3, [products[4], products[5]])  # Monitor 27", Webcam HD
     print(f"Created order #{order3.id} for {order3.customer.name} - ${order3.total_amount}")
     
     # Order 4: David buys multiple items
@@ -161,9 +164,7 @@ def create_orders(customers, products):
         customer=customers[3],  # David
         total_amount=Decimal('0')
     )
-    order4.products.set([products[1], products[2], products[6]])  # Mouse, Keyboard, Desk Lamp
-    order4.total_amount = order4.calculate_total()
-    order4.save()
+    add_items(order4, [products[1], products[2], products[6]])  # Mouse, Keyboard, Desk Lamp
     print(f"Created order #{order4.id} for {order4.customer.name} - ${order4.total_amount}")
     
     # Order 5: Eva buys headphones
@@ -171,9 +172,7 @@ def create_orders(customers, products):
         customer=customers[4],  # Eva
         total_amount=Decimal('0')
     )
-    order5.products.set([products[7]])  # Bluetooth Headphones
-    order5.total_amount = order5.calculate_total()
-    order5.save()
+    add_items(order5, [products[7]])  # Bluetooth Headphones
     print(f"Created order #{order5.id} for {order5.customer.name} - ${order5.total_amount}")
 
 
@@ -15,7 +15,7 @@ from django.db import models
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql_crm.settings')
 django.setup()
 
-from crm.models import Customer, Product, Order
+from crm.models import Customer, Product, Order, OrderItem
 
 
 def test_basic_queries():
@@ -142,7 +142,10 @@ def test_mutations():
                 customer=customer,
                 total_amount=total_amount
             )
-            order.products.set(products)
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product=product, unit_price=product.price)
+                for product in products
+            )
             
             print(f"   - Created order #{order.id} for {order.customer.name} - ${order.total_amount}")
             